@@ -1,2 +1,23 @@
-from .models import *
-from .routes import *
+import importlib
+from typing import Any
+
+# Resolved on first attribute access, see app/services/__init__.py
+_EXPORTS = {
+    "TransformResponse": ".models",
+    "BatchItemResult": ".models",
+    "ImageTransformRouter": ".routes",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -2,6 +2,16 @@ from typing import Union, List
 from pydantic import BaseModel
 
 
+class ObjectResult(BaseModel):
+    image_url: Union[str, None] = None
+    image_bytes: Union[str, None] = None
+    description: Union[str, None] = None
+    toy_description: Union[str, None] = None
+    main_object: Union[str, None] = None
+    box_xyxy: List[float]
+    score: Union[float, None] = None
+
+
 class TransformResponse(BaseModel):
     success: bool
     image_url: Union[str, None] = None
@@ -11,3 +21,11 @@ class TransformResponse(BaseModel):
     main_object: Union[str, None] = None
     detected_objects: Union[List[str], None] = None
     error: Union[str, None] = None
+    # Every object, best first, when several were requested
+    objects: Union[List[ObjectResult], None] = None
+
+
+class BatchItemResult(TransformResponse):
+    index: int
+    filename: str
+    elapsed: Union[float, None] = None
@@ -1,28 +1,71 @@
 import os
+import io
+import json
+import hashlib
 import time
+import asyncio
 import logging
-from fastapi import APIRouter, File, UploadFile, HTTPException, Request
-from fastapi.responses import FileResponse
+import uuid
+import zipfile
+from typing import List, Tuple, Union
+from fastapi import (
+    APIRouter,
+    File,
+    UploadFile,
+    HTTPException,
+    Query,
+    Request,
+    Response,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    PlainTextResponse,
+    StreamingResponse,
+)
 from fastapi.templating import Jinja2Templates
 from pathlib import Path
-import aiofiles
-from datetime import datetime
+from datetime import datetime, timezone
 
 from ..core.logging import setup_logging
+from ..services.artifact_store import MEDIA_TYPES
 from ..services.image_processor import ImageProcessor
+from ..services.live_stream import LiveSession
+from ..core.admission import ImageTooLarge
 from ..core.config import ConfigHandler
-from ..api.models import TransformResponse
+from ..core.deadline import Deadline, DeadlineExceeded
+from ..core.metrics import metrics
+from ..core.prefork import process_memory
+from ..core.profiler import ProfilerBusy, profiler
+from ..core.tracing import tracer
+from ..api.models import BatchItemResult, TransformResponse
 
 
 # Set up logging with more detailed configuration
-logger = setup_logging()
+logger = setup_logging(**ConfigHandler().get_logging_config())
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
 
 
 class ImageTransformRouter:
-    def __init__(self):
-        self.router = APIRouter()
+    def __init__(self, started_at: Union[float, None] = None):
+        """
+        `started_at` is the `time.perf_counter()` reading at process start, used to
+        report time-to-listen and time-to-ready.
+        """
+        self.router = APIRouter(on_startup=[self.startup])
         self.config = ConfigHandler()
-        self.processor = ImageProcessor(self.config)
+        self.started_at = time.perf_counter() if started_at is None else started_at
+
+        # Models are loaded in the startup phase (or on first use), not at import
+        self.processor = ImageProcessor(self.config, lazy=True)
+        self.model_loading = self.config.get_api_config().get(
+            "model_loading", "background"
+        )
+        self.warmup = self.config.get_api_config().get("warmup", True)
         self.templates = Jinja2Templates(
             directory=Path(__file__).parent.parent / "templates"
         )
@@ -30,12 +73,6 @@ class ImageTransformRouter:
         # Setup routes
         self._setup_routes()
 
-        self.upload_dir = Path(self.config.get_storage_config()["upload_dir"])
-        self.upload_dir.mkdir(exist_ok=True)
-
-        self.output_dir = Path(self.config.get_storage_config()["output_dir"])
-        self.output_dir.mkdir(exist_ok=True)
-
         self.log_dir = Path(self.config.get_storage_config()["log_dir"])
         self.log_dir.mkdir(exist_ok=True)
 
@@ -43,37 +80,79 @@ class ImageTransformRouter:
             "max_file_size", 10 * 1024 * 1024
         )
 
-        self.max_upload_storage = self.config.get_storage_config().get(
-            "max_upload_storage", 30
+        self.gallery_size = self.config.get_storage_config().get("gallery_size", 50)
+        self.max_batch_files = self.config.get_batch_config().get("max_files", 500)
+        self.max_batch_bytes = self.config.get_batch_config().get(
+            "max_total_size", 1024 * 1024 * 1024
+        )
+        self.max_objects = self.config.get_multi_object_config().get("max_objects", 5)
+
+        self.tenant_header = self.config.get_scheduler_config().get(
+            "tenant_header", "X-API-Key"
+        )
+        self.deadline_header = self.config.get_api_config().get(
+            "deadline_header", "X-Request-Timeout"
+        )
+        self.disconnect_poll_interval = self.config.get_api_config().get(
+            "disconnect_poll_interval", 0.5
         )
 
+        tracing_config = dict(self.config.get_tracing_config())
+        self.trace_header = tracing_config.pop("force_header", "X-Trace")
+        tracer.configure(**tracing_config)
+        self.admin_config = self.config.get_admin_config()
+
+        self.live_config = self.config.get_live_config()
+        self.live_sessions = 0
+
     def _setup_routes(self):
         """Initialize all routes"""
         self.router.get("/")(self.index)
         self.router.get("/logs")(self.get_logs)
         self.router.get("/gallery")(self.get_gallery)
-        self.router.get("/images/{file_path:path}")(self.get_image)
+        self.router.get("/artifacts/{artifact_id}")(self.get_artifact)
         self.router.post("/transform")(self.transform_image)
+        self.router.post("/transform/batch")(self.transform_batch)
+        self.router.websocket("/live")(self.live_stream)
+        self.router.get("/upload-limits")(self.get_upload_limits)
         self.router.get("/health")(self.health_check)
+        self.router.get("/ready")(self.readiness_check)
+        self.router.get("/metrics")(self.get_metrics)
+        self.router.get("/admin/traces")(self.list_traces)
+        self.router.get("/admin/traces/{trace_id}")(self.get_trace)
+        self.router.post("/admin/profile")(self.run_profiler)
+
+    async def startup(self):
+        """
+        Loads the models according to `api.model_loading`:
+        - eager: load and warm up before the server starts listening
+        - background: start listening immediately, load and warm up in a task
+        - lazy: load on the first request that needs the models
+        """
+        if self.model_loading == "eager":
+            await self._load_models()
+        elif self.model_loading == "background":
+            self._loading_task = asyncio.create_task(self._load_models())
+
+        logger.log(
+            logging.INFO,
+            "Time to listen: %.2fs (model loading: %s)",
+            time.perf_counter() - self.started_at,
+            self.model_loading,
+        )
 
-    async def save_upload_file(self, upload_file: UploadFile) -> Path:
-        # Limit number of files in upload directory by deleting the oldest file
-        files = list(self.upload_dir.iterdir())
-        if len(files) > self.max_upload_storage:
-            oldest_file = min(files, key=lambda p: p.stat().st_ctime)
-            logger.log(logging.INFO, f"Deleting oldest file: {oldest_file}")
-            oldest_file.unlink()
-
-        file_path = self.upload_dir / os.path.basename(upload_file.filename)
-
-        async with aiofiles.open(file_path, "wb") as out_file:
-            while content := await upload_file.read(1024):  # Read in chunks
-                await out_file.write(content)
-
-        # Reset file pointer to beginning
-        await upload_file.seek(0)
+    async def _load_models(self):
+        try:
+            await asyncio.shield(self.processor.start_loading(warmup=self.warmup))
+        except Exception as e:
+            logger.log(logging.ERROR, "Error loading models: %s", e)
+            return
 
-        return file_path
+        logger.log(
+            logging.INFO,
+            "Time to ready: %.2fs",
+            time.perf_counter() - self.started_at,
+        )
 
     async def index(self, request: Request):
         """Render main page"""
@@ -127,102 +206,560 @@ class ImageTransformRouter:
                 },
             )
         except Exception as e:
-            logger.log(logging.ERROR, f"Error accessing logs: {str(e)}")
+            logger.log(logging.ERROR, "Error accessing logs: %s", e)
             raise HTTPException(status_code=500, detail=str(e))
 
     async def get_gallery(self, request: Request):
         """Display a gallery of uploaded and transformed images side-by-side."""
         try:
-            upload_path = self.upload_dir
-            output_path = self.output_dir
-
-            gallery_items = []
-            for upload_file in upload_path.iterdir():
-                if upload_file.is_file() and upload_file.suffix.lower() in (
-                    ".jpg",
-                    ".jpeg",
-                    ".png",
-                    ".webp",
-                ):
-                    output_file = output_path / upload_file.name
-                    upload_file = upload_path / output_file.name
-                    if output_file.exists() and upload_file.exists():
-                        gallery_items.append(
-                            {
-                                "upload_path": str(upload_file),
-                                "output_path": str(output_file),
-                            }
-                        )
+            records = await asyncio.to_thread(
+                self.processor.artifacts.records, self.gallery_size
+            )
+            gallery_items = [
+                {"upload": record["upload"], "output": record["output"]}
+                for record in records
+                if record.get("upload") and record.get("output")
+            ]
 
             return self.templates.TemplateResponse(
                 "gallery.html", {"request": request, "gallery_items": gallery_items}
             )
 
         except Exception as e:
-            logger.log(logging.ERROR, f"Error accessing gallery: {str(e)}")
+            logger.log(logging.ERROR, "Error accessing gallery: %s", e)
             raise HTTPException(status_code=500, detail=str(e))
 
-    async def get_image(self, file_path: str):
-        if Path(file_path).exists():
-            return FileResponse(file_path)
-        raise HTTPException(status_code=404, detail="Image not found")
+    async def get_artifact(self, request: Request, artifact_id: str):
+        """
+        A stored upload, mask, cutout or output. Artifacts are named by their content
+        hash and never change, so clients may cache them forever.
+        """
+        artifacts = self.processor.artifacts
+        try:
+            path = artifacts.path(artifact_id)
+        except ValueError:
+            raise HTTPException(status_code=404, detail="Artifact not found")
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="Artifact not found")
+
+        headers = {
+            "Cache-Control": "public, max-age=31536000, immutable",
+            "ETag": f'"{artifact_id}"',
+        }
+        if request.headers.get("if-none-match") == headers["ETag"]:
+            return Response(status_code=304, headers=headers)
+        media_type = MEDIA_TYPES[artifact_id.rsplit(".", 1)[-1]]
+        if artifacts.mmap_reads:
+            return StreamingResponse(
+                artifacts.iter_chunks(artifact_id),
+                media_type=media_type,
+                headers={**headers, "Content-Length": str(path.stat().st_size)},
+            )
+        return FileResponse(path, media_type=media_type, headers=headers)
 
-    async def transform_image(self, file: UploadFile = File(...)):
+    def _validate_profile(self, profile: Union[str, None]):
+        try:
+            self.processor.resolve_profile(profile)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def _tenant(self, request: Union[Request, WebSocket]) -> str:
+        """Scheduling tenant: a hash of the API key header, else the client IP."""
+        api_key = request.headers.get(self.tenant_header)
+        if api_key:
+            return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:12]
+        return f"ip:{request.client.host if request.client else 'unknown'}"
+
+    def _request_deadline(
+        self, request: Request, profile: Union[str, None]
+    ) -> Deadline:
+        """
+        The tighter of the client's budget (deadline header, in seconds) and the
+        profile timeout.
+        """
+        header = request.headers.get(self.deadline_header)
+        try:
+            client_timeout = float(header) if header is not None else None
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail=f"{self.deadline_header} must be a number of seconds",
+            )
+        profile_timeout = self.processor.resolve_profile(profile)["timeout"]
+        return Deadline.from_budget(client_timeout, profile_timeout)
+
+    async def _run_until_disconnect(self, request: Request, coro):
+        """
+        Runs `coro` as a task and cancels it, with all the Gemini calls and stages it
+        has in flight, as soon as the client goes away.
+        """
+        task = asyncio.create_task(coro)
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {task}, timeout=self.disconnect_poll_interval
+                )
+                if done:
+                    return task.result()
+                if await request.is_disconnected():
+                    logger.log(
+                        logging.WARNING, "Client disconnected, cancelling request"
+                    )
+                    metrics.inc("requests_cancelled", reason="client_disconnect")
+                    task.cancel()
+                    raise HTTPException(status_code=499, detail="Client disconnected")
+        finally:
+            task.cancel()
+
+    async def transform_image(
+        self,
+        request: Request,
+        response: Response,
+        file: UploadFile = File(...),
+        profile: Union[str, None] = Query(
+            None, description="Quality/latency profile, e.g. fast or quality"
+        ),
+        objects: int = Query(
+            1, ge=1, description="Number of detected objects to turn into toys"
+        ),
+    ):
         """Transform an uploaded image with comprehensive error handling"""
 
-        logger.log(logging.INFO, f"Received file: {file}")
+        with tracer.span(
+            "transform_image",
+            force=request.headers.get(self.trace_header) == "1",
+            filename=file.filename,
+            profile=profile,
+        ) as span:
+            if span is not None:
+                response.headers["X-Trace-Id"] = span.trace.trace_id
+            logger.log(logging.INFO, "Received file: %s, profile: %s", file, profile)
 
-        try:
-            # Validate file size
-            if file.size > self.MAX_FILE_SIZE:
+            try:
+                self._validate_profile(profile)
+                deadline = self._request_deadline(request, profile)
+                if objects > self.max_objects:
+                    raise HTTPException(
+                        status_code=400,
+                        detail=f"At most {self.max_objects} objects per image",
+                    )
+
+                # Validate file size
+                if file.size > self.MAX_FILE_SIZE:
+                    raise HTTPException(
+                        status_code=413,
+                        detail="File too large. Maximum size is "
+                        f"{self.MAX_FILE_SIZE / (1024 * 1024):.0f}MB",
+                    )
+
+                # Validate file type
+                if not file.content_type.startswith("image/"):
+                    raise HTTPException(
+                        status_code=415, detail="Uploaded file must be an image"
+                    )
+
+                # Process image
+                try:
+                    result = await self._run_until_disconnect(
+                        request,
+                        self.processor.process_image(
+                            file,
+                            profile=profile,
+                            deadline=deadline,
+                            max_objects=objects,
+                            tenant=self._tenant(request),
+                        ),
+                    )
+
+                    logger.log(
+                        logging.INFO,
+                        "Successfully transformed image: %s",
+                        file.filename,
+                    )
+
+                    return TransformResponse(
+                        success=True,
+                        image_bytes=result["image_bytes"],
+                        image_url=result["image_url"],
+                        description=result["description"],
+                        toy_description=result["toy_description"],
+                        main_object=result["main_object"],
+                        detected_objects=result["detected_objects"],
+                        objects=result.get("objects"),
+                    )
+
+                except HTTPException:
+                    raise
+                except DeadlineExceeded as deadline_error:
+                    raise HTTPException(status_code=504, detail=str(deadline_error))
+                except ImageTooLarge as size_error:
+                    raise HTTPException(status_code=413, detail=str(size_error))
+                except Exception as process_error:
+                    logger.log(
+                        logging.ERROR,
+                        "Error processing image: %s",
+                        process_error,
+                    )
+                    raise HTTPException(
+                        status_code=500,
+                        detail=f"Error processing image: {str(process_error)}",
+                    )
+
+            except HTTPException:
+                raise  # Re-raise HTTPException to return the error to the client
+            except Exception as e:
+                logger.log(logging.ERROR, "Unexpected error: %s", e)
                 raise HTTPException(
-                    status_code=413, detail="File too large. Maximum size is 10MB"
+                    status_code=500, detail="An unexpected error occurred"
                 )
 
-            # Validate file type
-            if not file.content_type.startswith("image/"):
+    def _expand_zip(
+        self, data: bytes, filename: str, max_files: int, max_bytes: int
+    ) -> List[Tuple[str, bytes]]:
+        """
+        Image entries of a zip archive. The entry count and the declared sizes are
+        checked against the limits before anything is decompressed, and each entry
+        is read with a cap in case its declared size is wrong.
+        """
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                entries = [
+                    info
+                    for info in archive.infolist()
+                    if not info.is_dir()
+                    and not Path(info.filename).name.startswith(".")
+                    and Path(info.filename).suffix.lower() in IMAGE_EXTENSIONS
+                ]
+                if len(entries) > max_files:
+                    raise HTTPException(
+                        status_code=413,
+                        detail="Too many images. Maximum per batch is "
+                        f"{self.max_batch_files}",
+                    )
+                for info in entries:
+                    if info.file_size > self.MAX_FILE_SIZE:
+                        raise HTTPException(
+                            status_code=413, detail=f"File too large: {info.filename}"
+                        )
+                if sum(info.file_size for info in entries) > max_bytes:
+                    raise HTTPException(
+                        status_code=413,
+                        detail="Batch too large. Maximum uncompressed size is "
+                        f"{self.max_batch_bytes / (1024 * 1024):.0f}MB",
+                    )
+
+                items = []
+                for info in entries:
+                    with archive.open(info) as entry:
+                        content = entry.read(self.MAX_FILE_SIZE + 1)
+                    if len(content) > self.MAX_FILE_SIZE:
+                        raise HTTPException(
+                            status_code=413, detail=f"File too large: {info.filename}"
+                        )
+                    items.append((Path(info.filename).name, content))
+                return items
+        except zipfile.BadZipFile:
+            raise HTTPException(
+                status_code=415, detail=f"Invalid zip archive: {filename}"
+            )
+
+    async def _read_batch_items(
+        self, files: List[UploadFile]
+    ) -> List[Tuple[str, bytes]]:
+        """Reads uploaded images and expands zip archives into (filename, data) items"""
+        items: List[Tuple[str, bytes]] = []
+        total_bytes = 0
+        for upload in files:
+            filename = os.path.basename(upload.filename or "") or (
+                f"upload-{uuid.uuid4().hex[:8]}"
+            )
+            data = await upload.read()
+            if len(data) > self.MAX_FILE_SIZE:
                 raise HTTPException(
-                    status_code=415, detail="Uploaded file must be an image"
+                    status_code=413, detail=f"File too large: {filename}"
                 )
 
-            # Save file
-            file_path = await self.save_upload_file(file)
-
-            # Process image
-            try:
-                result = await self.processor.process_image(file)
-
-                logger.log(
-                    logging.INFO,
-                    f"Successfully transformed image: {file.filename}",
+            is_zip = upload.content_type in (
+                "application/zip",
+                "application/x-zip-compressed",
+            ) or filename.lower().endswith(".zip")
+
+            if is_zip:
+                new_items = await asyncio.to_thread(
+                    self._expand_zip,
+                    data,
+                    filename,
+                    self.max_batch_files - len(items),
+                    self.max_batch_bytes - total_bytes,
                 )
-
-                return TransformResponse(
-                    success=True,
-                    image_bytes=result["image_bytes"],
-                    image_url=result["image_url"],
-                    description=result["description"],
-                    toy_description=result["toy_description"],
-                    main_object=result["main_object"],
-                    detected_objects=result["detected_objects"],
+            elif upload.content_type and upload.content_type.startswith("image/"):
+                new_items = [(filename, data)]
+            else:
+                raise HTTPException(
+                    status_code=415,
+                    detail=f"Uploaded file must be an image or zip archive: {filename}",
                 )
+            items.extend(new_items)
+            total_bytes += sum(len(content) for _, content in new_items)
 
-            except Exception as process_error:
-                logger.log(
-                    logging.ERROR,
-                    f"Error processing image: {str(process_error)}",
+            if len(items) > self.max_batch_files:
+                raise HTTPException(
+                    status_code=413,
+                    detail="Too many images. Maximum per batch is "
+                    f"{self.max_batch_files}",
                 )
+            if total_bytes > self.max_batch_bytes:
                 raise HTTPException(
-                    status_code=500,
-                    detail=f"Error processing image: {str(process_error)}",
+                    status_code=413,
+                    detail="Batch too large. Maximum uncompressed size is "
+                    f"{self.max_batch_bytes / (1024 * 1024):.0f}MB",
                 )
 
-        except HTTPException:
-            raise  # Re-raise HTTPException to return the error to the client
+        if not items:
+            raise HTTPException(status_code=400, detail="No images in batch")
+
+        return items
+
+    async def transform_batch(
+        self,
+        request: Request,
+        files: List[UploadFile] = File(...),
+        profile: Union[str, None] = Query(
+            None, description="Quality/latency profile, e.g. fast or quality"
+        ),
+    ):
+        """
+        Transform many images in one request. Accepts multiple image files and/or zip
+        archives and streams one NDJSON line per image as soon as it finishes. The
+        images are scheduled in the bulk lane.
+        """
+        self._validate_profile(profile)
+        items = await self._read_batch_items(files)
+        tenant = self._tenant(request)
+        logger.log(
+            logging.INFO, "Received batch of %s images from %s", len(items), tenant
+        )
+
+        async def stream_results():
+            succeeded = 0
+            async for item in self.processor.process_batch(
+                items, profile=profile, tenant=tenant
+            ):
+                succeeded += item["success"]
+                result = BatchItemResult(**item)
+                yield json.dumps(jsonable_encoder(result)) + "\n"
+            logger.log(
+                logging.INFO,
+                "Batch complete: %s/%s images transformed",
+                succeeded,
+                len(items),
+            )
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    async def live_stream(
+        self,
+        websocket: WebSocket,
+        profile: Union[str, None] = Query(
+            None, description="Quality/latency profile, e.g. fast or quality"
+        ),
+    ):
+        """
+        Live camera mode. The client sends frames (JPEG/PNG/WebP) as binary messages
+        and receives a `frame` message per processed frame with the tracked box, and
+        an `analysis` message with the descriptions and the toy image whenever a new
+        object has been analysed. Stale frames are dropped.
+        """
+        await websocket.accept()
+        try:
+            profile_config = self.processor.resolve_profile(
+                profile or self.live_config.get("profile")
+            )
+        except ValueError as e:
+            await websocket.close(code=1008, reason=str(e))
+            return
+
+        if self.live_sessions >= self.live_config.get("max_sessions", 32):
+            metrics.inc("live_sessions_rejected")
+            await websocket.close(code=1013, reason="Too many live sessions")
+            return
+
+        max_frame_size = self.live_config.get("max_frame_size", 4 * 1024 * 1024)
+
+        async def receive() -> bytes:
+            data = await websocket.receive_bytes()
+            if len(data) > max_frame_size:
+                raise ImageTooLarge(
+                    f"Frame too large. Maximum size is {max_frame_size} bytes"
+                )
+            return data
+
+        session = LiveSession(
+            self.processor,
+            profile_config,
+            session_id=uuid.uuid4().hex[:8],
+            tenant=self._tenant(websocket),
+            max_image_size=self.live_config.get("max_image_size", 640),
+            change_threshold=self.live_config.get("change_threshold", 0.04),
+            track_iou=self.live_config.get("track_iou", 0.3),
+            confirm_frames=self.live_config.get("confirm_frames", 2),
+            analysis_interval=self.live_config.get("analysis_interval", 5.0),
+        )
+        self.live_sessions += 1
+        metrics.set_gauge("live_sessions", self.live_sessions)
+        logger.log(
+            logging.INFO,
+            "Live session %s started, profile: %s",
+            session.session_id,
+            profile_config["name"],
+        )
+        try:
+            await self.processor.ensure_ready()
+            await session.run(receive, websocket.send_json)
+        except WebSocketDisconnect:
+            pass
+        except ImageTooLarge as e:
+            await websocket.close(code=1009, reason=str(e))
         except Exception as e:
-            logger.log(logging.ERROR, f"Unexpected error: {str(e)}")
-            raise HTTPException(status_code=500, detail="An unexpected error occurred")
+            logger.log(
+                logging.ERROR, "Live session %s failed: %s", session.session_id, e
+            )
+            metrics.inc("live_sessions_failed")
+            try:
+                await websocket.send_json({"type": "error", "detail": str(e)})
+                await websocket.close(code=1011)
+            except Exception:
+                pass  # the connection is gone already
+        finally:
+            self.live_sessions -= 1
+            metrics.set_gauge("live_sessions", self.live_sessions)
+            logger.log(
+                logging.INFO,
+                "Live session %s ended: %s frames processed, %s dropped",
+                session.session_id,
+                session.frames,
+                session.dropped,
+            )
+
+    async def get_upload_limits(
+        self,
+        profile: Union[str, None] = Query(
+            None, description="Quality/latency profile the image is uploaded for"
+        ),
+    ):
+        """
+        Size and format to reduce an image to before uploading it, no stage of the
+        profile uses more pixels.
+        """
+        self._validate_profile(profile)
+        upload_config = self.config.get_upload_config()
+        max_dimension = upload_config.get("max_dimension")
+        if not max_dimension:
+            max_dimension = self.processor.upload_dimension(
+                self.processor.resolve_profile(profile)
+            )
+        return JSONResponse(
+            {
+                "max_dimension": max_dimension,
+                "max_file_size": self.MAX_FILE_SIZE,
+                "formats": upload_config.get("formats", ["image/jpeg", "image/webp"]),
+                "quality": upload_config.get("quality", 0.9),
+                "min_resize_bytes": upload_config.get("min_resize_bytes", 1024 * 1024),
+            },
+            headers={"Cache-Control": "max-age=300"},
+        )
 
     async def health_check(self):
         """API health check endpoint"""
         return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+
+    async def get_metrics(self):
+        """Counters, gauges and latency summaries of this process"""
+        for name, value in process_memory().items():
+            metrics.set_gauge(f"process_memory_{name}_bytes", value)
+        return metrics.snapshot()
+
+    def _check_admin(self, request: Request):
+        token = os.environ.get(self.admin_config.get("token_env", "ADMIN_TOKEN"))
+        if token:
+            if request.headers.get("X-Admin-Token") != token:
+                raise HTTPException(status_code=403, detail="Invalid admin token")
+        elif request.client is None or request.client.host not in (
+            "127.0.0.1",
+            "::1",
+            "localhost",
+        ):
+            raise HTTPException(
+                status_code=403, detail="Admin endpoints are local only"
+            )
+
+    async def list_traces(self, request: Request):
+        """Recently sampled traces, newest first"""
+        self._check_admin(request)
+        return [
+            {
+                "trace_id": trace.trace_id,
+                "name": trace.root.name,
+                "start": datetime.fromtimestamp(
+                    trace.root.start_ns / 1e9, timezone.utc
+                ).isoformat(),
+                "duration_ms": trace.root.duration_ms,
+                "error": trace.root.error,
+                "spans": len(trace.spans),
+            }
+            for trace in reversed(tracer.recent)
+        ]
+
+    async def get_trace(
+        self,
+        request: Request,
+        trace_id: str,
+        format: str = Query("chrome", description="chrome or otlp"),
+    ):
+        """One trace in Chrome trace event format (Perfetto) or OTLP JSON"""
+        self._check_admin(request)
+        trace = tracer.get(trace_id)
+        if trace is None:
+            raise HTTPException(status_code=404, detail="Trace not found")
+        if format == "otlp":
+            return trace.to_otlp(tracer.service_name)
+        return trace.to_chrome()
+
+    async def run_profiler(
+        self,
+        request: Request,
+        seconds: float = Query(10, gt=0),
+        interval_ms: float = Query(5, ge=1),
+        include_idle: bool = Query(False),
+    ):
+        """
+        Samples the stacks of every thread for `seconds` and returns them in the
+        folded format, e.g. `flamegraph.pl profile.folded > profile.svg` or open in
+        speedscope.
+        """
+        self._check_admin(request)
+        max_seconds = self.admin_config.get("max_profile_seconds", 60)
+        if seconds > max_seconds:
+            raise HTTPException(
+                status_code=400, detail=f"seconds must be at most {max_seconds}"
+            )
+        logger.log(logging.INFO, "Sampling profiler started for %ss", seconds)
+        try:
+            counts = await asyncio.to_thread(
+                profiler.sample, seconds, interval_ms / 1000, include_idle
+            )
+        except ProfilerBusy as e:
+            raise HTTPException(status_code=409, detail=str(e))
+        return PlainTextResponse(profiler.folded(counts))
+
+    async def readiness_check(self):
+        """Readiness endpoint, 200 only once the models are loaded and warm"""
+        if not self.processor.ready:
+            return JSONResponse(
+                status_code=503,
+                content={
+                    "status": "loading" if self.processor.loaded else "starting",
+                    "timestamp": datetime.utcnow().isoformat(),
+                },
+            )
+        return {"status": "ready", "timestamp": datetime.utcnow().isoformat()}
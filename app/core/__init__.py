@@ -1,3 +1,33 @@
-from .config import *
-from .logging import *
-from .prompt_manager import *
+import importlib
+from typing import Any
+
+# Resolved on first attribute access, see app/services/__init__.py
+_EXPORTS = {
+    "ConfigHandler": ".config",
+    "Deadline": ".deadline",
+    "DeadlineExceeded": ".deadline",
+    # The shared registry is app.core.metrics.metrics, a `metrics` export would
+    # be shadowed by the submodule once it is imported
+    "MetricsRegistry": ".metrics",
+    "setup_logging": ".logging",
+    "safe_repr": ".logging",
+    "vn_time": ".logging",
+    "VN_TZ": ".logging",
+    "PromptManager": ".prompt_manager",
+    "PromptSequence": ".prompt_manager",
+    "PromptSequenceItem": ".prompt_manager",
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,153 @@
+import io
+import time
+import asyncio
+import logging
+import warnings
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Tuple, Union
+from PIL import Image
+from .metrics import metrics
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+MB = 1024 * 1024
+
+
+class ImageTooLarge(ValueError):
+    """Raised when an upload exceeds the pixel ceiling, checked before decoding."""
+
+
+def read_image_size(data: bytes) -> Tuple[int, int, Union[str, None]]:
+    """Width, height and format from the image header, without decoding pixels."""
+    with warnings.catch_warnings():
+        # The caller applies its own pixel ceiling
+        warnings.simplefilter("ignore", Image.DecompressionBombWarning)
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                return image.size[0], image.size[1], image.format
+        except Image.DecompressionBombError as e:
+            raise ImageTooLarge(str(e)) from e
+
+
+class MemoryAdmission:
+    """
+    Admits requests against a global memory budget. The cost of a request is
+    estimated from its header dimensions: the decoded frame (reduced by JPEG draft
+    decoding) plus the full-frame buffers of segmentation and mask compositing at
+    the working resolution, plus a fixed per-request overhead. Requests over the
+    budget wait in FIFO order, images above `max_megapixels` are rejected.
+    """
+
+    def __init__(
+        self,
+        budget_mb: float = 4096,
+        max_megapixels: float = 100,
+        bytes_per_working_pixel: float = 48,
+        base_cost_mb: float = 64,
+    ):
+        self.budget = int(budget_mb * MB)
+        self.max_pixels = int(max_megapixels * 1e6)
+        self.bytes_per_working_pixel = bytes_per_working_pixel
+        self.base_cost = int(base_cost_mb * MB)
+
+        self.in_use = 0
+        self._waiters: Deque[Tuple[int, asyncio.Future]] = deque()
+
+        metrics.set_gauge("admission_memory_budget_bytes", self.budget)
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("admission_memory_in_use_bytes", self.in_use)
+        metrics.set_gauge("admission_waiting", len(self._waiters))
+
+    def estimate(self, data: bytes, max_image_size: Union[int, None] = None) -> int:
+        """Estimated peak bytes to process `data`, raises ImageTooLarge."""
+        width, height, image_format = read_image_size(data)
+        pixels = width * height
+        if pixels > self.max_pixels:
+            metrics.inc("admission_rejected", reason="pixel_ceiling")
+            raise ImageTooLarge(
+                f"Image of {width}x{height} ({pixels / 1e6:.0f} MP) exceeds the "
+                f"{self.max_pixels / 1e6:.0f} MP limit"
+            )
+
+        scale = 1.0
+        if max_image_size and max(width, height) > max_image_size:
+            scale = max_image_size / max(width, height)
+        working_pixels = pixels * scale * scale
+
+        decoded_pixels = pixels
+        if image_format == "JPEG":
+            # Draft mode decodes at 1/2, 1/4 or 1/8 scale when that still covers
+            # the working resolution
+            reduce = 1
+            while reduce < 8 and scale * reduce * 2 <= 1:
+                reduce *= 2
+            decoded_pixels = pixels / (reduce * reduce)
+
+        # RGBA decode buffer, then the per-pixel buffers at working resolution
+        return int(
+            self.base_cost
+            + 4 * decoded_pixels
+            + self.bytes_per_working_pixel * working_pixels
+        )
+
+    def _dispatch(self):
+        while self._waiters:
+            cost, future = self._waiters[0]
+            if future.done():  # waiter was cancelled
+                self._waiters.popleft()
+                continue
+            if self.in_use + cost > self.budget:
+                break
+            self._waiters.popleft()
+            self.in_use += cost
+            future.set_result(None)
+        self._publish()
+
+    async def acquire(self, cost: int) -> int:
+        """Waits until `cost` bytes fit in the budget and returns the amount held."""
+        # A request larger than the whole budget runs alone
+        cost = min(cost, self.budget)
+        if not self._waiters and self.in_use + cost <= self.budget:
+            self.in_use += cost
+            self._publish()
+            return cost
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((cost, future))
+        self._publish()
+        logger.log(
+            logging.INFO,
+            "Memory budget full (%.0f/%.0f MB), queueing request of %.0f MB",
+            self.in_use / MB,
+            self.budget / MB,
+            cost / MB,
+        )
+
+        wait_start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(cost)  # admitted, but the waiter is gone
+            else:
+                self._dispatch()  # a smaller request behind it may fit now
+            raise
+        metrics.observe("admission_wait_seconds", time.perf_counter() - wait_start)
+        return cost
+
+    def release(self, cost: int):
+        self.in_use -= cost
+        self._dispatch()
+
+    @asynccontextmanager
+    async def admit(self, cost: int):
+        held = await self.acquire(cost)
+        try:
+            yield
+        finally:
+            self.release(held)
@@ -1,6 +1,6 @@
 import os
 from pathlib import Path
-from typing import Any, Dict, Union
+from typing import Any, Dict, List, Union
 import yaml
 
 
@@ -28,3 +28,66 @@ class ConfigHandler:
 
     def get_storage_config(self) -> Dict[str, Any]:
         return self.config.get("storage", {})
+
+    def get_upload_config(self) -> Dict[str, Any]:
+        return self.config.get("upload", {})
+
+    def get_batch_config(self) -> Dict[str, Any]:
+        return self.config.get("batch", {})
+
+    def get_admission_config(self) -> Dict[str, Any]:
+        return self.config.get("admission", {})
+
+    def get_scheduler_config(self) -> Dict[str, Any]:
+        return self.config.get("scheduler", {})
+
+    def get_dedup_config(self) -> Dict[str, Any]:
+        return self.config.get("dedup", {})
+
+    def get_tracing_config(self) -> Dict[str, Any]:
+        return self.config.get("tracing", {})
+
+    def get_admin_config(self) -> Dict[str, Any]:
+        return self.config.get("admin", {})
+
+    def get_logging_config(self) -> Dict[str, Any]:
+        return self.config.get("logging", {})
+
+    def get_multi_object_config(self) -> Dict[str, Any]:
+        return self.config.get("multi_object", {})
+
+    def get_live_config(self) -> Dict[str, Any]:
+        return self.config.get("live", {})
+
+    def get_keyword_fast_path_config(self) -> Dict[str, Any]:
+        return self.config.get("keyword_fast_path", {})
+
+    def get_profile_config(self, name: Union[str, None] = None) -> Dict[str, Any]:
+        """
+        Returns a quality/latency profile with its model overrides merged over the
+        base `models` config. Without a `profiles` section the base config is
+        returned as the only profile.
+        """
+        profiles = self.config.get("profiles", {})
+        presets = profiles.get("presets", {})
+        name = name or profiles.get("default", "default")
+
+        if name not in presets and (presets or name != "default"):
+            raise ValueError(f"Unknown profile: {name}")
+        preset = presets.get(name, {})
+
+        return {
+            "name": name,
+            "samples": preset.get("samples", {}),
+            "max_image_size": preset.get("max_image_size"),
+            "timeout": preset.get("timeout"),
+            "fused_description": preset.get("fused_description", False),
+            "keyword_fast_path": preset.get("keyword_fast_path", False),
+            "yolo": {**self.get_model_config("yolo"), **preset.get("yolo", {})},
+            "sam": {**self.get_model_config("sam"), **preset.get("sam", {})},
+        }
+
+    def get_active_profiles(self) -> List[str]:
+        """Names of the profiles whose models are preloaded and can be requested."""
+        profiles = self.config.get("profiles", {})
+        return profiles.get("active") or [profiles.get("default", "default")]
@@ -0,0 +1,41 @@
+import time
+from typing import Union
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a request runs out of its time budget."""
+
+
+class Deadline:
+    """
+    Time budget of one request, created from a timeout in seconds (None means
+    unbounded) and passed down the pipeline so each stage can check what is left.
+    """
+
+    def __init__(self, timeout: Union[float, None]):
+        self.timeout = timeout
+        self.expires_at = None if timeout is None else time.monotonic() + timeout
+
+    @classmethod
+    def from_budget(cls, *timeouts: Union[float, None]) -> "Deadline":
+        """The tightest of the given timeouts, ignoring the unset ones."""
+        timeouts = [t for t in timeouts if t is not None]
+        return cls(min(timeouts) if timeouts else None)
+
+    def remaining(self) -> Union[float, None]:
+        if self.expires_at is None:
+            return None
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage: str):
+        """Raises DeadlineExceeded if no budget is left before starting `stage`."""
+        if self.expired():
+            raise DeadlineExceeded(
+                f"Deadline of {self.timeout}s exceeded before {stage}"
+            )
+
+    def __repr__(self) -> str:
+        return f"Deadline(timeout={self.timeout}, remaining={self.remaining()})"
@@ -0,0 +1,166 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+from typing import List, Tuple, Union
+from .metrics import metrics
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+# HTTP statuses that mean "slow down": quota exhaustion and server overload
+THROTTLE_STATUS_CODES = (429, 500, 502, 503, 504)
+THROTTLE_ERROR_NAMES = (
+    "ResourceExhausted",
+    "TooManyRequests",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "DeadlineExceeded",
+)
+
+
+def is_throttle_error(error: BaseException) -> bool:
+    """True for 429/5xx style errors from the Gemini SDK (google.api_core)."""
+    code = getattr(error, "code", None)
+    if isinstance(code, int) and code in THROTTLE_STATUS_CODES:
+        return True
+    return type(error).__name__ in THROTTLE_ERROR_NAMES
+
+
+class GeminiGovernor:
+    """
+    Process-wide admission for Gemini calls, shared by every service and request.
+
+    - A token bucket caps the request rate (`rate` per second, `burst` tokens).
+    - AIMD concurrency: the in-flight limit grows by ~1 per window of successful
+      calls and halves on a throttling error (at most once per `cooldown` seconds).
+    - Waiters are served by priority (lower first), then arrival order, so stages
+      closest to completing a request are not starved by new requests.
+    """
+
+    def __init__(
+        self,
+        rate: Union[float, None] = None,
+        burst: int = 10,
+        initial_concurrency: int = 8,
+        min_concurrency: int = 1,
+        max_concurrency: int = 32,
+        decrease_factor: float = 0.5,
+        cooldown: float = 2.0,
+    ):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.limit = float(
+            min(max(initial_concurrency, min_concurrency), max_concurrency)
+        )
+        self.decrease_factor = decrease_factor
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self._last_refill = time.monotonic()
+        self._last_decrease = 0.0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._refill_timer: Union[asyncio.TimerHandle, None] = None
+
+        self._publish()
+
+    def _publish(self):
+        metrics.set_gauge("gemini_concurrency_limit", int(self.limit))
+        metrics.set_gauge("gemini_in_flight", self.in_flight)
+        metrics.set_gauge("gemini_waiting", len(self._waiters))
+
+    def _refill(self):
+        if self.rate is None:
+            return
+        now = time.monotonic()
+        self.tokens = min(
+            self.burst, self.tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    def _dispatch(self):
+        """Grants slots to the best waiters while concurrency and tokens allow."""
+        self._refill_timer = None
+        self._refill()
+
+        while self._waiters and self.in_flight < int(self.limit):
+            if self.rate is not None and self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                self._refill_timer = asyncio.get_running_loop().call_later(
+                    delay, self._dispatch
+                )
+                break
+
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # waiter was cancelled
+                continue
+            if self.rate is not None:
+                self.tokens -= 1
+            self.in_flight += 1
+            future.set_result(None)
+
+        self._publish()
+
+    async def acquire(self, priority: int = 0):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._sequence), future))
+        if self._refill_timer is None:
+            self._dispatch()
+
+        wait_start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # granted, but the waiter is gone
+            raise
+        metrics.observe("gemini_queue_wait_seconds", time.perf_counter() - wait_start)
+
+    def release(self):
+        self.in_flight -= 1
+        if self._refill_timer is None:
+            self._dispatch()
+        else:
+            self._publish()
+
+    def record_success(self):
+        # Additive increase, roughly +1 per `limit` successful calls
+        self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+
+    def record_throttle(self):
+        metrics.inc("gemini_throttled")
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit * self.decrease_factor)
+        logger.log(
+            logging.WARNING,
+            "Gemini throttled, concurrency limit lowered to %s",
+            int(self.limit),
+        )
+        self._publish()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = 0):
+        """Holds one Gemini call slot and feeds the call's outcome back into AIMD."""
+        await self.acquire(priority)
+        try:
+            yield
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if is_throttle_error(e):
+                self.record_throttle()
+            raise
+        else:
+            self.record_success()
+        finally:
+            self.release()
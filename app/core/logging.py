@@ -1,7 +1,16 @@
+import os
+import time
+import queue
+import atexit
+import numbers
 import logging
-from typing import Union
+import reprlib
+import threading
+import logging.handlers
+from typing import Any, Dict, Tuple, Union
 from pathlib import Path
 from datetime import datetime, timedelta, timezone
+from .metrics import metrics
 
 
 # Set up Vietnam timezone (UTC+7)
@@ -13,26 +22,220 @@ def vn_time():
     return datetime.now(VN_TZ).strftime("%Y-%m-%d %H:%M:%S")
 
 
-def setup_logging(log_path: Union[Path, None] = None) -> logging.Logger:
+class _SafeRepr(reprlib.Repr):
+    """
+    reprlib with summaries for arrays, tensors and images, so that logging one of
+    them never dumps (or even formats) its data.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.maxlevel = 3
+        self.maxlist = self.maxtuple = self.maxset = self.maxdict = 10
+        self.maxstring = 500
+        self.maxother = 200
+
+    def repr1(self, x: Any, level: int) -> str:
+        # PIL images, duck-typed so that this module does not import Pillow
+        if hasattr(x, "getbands") and hasattr(x, "size") and hasattr(x, "mode"):
+            return f"<{type(x).__name__} {x.mode} {x.size[0]}x{x.size[1]}>"
+        # numpy arrays and torch tensors
+        if hasattr(x, "shape") and hasattr(x, "dtype") and not isinstance(x, type):
+            if getattr(x, "size", None) == 1 or getattr(x, "ndim", 0) == 0:
+                return repr(x.item()) if hasattr(x, "item") else repr(x)
+            if getattr(x, "ndim", None) == 1 and len(x) <= 8:
+                return f"{type(x).__name__}({[round(float(v), 3) for v in x]})"
+            return f"<{type(x).__name__} shape={tuple(x.shape)} dtype={x.dtype}>"
+        if isinstance(x, (bytes, bytearray)):
+            return f"<{type(x).__name__} len={len(x)}>"
+        return super().repr1(x, level)
+
+    def repr_instance(self, x: Any, level: int) -> str:
+        try:
+            s = repr(x)
+        except Exception:
+            return f"<{type(x).__name__} object>"
+        if len(s) > self.maxother:
+            return f"{s[: self.maxother]}... ({type(x).__name__})"
+        return s
+
+
+_safe_repr = _SafeRepr()
+
+
+def safe_repr(value: Any) -> str:
+    """Size-limited repr of a log argument, strings are only truncated."""
+    if isinstance(value, str):
+        if len(value) <= _safe_repr.maxstring:
+            return value
+        return f"{value[: _safe_repr.maxstring]}... ({len(value)} chars)"
+    return _safe_repr.repr(value)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per message template (logger, level and the unformatted message),
+    so a hot loop or an error storm logs `burst` records and then `rate` per second.
+    The next record that passes reports how many were suppressed.
+    """
+
+    def __init__(self, rate: float = 5.0, burst: int = 20):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._lock = threading.Lock()
+        # template -> (tokens, last update, suppressed records)
+        self._buckets: Dict[Tuple[str, int, Any], Tuple[float, float, int]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                metrics.inc("log_records_suppressed")
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+            if len(self._buckets) > 10000:
+                self._buckets.clear()
+        if suppressed:
+            record.msg = f"{record.msg} [{suppressed} similar messages suppressed]"
+        return True
+
+
+class _SafeArg:
+    """Formats as the safe repr of `value` for both %s and %r."""
+
+    __slots__ = ("value",)
+
+    def __init__(self, value: Any):
+        self.value = value
+
+    def __str__(self) -> str:
+        return safe_repr(self.value)
+
+    def __repr__(self) -> str:
+        if isinstance(self.value, str):
+            return repr(safe_repr(self.value))
+        return safe_repr(self.value)
+
+
+def _safe_arg(value: Any) -> Any:
+    # Numbers (numpy scalars included) stay as they are for %d/%f
+    if value is None or isinstance(value, numbers.Number):
+        return value
+    return _SafeArg(value)
+
+
+class SafeQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the listener thread. Only the message is formatted here, with
+    size-limited reprs of the arguments, the rest of the formatting and the I/O
+    happen off the calling thread. Records are dropped when the queue is full.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        if record.args:
+            args = record.args
+            if isinstance(args, dict):
+                args = {k: _safe_arg(v) for k, v in args.items()}
+            else:
+                args = tuple(_safe_arg(a) for a in args)
+            record.args = args
+        return super().prepare(record)
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc("log_records_dropped")
+
+
+# log path -> (queue handler, listener)
+_listeners: Dict[str, Tuple[SafeQueueHandler, logging.handlers.QueueListener]] = {}
+
+
+def stop_logging():
+    """Writes the queued records and stops the listener threads."""
+    for _, listener in _listeners.values():
+        if listener._thread is not None:
+            listener.stop()
+
+
+def _restart_listeners_after_fork():
+    # Only the forking thread exists in the child: the listener threads are gone
+    # and their queues may be locked, each listener restarts with a new queue
+    for handler, listener in _listeners.values():
+        if listener._thread is None:
+            continue
+        handler.queue = listener.queue = queue.Queue(maxsize=handler.queue.maxsize)
+        listener._thread = None
+        listener.start()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_restart_listeners_after_fork)
+
+
+def setup_logging(
+    log_path: Union[Path, None] = None,
+    level: Union[str, int] = logging.INFO,
+    queue_size: int = 10000,
+    rate_limit: Union[Dict[str, float], None] = None,
+) -> logging.Logger:
+    """
+    Configures the "toy_transformer" logger: records go through a bounded queue to a
+    listener thread that writes the log file and the console, so the event loop
+    never blocks on I/O. Call sites use lazy `%`-style arguments, which are only
+    formatted (with size-limited reprs) for records that are emitted.
+    `rate_limit` ({"rate": per second, "burst": n}) limits repeated messages,
+    None disables it. Calling it again with another `log_path` adds that file.
+    """
     if log_path is None:
         log_path = Path("logs/toy_transformer.log")
 
     log_path.parent.mkdir(parents=True, exist_ok=True)
 
     logger = logging.getLogger("toy_transformer")
-    logger.setLevel(logging.INFO)
+    logger.setLevel(level)
 
     formatter = logging.Formatter(
         "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
     )
     formatter.converter = lambda *args: datetime.now(VN_TZ).timetuple()
 
+    key = str(log_path.resolve())
+    if key in _listeners:
+        return logger
+
     file_handler = logging.FileHandler(log_path)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
 
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
-    logger.addHandler(console_handler)
+    handlers = [file_handler]
+    if not _listeners:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+
+    log_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+    queue_handler = SafeQueueHandler(log_queue)
+    if rate_limit is not None:
+        queue_handler.addFilter(RateLimitFilter(**rate_limit))
+    logger.addHandler(queue_handler)
+
+    listener = logging.handlers.QueueListener(
+        log_queue, *handlers, respect_handler_level=True
+    )
+    listener.start()
+    # Flushes the queued records on interpreter exit
+    atexit.register(stop_logging)
+    _listeners[key] = (queue_handler, listener)
 
     return logger
@@ -0,0 +1,254 @@
+import os
+import gc
+import time
+import signal
+import socket
+import logging
+from typing import Any, Callable, Dict, Union
+from .logging import stop_logging
+
+
+logger = logging.getLogger("toy_transformer")
+
+MB = 1024 * 1024
+
+
+def process_memory(pid: Union[int, None] = None) -> Dict[str, int]:
+    """
+    Memory of a process in bytes from /proc (Linux): rss, pss (shared pages divided
+    among the processes that map them), uss (private pages) and shared. Only rss is
+    available without smaps_rollup, nothing outside Linux.
+    """
+    pid = os.getpid() if pid is None else pid
+    fields: Dict[str, int] = {}
+    try:
+        with open(f"/proc/{pid}/smaps_rollup") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == "kB":
+                    fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    except OSError:
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return {"rss": int(line.split()[1]) * 1024}
+        except OSError:
+            pass
+        return {}
+
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "uss": private,
+        "shared": fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0),
+    }
+
+
+def configure_torch_threads(threads: int):
+    """Sets the intra-op thread count of torch, if it is installed."""
+    try:
+        import torch
+    except ImportError:
+        return
+    torch.set_num_threads(threads)
+
+
+class PreforkServer:
+    """
+    Serves `app` from `workers` processes forked from a master that ran `preload`,
+    so the model weights and prompt images loaded there are shared copy-on-write
+    instead of being loaded once per worker. The objects of the master are moved to
+    the permanent GC generation before forking, so collections in the workers do
+    not write to (and copy) their pages.
+
+    `preload` must not start threads, open network clients or run inference (the
+    OpenMP pool of torch does not survive a fork), those happen per worker after
+    `after_fork(workers)`, in the application startup. Each worker runs uvicorn on
+    the listening socket of the master with `torch_threads` intra-op threads
+    (default: the CPU count divided among the workers).
+
+    The master restarts workers that exit, forwards SIGTERM/SIGINT to them and logs
+    their memory every `memory_report_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        app: Any,
+        host: str,
+        port: int,
+        workers: int,
+        preload: Callable[[], None],
+        after_fork: Callable[[int], None],
+        torch_threads: Union[int, None] = None,
+        memory_report_interval: float = 60,
+        shutdown_timeout: float = 30,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.preload = preload
+        self.after_fork = after_fork
+        self.torch_threads = torch_threads or max(1, (os.cpu_count() or 1) // workers)
+        self.memory_report_interval = memory_report_interval
+        self.shutdown_timeout = shutdown_timeout
+
+        self.socket: Union[socket.socket, None] = None
+        self.children: Dict[int, int] = {}  # pid -> worker index
+        self._spawned_at: Dict[int, float] = {}
+        self._stopping = False
+
+    def run(self):
+        family = socket.AF_INET6 if ":" in self.host else socket.AF_INET
+        self.socket = socket.create_server(
+            (self.host, self.port), family=family, backlog=2048
+        )
+        self.socket.set_inheritable(True)
+
+        start = time.perf_counter()
+        self.preload()
+        gc.collect()
+        gc.freeze()
+        master_rss = process_memory().get("rss", 0)
+        logger.log(
+            logging.INFO,
+            "Preloaded in %.2fs (master rss %.0fMB), forking %s workers "
+            "with %s torch threads each",
+            time.perf_counter() - start,
+            master_rss / MB,
+            self.workers,
+            self.torch_threads,
+        )
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        for index in range(self.workers):
+            self._spawn(index)
+
+        next_report = time.monotonic() + self.memory_report_interval
+        while not self._stopping:
+            self._reap()
+            if self.memory_report_interval and time.monotonic() >= next_report:
+                self.report_memory()
+                next_report = time.monotonic() + self.memory_report_interval
+            time.sleep(0.5)
+
+        self._shutdown()
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self, index: int):
+        pid = os.fork()
+        if pid:
+            self.children[pid] = index
+            self._spawned_at[pid] = time.monotonic()
+            return
+
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            self._run_worker(index)
+        except BaseException as e:
+            logger.log(logging.ERROR, "Worker %s failed: %s", index, e)
+            exit_code = 1
+        finally:
+            stop_logging()
+            os._exit(exit_code)
+
+    def _run_worker(self, index: int):
+        import uvicorn
+
+        configure_torch_threads(self.torch_threads)
+        self.after_fork(self.workers)
+        logger.log(logging.INFO, "Worker %s started (pid %s)", index, os.getpid())
+
+        config = uvicorn.Config(self.app, host=self.host, port=self.port)
+        uvicorn.Server(config).run(sockets=[self.socket])
+
+    def _reap(self):
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            index = self.children.pop(pid, None)
+            spawned_at = self._spawned_at.pop(pid, time.monotonic())
+            if index is None or self._stopping:
+                continue
+            logger.log(
+                logging.WARNING,
+                "Worker %s (pid %s) exited with status %s, restarting",
+                index,
+                pid,
+                os.waitstatus_to_exitcode(status),
+            )
+            # Do not fork in a tight loop when workers die on startup
+            if time.monotonic() - spawned_at < 1:
+                time.sleep(1)
+            self._spawn(index)
+
+    def _shutdown(self):
+        for pid in self.children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+        deadline = time.monotonic() + self.shutdown_timeout
+        while self.children and time.monotonic() < deadline:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid:
+                self.children.pop(pid, None)
+            else:
+                time.sleep(0.1)
+
+        for pid in self.children:
+            logger.log(logging.WARNING, "Killing worker pid %s", pid)
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        self.socket.close()
+
+    def report_memory(self) -> Dict[str, Dict[str, int]]:
+        """
+        Logs the memory of the master and every worker. The sum of the worker RSS is
+        roughly what loading the models in every worker would take, the sum of the
+        PSS is what the shared processes actually use.
+        """
+        report = {"master": process_memory()}
+        for pid, index in sorted(self.children.items(), key=lambda item: item[1]):
+            memory = process_memory(pid)
+            report[f"worker-{index}"] = memory
+            logger.log(
+                logging.INFO,
+                "Worker %s (pid %s): rss %.0fMB, pss %.0fMB, uss %.0fMB",
+                index,
+                pid,
+                memory.get("rss", 0) / MB,
+                memory.get("pss", 0) / MB,
+                memory.get("uss", 0) / MB,
+            )
+
+        total_pss = sum(m.get("pss", 0) for m in report.values())
+        workers_rss = sum(
+            m.get("rss", 0) for name, m in report.items() if name != "master"
+        )
+        logger.log(
+            logging.INFO,
+            "Memory of %s workers: %.0fMB pss in total with the master, "
+            "%.0fMB rss summed over the workers",
+            len(self.children),
+            total_pss / MB,
+            workers_rss / MB,
+        )
+        return report
@@ -0,0 +1,88 @@
+import os
+import sys
+import time
+import threading
+from collections import Counter
+from types import FrameType
+from typing import Dict, List
+
+
+# Leaf frames of a thread that is waiting rather than working
+_IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+
+class ProfilerBusy(RuntimeError):
+    """Raised when a profile is requested while another one is running."""
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler of every thread of the process, from `sys._current_frames()`
+    every `interval` seconds. Stacks are returned in the folded format
+    ("thread;outer;...;inner count" per line) read by flamegraph.pl, speedscope
+    and inferno. Nothing is installed in the profiled threads, so it can be started
+    and stopped on a running server.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.running = False
+
+    @staticmethod
+    def _frame_label(frame: FrameType) -> str:
+        code = frame.f_code
+        return (
+            f"{code.co_name} ({os.path.basename(code.co_filename)}"
+            f":{code.co_firstlineno})"
+        )
+
+    @staticmethod
+    def _is_idle(frame: FrameType) -> bool:
+        code = frame.f_code
+        return (os.path.basename(code.co_filename), code.co_name) in _IDLE_FRAMES
+
+    def sample(
+        self, seconds: float, interval: float = 0.005, include_idle: bool = False
+    ) -> Dict[str, int]:
+        """Samples for `seconds` (blocking) and returns folded stack counts."""
+        with self._lock:
+            if self.running:
+                raise ProfilerBusy("A profile is already running")
+            self.running = True
+
+        own_id = threading.get_ident()
+        counts: Counter = Counter()
+        try:
+            end = time.monotonic() + seconds
+            while time.monotonic() < end:
+                names = {t.ident: t.name for t in threading.enumerate()}
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_id:
+                        continue
+                    if not include_idle and self._is_idle(frame):
+                        continue
+                    stack: List[str] = []
+                    while frame is not None:
+                        stack.append(self._frame_label(frame))
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    counts[";".join(reversed(stack))] += 1
+                time.sleep(interval)
+        finally:
+            self.running = False
+        return dict(counts)
+
+    @staticmethod
+    def folded(counts: Dict[str, int]) -> str:
+        return "".join(
+            f"{stack} {count}\n"
+            for stack, count in sorted(counts.items(), key=lambda item: -item[1])
+        )
+
+
+profiler = SamplingProfiler()
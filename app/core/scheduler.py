@@ -0,0 +1,193 @@
+import time
+import asyncio
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Deque, Dict, Union
+from .metrics import metrics
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+LANES = (INTERACTIVE, BULK)
+
+
+class _Waiter:
+    __slots__ = ("tenant", "lane", "tag", "future")
+
+    def __init__(self, tenant: str, lane: str, tag: float, future: asyncio.Future):
+        self.tenant = tenant
+        self.lane = lane
+        self.tag = tag
+        self.future = future
+
+
+class FairScheduler:
+    """
+    Runs at most `max_concurrency` pipelines at once and decides which waiting
+    request runs next. The interactive lane is served first and bulk requests never
+    take the last `interactive_reserved` slots, so interactive requests do not queue
+    behind a bulk backlog. Within a lane, tenants share the slots by start-time fair
+    queuing: a request is tagged with the later of the lane's virtual time and the
+    tenant's previous finish tag, the tenant's next finish tag is that plus
+    1 / weight, and the smallest tag runs next. A tenant runs at most its
+    `max_concurrency` (default `tenant_max_concurrency`) pipelines at once.
+
+    `tenants` maps tenant ids to {"weight": w, "max_concurrency": n}.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        interactive_reserved: int = 2,
+        tenant_max_concurrency: int = 4,
+        tenants: Union[Dict[str, Dict[str, Any]], None] = None,
+        max_tracked_tenants: int = 100,
+    ):
+        self.max_concurrency = max_concurrency
+        self.interactive_reserved = min(interactive_reserved, max_concurrency - 1)
+        self.tenant_max_concurrency = tenant_max_concurrency
+        self.tenants = tenants or {}
+        self.max_tracked_tenants = max_tracked_tenants
+
+        self.running = {lane: 0 for lane in LANES}
+        self._tenant_running: Dict[str, int] = {}
+        self._queues: Dict[str, Dict[str, Deque[_Waiter]]] = {
+            lane: {} for lane in LANES
+        }
+        self._virtual_time = {lane: 0.0 for lane in LANES}
+        self._finish_tags: Dict[str, Dict[str, float]] = {lane: {} for lane in LANES}
+        # Tenants with their own queue wait summary, the others count as "other"
+        self._tracked = set(self.tenants)
+
+        self._publish()
+
+    def _publish(self):
+        for lane in LANES:
+            metrics.set_gauge("scheduler_running", self.running[lane], lane=lane)
+            metrics.set_gauge(
+                "scheduler_queued",
+                sum(len(q) for q in self._queues[lane].values()),
+                lane=lane,
+            )
+
+    def _weight(self, tenant: str) -> float:
+        return self.tenants.get(tenant, {}).get("weight", 1.0)
+
+    def _cap(self, tenant: str) -> int:
+        return self.tenants.get(tenant, {}).get(
+            "max_concurrency", self.tenant_max_concurrency
+        )
+
+    def _label(self, tenant: str) -> str:
+        if (
+            tenant not in self._tracked
+            and len(self._tracked) < self.max_tracked_tenants
+        ):
+            self._tracked.add(tenant)
+        return tenant if tenant in self._tracked else "other"
+
+    def _next(self, lane: str) -> Union[_Waiter, None]:
+        """Pops the smallest tag of a tenant under its cap, None if there is none."""
+        queues = self._queues[lane]
+        best = None
+        for tenant in list(queues):
+            queue = queues[tenant]
+            while queue and queue[0].future.done():  # waiter was cancelled
+                queue.popleft()
+            if not queue:
+                del queues[tenant]
+                continue
+            if self._tenant_running.get(tenant, 0) >= self._cap(tenant):
+                continue
+            if best is None or queue[0].tag < best.tag:
+                best = queue[0]
+        if best is not None:
+            queues[best.tenant].popleft()
+            self._virtual_time[lane] = best.tag
+        return best
+
+    def _dispatch(self):
+        while sum(self.running.values()) < self.max_concurrency:
+            waiter = self._next(INTERACTIVE)
+            if waiter is None:
+                bulk_slots = self.max_concurrency - self.interactive_reserved
+                if sum(self.running.values()) >= bulk_slots:
+                    break
+                waiter = self._next(BULK)
+            if waiter is None:
+                break
+            self.running[waiter.lane] += 1
+            self._tenant_running[waiter.tenant] = (
+                self._tenant_running.get(waiter.tenant, 0) + 1
+            )
+            waiter.future.set_result(None)
+        self._publish()
+
+    def _tag(self, tenant: str, lane: str) -> float:
+        finish_tags = self._finish_tags[lane]
+        virtual_time = self._virtual_time[lane]
+        if len(finish_tags) > 10000:
+            # Tags at or behind the virtual time carry no credit, drop them
+            for key in [k for k, tag in finish_tags.items() if tag <= virtual_time]:
+                del finish_tags[key]
+        start = max(virtual_time, finish_tags.get(tenant, 0.0))
+        finish_tags[tenant] = start + 1 / self._weight(tenant)
+        return start
+
+    async def acquire(self, tenant: str, lane: str = INTERACTIVE):
+        """Waits for a slot for one pipeline of `tenant` in `lane`."""
+        if lane not in LANES:
+            raise ValueError(f"Unknown lane {lane!r}, expected one of {LANES}")
+
+        future = asyncio.get_running_loop().create_future()
+        waiter = _Waiter(tenant, lane, self._tag(tenant, lane), future)
+        self._queues[lane].setdefault(tenant, deque()).append(waiter)
+        self._dispatch()
+
+        wait_start = time.perf_counter()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self.release(tenant, lane)  # started, but the waiter is gone
+            else:
+                queue = self._queues[lane].get(tenant)
+                if queue is not None and waiter in queue:
+                    queue.remove(waiter)
+                self._publish()
+            raise
+        wait = time.perf_counter() - wait_start
+        metrics.observe("scheduler_queue_wait_seconds", wait, lane=lane)
+        metrics.observe(
+            "scheduler_tenant_queue_wait_seconds",
+            wait,
+            lane=lane,
+            tenant=self._label(tenant),
+        )
+        if wait > 1:
+            logger.log(
+                logging.INFO,
+                "Tenant %s waited %.2fs for a %s slot",
+                tenant,
+                wait,
+                lane,
+            )
+
+    def release(self, tenant: str, lane: str = INTERACTIVE):
+        self.running[lane] -= 1
+        self._tenant_running[tenant] -= 1
+        if not self._tenant_running[tenant]:
+            del self._tenant_running[tenant]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, tenant: str, lane: str = INTERACTIVE):
+        await self.acquire(tenant, lane)
+        try:
+            yield
+        finally:
+            self.release(tenant, lane)
@@ -0,0 +1,284 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Deque, Dict, Iterator, List, Union
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+class Span:
+    """One timed operation of a trace, times in ns since the epoch."""
+
+    __slots__ = (
+        "name",
+        "trace",
+        "span_id",
+        "parent_id",
+        "start_ns",
+        "end_ns",
+        "thread_id",
+        "attributes",
+        "error",
+    )
+
+    def __init__(
+        self,
+        name: str,
+        trace: "Trace",
+        parent_id: Union[str, None],
+        attributes: Dict[str, Any],
+    ):
+        self.name = name
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Union[int, None] = None
+        self.thread_id = threading.get_ident()
+        self.attributes = attributes
+        self.error: Union[str, None] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_ms(self) -> float:
+        end_ns = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end_ns - self.start_ns) / 1e6
+
+
+class Trace:
+    def __init__(self):
+        self.trace_id = os.urandom(16).hex()
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    @property
+    def root(self) -> Span:
+        return next(s for s in self.spans if s.parent_id is None)
+
+    def to_chrome(self) -> Dict[str, Any]:
+        """Chrome trace event format, opens in Perfetto or chrome://tracing."""
+        pid = os.getpid()
+        events = [
+            {
+                "name": span.name,
+                "cat": "toy_transformer",
+                "ph": "X",
+                "ts": span.start_ns / 1000,
+                "dur": (span.end_ns - span.start_ns) / 1000,
+                "pid": pid,
+                "tid": span.thread_id,
+                "args": {
+                    **span.attributes,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    **({"error": span.error} if span.error else {}),
+                },
+            }
+            for span in self.spans
+        ]
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {"trace_id": self.trace_id},
+        }
+
+    def to_otlp(self, service_name: str) -> Dict[str, Any]:
+        """OTLP/HTTP JSON payload of the trace."""
+
+        def attribute(key: str, value: Any) -> Dict[str, Any]:
+            if isinstance(value, bool):
+                return {"key": key, "value": {"boolValue": value}}
+            if isinstance(value, int):
+                return {"key": key, "value": {"intValue": str(value)}}
+            if isinstance(value, float):
+                return {"key": key, "value": {"doubleValue": value}}
+            return {"key": key, "value": {"stringValue": str(value)}}
+
+        spans = []
+        for span in self.spans:
+            otlp_span = {
+                "traceId": self.trace_id,
+                "spanId": span.span_id,
+                "name": span.name,
+                "kind": 1,  # internal
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [attribute(k, v) for k, v in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {},
+            }
+            if span.parent_id is not None:
+                otlp_span["parentSpanId"] = span.parent_id
+            spans.append(otlp_span)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [attribute("service.name", service_name)]
+                    },
+                    "scopeSpans": [
+                        {"scope": {"name": "toy_transformer"}, "spans": spans}
+                    ],
+                }
+            ]
+        }
+
+
+# Current span of the task/thread, _UNSAMPLED below a root that was not sampled
+_UNSAMPLED = object()
+_current_span: ContextVar[Any] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    Span tracing of sampled requests. The outermost span decides whether its trace
+    is sampled (`sample_rate`, or `force=True`), spans below an unsampled root cost
+    a context variable lookup. Spans follow asyncio tasks and `asyncio.to_thread`
+    calls through contextvars. Finished traces are kept in memory (`keep_recent`)
+    and exported from a background thread to `chrome_dir` as Chrome trace files
+    and/or to an OTLP/HTTP JSON collector at `otlp_endpoint`.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.chrome_dir: Union[Path, None] = None
+        self.otlp_endpoint: Union[str, None] = None
+        self.service_name = "toy-transformer"
+        self.recent: Deque[Trace] = deque(maxlen=50)
+        self.chrome_max_files = 500
+        self._chrome_files: Deque[Path] = deque()
+        self._exports: "queue.Queue[Trace]" = queue.Queue(maxsize=1000)
+        self._exporter: Union[threading.Thread, None] = None
+
+    def configure(
+        self,
+        enabled: bool = False,
+        sample_rate: float = 0.0,
+        chrome_dir: Union[str, None] = None,
+        chrome_max_files: int = 500,
+        otlp_endpoint: Union[str, None] = None,
+        service_name: str = "toy-transformer",
+        keep_recent: int = 50,
+    ):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.chrome_dir = Path(chrome_dir) if chrome_dir else None
+        self.chrome_max_files = chrome_max_files
+        if self.chrome_dir is not None:
+            self.chrome_dir.mkdir(parents=True, exist_ok=True)
+        self.otlp_endpoint = otlp_endpoint
+        self.service_name = service_name
+        self.recent = deque(self.recent, maxlen=keep_recent)
+
+        if self._exporter is None and (self.chrome_dir or self.otlp_endpoint):
+            self._exporter = threading.Thread(
+                target=self._export_loop, name="trace-exporter", daemon=True
+            )
+            self._exporter.start()
+
+    def _after_fork(self):
+        # The exporter thread does not survive a fork, its queue may be locked
+        self._exports = queue.Queue(maxsize=1000)
+        if self._exporter is not None:
+            self._exporter = threading.Thread(
+                target=self._export_loop, name="trace-exporter", daemon=True
+            )
+            self._exporter.start()
+
+    @staticmethod
+    def current() -> Union[Span, None]:
+        span = _current_span.get()
+        return span if isinstance(span, Span) else None
+
+    @contextmanager
+    def span(
+        self, name: str, force: bool = False, **attributes
+    ) -> Iterator[Union[Span, None]]:
+        """
+        Times the enclosed block as a child of the current span, or as the root of a
+        new trace. Yields None when the trace is not sampled.
+        """
+        parent = _current_span.get()
+        if parent is _UNSAMPLED:
+            yield None
+            return
+        if parent is None:
+            if not self.enabled or not (force or random.random() < self.sample_rate):
+                token = _current_span.set(_UNSAMPLED)
+                try:
+                    yield None
+                finally:
+                    _current_span.reset(token)
+                return
+            span = Span(name, Trace(), None, attributes)
+        else:
+            span = Span(name, parent.trace, parent.span_id, attributes)
+
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__ if not str(e) else f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end_ns = time.time_ns()
+            _current_span.reset(token)
+            span.trace.add(span)
+            if span.parent_id is None:
+                self._finish(span.trace)
+
+    def _finish(self, trace: Trace):
+        self.recent.append(trace)
+        if self._exporter is not None:
+            try:
+                self._exports.put_nowait(trace)
+            except queue.Full:
+                logger.log(logging.WARNING, "Trace export queue full, dropping trace")
+
+    def get(self, trace_id: str) -> Union[Trace, None]:
+        return next((t for t in self.recent if t.trace_id == trace_id), None)
+
+    def _export_loop(self):
+        while True:
+            trace = self._exports.get()
+            if self.chrome_dir is not None:
+                try:
+                    path = self.chrome_dir / f"trace-{trace.trace_id}.json"
+                    path.write_text(json.dumps(trace.to_chrome()))
+                    self._chrome_files.append(path)
+                    while len(self._chrome_files) > self.chrome_max_files:
+                        self._chrome_files.popleft().unlink(missing_ok=True)
+                except Exception as e:
+                    logger.log(logging.WARNING, "Error writing trace: %s", e)
+            if self.otlp_endpoint is not None:
+                try:
+                    import httpx
+
+                    httpx.post(
+                        self.otlp_endpoint,
+                        json=trace.to_otlp(self.service_name),
+                        timeout=5,
+                    ).raise_for_status()
+                except Exception as e:
+                    logger.log(logging.WARNING, "Error exporting trace: %s", e)
+
+
+tracer = Tracer()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=tracer._after_fork)
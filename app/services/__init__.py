@@ -1,7 +1,33 @@
-from .base_service import BaseService
-from .description_generator import DescriptionGenerator
-from .image_generator import ImageGenerator
-from .keyword_extractor import KeywordExtractor
-from .object_detector import ObjectDetector
-from .segmentation import Segmentation
-from .image_processor import ImageProcessor
+"""
+Services are resolved on first attribute access so that importing one of them (or
+the package) does not pull in torch/ultralytics or the Gemini SDK.
+"""
+
+import importlib
+from typing import Any
+
+_SERVICES = {
+    "BaseService": ".base_service",
+    "DescriptionGenerator": ".description_generator",
+    "FusedDescriptionGenerator": ".fused_description_generator",
+    "ImageGenerator": ".image_generator",
+    "KeywordExtractor": ".keyword_extractor",
+    "ObjectDetector": ".object_detector",
+    "Segmentation": ".segmentation",
+    "ToyDescriptionModifier": ".toy_description_modifier",
+    "ImageProcessor": ".image_processor",
+}
+
+__all__ = list(_SERVICES)
+
+
+def __getattr__(name: str) -> Any:
+    if name not in _SERVICES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_SERVICES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
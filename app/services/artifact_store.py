@@ -0,0 +1,333 @@
+import io
+import os
+import json
+import mmap
+import time
+import uuid
+import zlib
+import struct
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Union
+import numpy as np
+import numpy.typing as npt
+from PIL import Image, features
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from ..core.metrics import metrics
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+# Extensions of the formats stored as they are
+FORMAT_EXTENSIONS = {
+    "JPEG": "jpg",
+    "MPO": "jpg",
+    "PNG": "png",
+    "WEBP": "webp",
+    "AVIF": "avif",
+    "GIF": "gif",
+    "BMP": "bmp",
+    "TIFF": "tif",
+}
+# Formats never re-encoded, that would only lose quality
+COMPACT_FORMATS = ("JPEG", "MPO", "WEBP", "AVIF")
+IMAGE_EXTENSIONS = {"webp": "WEBP", "avif": "AVIF", "png": "PNG"}
+MEDIA_TYPES = {
+    "jpg": "image/jpeg",
+    "webp": "image/webp",
+    "avif": "image/avif",
+    "png": "image/png",
+    "gif": "image/gif",
+    "bmp": "image/bmp",
+    "tif": "image/tiff",
+    "rle": "application/octet-stream",
+    "bin": "application/octet-stream",
+}
+
+_RLE_HEADER = struct.Struct("<II")  # height, width
+
+# Record fields holding artifact ids
+ARTIFACT_KEYS = ("upload", "mask", "cutout", "output")
+
+
+def encode_mask_rle(mask: npt.NDArray) -> bytes:
+    """
+    Run-length encoding of a binary mask in row-major order: the height and width,
+    then the zlib-compressed lengths of alternating runs as uint32, starting with a
+    run of zeros (possibly empty). Object masks take about half the size of a
+    1-bit PNG.
+    """
+    height, width = mask.shape
+    flat = np.asarray(mask, dtype=bool).ravel()
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    bounds = np.concatenate(([0], changes, [flat.size]))
+    runs = np.diff(bounds)
+    if flat.size and flat[0]:
+        runs = np.concatenate(([0], runs))
+    return _RLE_HEADER.pack(height, width) + zlib.compress(
+        runs.astype("<u4").tobytes(), 6
+    )
+
+
+def decode_mask_rle(data: bytes) -> npt.NDArray:
+    height, width = _RLE_HEADER.unpack_from(data)
+    runs = np.frombuffer(zlib.decompress(data[_RLE_HEADER.size :]), dtype="<u4")
+    values = np.arange(len(runs)) % 2 == 1
+    return np.repeat(values, runs).reshape(height, width)
+
+
+class ArtifactStore:
+    """
+    Content-addressed files: an artifact is stored once as
+    `blobs/<2 hex digits>/<sha256>.<ext>` under `directory`, so identical uploads
+    and outputs share a file and equal file names never collide. Images are stored
+    in `image_format` (webp, avif or png) at `quality` unless they are already
+    JPEG/WebP/AVIF, uploads are kept as they are, masks are run-length encoded.
+
+    Each processed image adds a record to `records.jsonl` linking its upload, mask,
+    cutout and output artifacts. Beyond `max_records` records the oldest ones are
+    dropped together with the files no remaining record uses. Files written or
+    reused in the last `prune_grace` seconds are kept, they may belong to a request
+    still in flight.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path] = "artifacts",
+        image_format: str = "webp",
+        quality: int = 85,
+        mmap_reads: bool = False,
+        max_records: Union[int, None] = 1000,
+        prune_grace: float = 600,
+    ):
+        self.directory = Path(directory)
+        self.blob_dir = self.directory / "blobs"
+        self.blob_dir.mkdir(parents=True, exist_ok=True)
+        self.records_path = self.directory / "records.jsonl"
+
+        if image_format not in IMAGE_EXTENSIONS:
+            raise ValueError(
+                f"Unknown image format {image_format!r}, "
+                f"expected one of {list(IMAGE_EXTENSIONS)}"
+            )
+        if image_format == "avif" and not features.check("avif"):
+            logger.log(logging.WARNING, "Pillow has no AVIF support, using WebP")
+            image_format = "webp"
+        self.image_format = image_format
+        self.quality = quality
+        self.mmap_reads = mmap_reads
+        self.max_records = max_records
+        self.prune_grace = prune_grace
+
+        self._records = self._count_records()
+
+    def _count_records(self) -> int:
+        if not self.records_path.exists():
+            return 0
+        with open(self.records_path, "rb") as f:
+            return sum(1 for _ in f)
+
+    def path(self, artifact_id: str) -> Path:
+        digest = artifact_id.split(".", 1)[0]
+        if len(digest) != 64 or not all(c in "0123456789abcdef" for c in digest):
+            raise ValueError(f"Invalid artifact id {artifact_id!r}")
+        return self.blob_dir / digest[:2] / artifact_id
+
+    def _write(self, digest: str, extension: str, data: bytes) -> str:
+        artifact_id = f"{digest}.{extension}"
+        path = self.path(artifact_id)
+        if self._reuse(path):
+            return artifact_id
+        path.parent.mkdir(exist_ok=True)
+        # Readers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        metrics.inc("artifacts_written")
+        metrics.inc("artifact_bytes_written", len(data))
+        return artifact_id
+
+    @staticmethod
+    def _reuse(path: Path) -> bool:
+        """True if the artifact exists, its mtime is renewed so prune keeps it."""
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        metrics.inc("artifacts_deduplicated")
+        return True
+
+    def _encode_image(self, image: Image.Image) -> bytes:
+        if image.mode not in ("RGB", "RGBA", "L"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+        buffer = io.BytesIO()
+        image_format = IMAGE_EXTENSIONS[self.image_format]
+        if image_format == "PNG":
+            image.save(buffer, format="PNG", optimize=True)
+        else:
+            image.save(buffer, format=image_format, quality=self.quality)
+        return buffer.getvalue()
+
+    def _find(self, digest: str) -> Union[str, None]:
+        for extension in dict.fromkeys(
+            (self.image_format, *FORMAT_EXTENSIONS.values(), "bin")
+        ):
+            if self._reuse(self.path(f"{digest}.{extension}")):
+                return f"{digest}.{extension}"
+        return None
+
+    def put_file(self, data: bytes) -> str:
+        """
+        Stores encoded image bytes as they are, e.g. an upload. Only the header is
+        parsed, for the extension.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        artifact_id = self._find(digest)
+        if artifact_id is not None:
+            return artifact_id
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                extension = FORMAT_EXTENSIONS.get(image.format, "bin")
+        except Exception:
+            extension = "bin"
+        return self._write(digest, extension, data)
+
+    def put_image(self, image: Union[bytes, Image.Image]) -> str:
+        """
+        Stores an image (encoded bytes or a PIL image) and returns its artifact id.
+        Encoded bytes are addressed by their own hash, so a repeated file is not even
+        re-encoded. JPEG/WebP/AVIF bytes are stored unchanged, as are images the
+        configured format cannot encode (e.g. WebP above 16383px).
+        """
+        if isinstance(image, Image.Image):
+            data = self._encode_image(image)
+            return self._write(
+                hashlib.sha256(data).hexdigest(), self.image_format, data
+            )
+
+        digest = hashlib.sha256(image).hexdigest()
+        artifact_id = self._find(digest)
+        if artifact_id is not None:
+            return artifact_id
+
+        with Image.open(io.BytesIO(image)) as decoded:
+            extension = FORMAT_EXTENSIONS.get(decoded.format, "bin")
+            if decoded.format in COMPACT_FORMATS:
+                return self._write(digest, extension, image)
+            try:
+                return self._write(
+                    digest, self.image_format, self._encode_image(decoded)
+                )
+            except (OSError, ValueError) as e:
+                logger.log(
+                    logging.WARNING,
+                    "Cannot encode a %sx%s image as %s, storing it as is: %s",
+                    *decoded.size,
+                    self.image_format,
+                    e,
+                )
+                return self._write(digest, extension, image)
+
+    def put_mask(self, mask: npt.NDArray) -> str:
+        data = encode_mask_rle(mask)
+        return self._write(hashlib.sha256(data).hexdigest(), "rle", data)
+
+    def read(self, artifact_id: str) -> Union[bytes, mmap.mmap]:
+        """
+        Contents of an artifact, memory-mapped with `mmap_reads` so that repeated
+        reads of popular files come from the page cache without copies.
+        """
+        with open(self.path(artifact_id), "rb") as f:
+            if self.mmap_reads and os.fstat(f.fileno()).st_size:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return f.read()
+
+    def iter_chunks(
+        self, artifact_id: str, chunk_size: int = 256 * 1024
+    ) -> Iterator[bytes]:
+        data = self.read(artifact_id)
+        try:
+            for start in range(0, len(data), chunk_size):
+                yield data[start : start + chunk_size]
+        finally:
+            if isinstance(data, mmap.mmap):
+                data.close()
+
+    def read_mask(self, artifact_id: str) -> npt.NDArray:
+        return decode_mask_rle(bytes(self.read(artifact_id)))
+
+    def add_record(self, record: Dict[str, Any]) -> str:
+        """Appends a record linking the artifacts of one image, returns its id."""
+        record = {"id": uuid.uuid4().hex, "created": time.time(), **record}
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        with open(self.records_path, "ab") as f:
+            # Pre-forked workers append to the same file
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.write(line)
+        self._records += 1
+        if self.max_records is not None and self._records > self.max_records * 1.1:
+            self.prune()
+        return record["id"]
+
+    def records(self, limit: Union[int, None] = None) -> List[Dict[str, Any]]:
+        """Records, newest first."""
+        if not self.records_path.exists():
+            return []
+        with open(self.records_path, "rb") as f:
+            lines = f.read().splitlines()
+        if limit is not None:
+            lines = lines[-limit:]
+        return [json.loads(line) for line in reversed(lines) if line.strip()]
+
+    @staticmethod
+    def _artifact_ids(record: Dict[str, Any]) -> List[str]:
+        return [record[key] for key in ARTIFACT_KEYS if record.get(key)]
+
+    def prune(self):
+        """
+        Keeps the newest `max_records` records and the files they use. Files of no
+        record (e.g. of failed requests) go too, once older than `prune_grace`.
+        """
+        with open(self.records_path, "r+b") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            lines = f.read().splitlines()
+            dropped = max(0, len(lines) - self.max_records)
+            kept_lines = lines[dropped:]
+            kept = set()
+            for line in kept_lines:
+                kept.update(self._artifact_ids(json.loads(line)))
+
+            if dropped:
+                f.seek(0)
+                f.write(b"".join(line + b"\n" for line in kept_lines))
+                f.truncate()
+            self._records = len(kept_lines)
+
+        removed = 0
+        recent = time.time() - self.prune_grace
+        for path in self.blob_dir.glob("*/*"):
+            if path.name in kept:
+                continue
+            try:
+                if path.stat().st_mtime < recent:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        logger.log(
+            logging.INFO,
+            "Pruned %s artifact records and %s files",
+            dropped,
+            removed,
+        )
@@ -1,35 +1,89 @@
+import time
+import random
 import asyncio
 import logging
 from abc import ABC, abstractmethod
 from typing import Dict, Any, List, Union
+from ..core.deadline import Deadline, DeadlineExceeded
+from ..core.gemini_governor import GeminiGovernor
+from ..core.metrics import metrics
+from ..core.tracing import tracer
 from ..core.prompt_manager import PromptManager
 
 
 logger = logging.getLogger("toy_transformer")
 
 
+class ExecutionContext:
+    """
+    State of one `BaseService.__call__`: its sample target, deadline, completed
+    count, results and the tasks it owns. Services are shared singletons, so
+    nothing about an individual call may live on the service instance.
+    """
+
+    def __init__(self, max_total_tasks: int, deadline: Union[Deadline, None] = None):
+        self.max_total_tasks = max_total_tasks
+        self.deadline = deadline
+        self.completed_tasks = 0
+        self.results: List[Any] = []
+        self.tasks: List[asyncio.Task] = []
+
+    @property
+    def satisfied(self) -> bool:
+        return self.completed_tasks >= self.max_total_tasks
+
+    def remaining(self) -> Union[float, None]:
+        return self.deadline.remaining() if self.deadline is not None else None
+
+    def spawn(self, coro) -> asyncio.Task:
+        task = asyncio.create_task(coro)
+        self.tasks.append(task)
+        return task
+
+    def cancel(self) -> int:
+        """Cancels this call's unfinished tasks and returns how many there were."""
+        pending = [task for task in self.tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        return len(pending)
+
+
 class BaseService(ABC):
     def __init__(
         self,
         config: Dict[str, Any],
         prompt_manager: PromptManager,
         prompt_type: str,
-        max_concurrency: int = 1,
+        governor: Union[GeminiGovernor, None] = None,
+        priority: int = 0,
         max_total_tasks: int = 1,
         max_retries: int = 3,
+        backoff_base: float = 1.0,
+        backoff_max: float = 16.0,
     ):
+        """
+        `governor` is the Gemini admission control shared by all services, a private
+        one is built from `config["governor"]` if none is given. Lower `priority`
+        values are served first, services closer to the end of the pipeline use
+        lower values.
+        """
         self.config = config
         self.prompt_manager = prompt_manager
         self.prompt_type = prompt_type
 
-        self.max_concurrency = max_concurrency
+        self.governor = governor or GeminiGovernor(**config.get("governor", {}))
+        self.priority = priority
         self.max_total_tasks = max_total_tasks
         self.max_retries = max_retries
-        self.completed_tasks = 0
-        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        # Moving average of a successful forward() call, used to decide whether
+        # optional samples still fit in a request's remaining time budget
+        self.forward_latency_ewma: Union[float, None] = None
 
         logger.log(
-            logging.INFO, f"BaseService initialized with prompt type: {prompt_type}"
+            logging.INFO, "BaseService initialized with prompt type: %s", prompt_type
         )
 
     def _get_prompt_sequence(
@@ -41,7 +95,7 @@ class BaseService(ABC):
         Retrieves a prompt sequence for the given prompt type, excluding specified keys.
         """
 
-        logger.log(logging.DEBUG, f"Getting prompt sequence: {prompt_type}")
+        logger.log(logging.DEBUG, "Getting prompt sequence: %s", prompt_type)
 
         if prompt_type:
             return self.prompt_manager.get_prompt_sequence(prompt_type, exclude_keys)
@@ -52,7 +106,7 @@ class BaseService(ABC):
         Retrieves a specific prompt key for the given prompt type.
         """
 
-        logger.log(logging.DEBUG, f"Getting prompt key: {prompt_key}")
+        logger.log(logging.DEBUG, "Getting prompt key: %s", prompt_key)
 
         if prompt_type:
             return self.prompt_manager.get_prompt_key(prompt_type, prompt_key)
@@ -72,56 +126,133 @@ class BaseService(ABC):
         """
         raise NotImplementedError("The process_results method must be implemented.")
 
-    async def __call__(self, *args, **kwargs) -> Any:
+    def _record_forward_latency(self, latency: float):
+        if self.forward_latency_ewma is None:
+            self.forward_latency_ewma = latency
+        else:
+            self.forward_latency_ewma = 0.8 * self.forward_latency_ewma + 0.2 * latency
+
+    def _plan_tasks(self, max_total_tasks: int, deadline: Union[Deadline, None]) -> int:
+        """Drops the optional samples when one call barely fits in the budget."""
+        remaining = deadline.remaining() if deadline is not None else None
+        if (
+            remaining is not None
+            and self.forward_latency_ewma is not None
+            and max_total_tasks > 1
+            and remaining < 1.5 * self.forward_latency_ewma
+        ):
+            logger.log(
+                logging.INFO,
+                "%.1fs left in %s, skipping %s optional samples",
+                remaining,
+                self.prompt_type,
+                max_total_tasks - 1,
+            )
+            metrics.inc(
+                "service_samples_skipped",
+                max_total_tasks - 1,
+                service=self.prompt_type,
+            )
+            return 1
+        return max_total_tasks
+
+    async def _run_task(self, context: ExecutionContext, *args, **kwargs):
+        """Runs one sample of `context` with retries and records its result there."""
+        logger.log(
+            logging.DEBUG, "Processing task with args %s, kwargs %s", args, kwargs
+        )
+
+        for attempt in range(1, self.max_retries + 1):
+            if context.satisfied:
+                return
+            try:
+                with tracer.span(self.prompt_type, attempt=attempt) as span:
+                    queued = time.perf_counter()
+                    async with self.governor.slot(self.priority):
+                        # Pass original arguments directly to `forward`
+                        start = time.perf_counter()
+                        if span is not None:
+                            span.set(governor_wait_ms=(start - queued) * 1000)
+                        result = await self.forward(*args, **kwargs)
+                        self._record_forward_latency(time.perf_counter() - start)
+            except Exception as e:
+                logger.log(logging.ERROR, "Error processing task: %s", e)
+                if attempt == self.max_retries:
+                    logger.log(
+                        logging.ERROR,
+                        "Max retries reached for task with args %s, kwargs %s",
+                        args,
+                        kwargs,
+                    )
+                    return
+                # Exponential backoff with full jitter, outside the held slot
+                backoff = random.uniform(
+                    0,
+                    min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)),
+                )
+                remaining = context.remaining()
+                if remaining is not None and remaining <= backoff:
+                    return  # no budget left for another attempt
+                await asyncio.sleep(backoff)
+            else:
+                context.completed_tasks += 1
+                if result is not None:
+                    context.results.append(result)
+                return
+
+    async def __call__(
+        self,
+        *args,
+        max_total_tasks: Union[int, None] = None,
+        deadline: Union[Deadline, None] = None,
+        **kwargs,
+    ) -> Any:
         """
         Runs tasks in parallel with a concurrency and retry mechanism.
+        `max_total_tasks` overrides the number of samples for this call only.
+        With a `deadline`, optional samples are skipped when time is short and
+        outstanding tasks are cancelled once it passes, keeping what finished.
         """
+        if max_total_tasks is None:
+            max_total_tasks = self.max_total_tasks
+        if deadline is not None:
+            deadline.check(self.prompt_type)
+        max_total_tasks = self._plan_tasks(max_total_tasks, deadline)
+
+        context = ExecutionContext(max_total_tasks, deadline)
 
         logger.log(
             logging.INFO,
-            f"Processing {self.max_total_tasks} tasks in {self.prompt_type}",
+            "Processing %s tasks in %s",
+            max_total_tasks,
+            self.prompt_type,
         )
 
-        async def limited_task(*args, **kwargs):
-            if (
-                self.max_total_tasks is not None
-                and self.completed_tasks >= self.max_total_tasks
-            ):
-                return None
+        # Run each task with the original arguments in parallel
+        for _ in range(max_total_tasks):
+            context.spawn(self._run_task(context, *args, **kwargs))
+        try:
+            await asyncio.wait(context.tasks, timeout=context.remaining())
+        finally:
+            # Also reached when the request itself is cancelled
+            cancelled = context.cancel()
 
+        if cancelled:
             logger.log(
-                logging.INFO, f"Processing task with args {args}, kwargs {kwargs}"
+                logging.WARNING,
+                "Deadline reached in %s, cancelled %s outstanding tasks",
+                self.prompt_type,
+                cancelled,
             )
+            metrics.inc("service_tasks_cancelled", cancelled, service=self.prompt_type)
 
-            async with self.semaphore:
-                for attempt in range(1, self.max_retries + 1):
-                    try:
-                        # Pass original arguments directly to `forward`
-                        results = await self.forward(*args, **kwargs)
-                        self.completed_tasks += 1
-                        return results
-                    except Exception as e:
-                        logging.error(logging.ERROR, f"Error processing task: {e}")
-                        if attempt == self.max_retries:
-                            logging.error(
-                                logging.ERROR,
-                                f"Max retries reached for task with args {args}, kwargs {kwargs}",
-                            )
-                            return None
-                        await asyncio.sleep(2 ** (attempt - 1))  # Exponential backoff
+        # Tasks that failed all retries did not add a result
+        results = context.results
+        logger.log(logging.INFO, "Completed %s tasks", len(results))
 
-        # Run each task with the original arguments in parallel
-        tasks = [limited_task(*args, **kwargs) for _ in range(self.max_total_tasks)]
-        results = await asyncio.gather(*tasks)
-
-        # Filter out any None results from tasks that failed all retries
-        results = [result for result in results if result is not None]
-
-        logger.log(logging.INFO, f"Completed {len(results)} tasks")
-
-        self.completed_tasks = 0
-        logger.log(
-            logging.DEBUG, f"Setting completed tasks back to {self.completed_tasks}"
-        )
+        if not results and cancelled:
+            raise DeadlineExceeded(
+                f"Deadline of {deadline.timeout}s exceeded in {self.prompt_type}"
+            )
 
         return self.process_results(results)
@@ -1,8 +1,8 @@
 import logging
 from typing import Dict, List, Union
-import google.generativeai as genai
 from PIL import Image
 from .base_service import BaseService
+from ..core.gemini_governor import GeminiGovernor
 from ..core.prompt_manager import PromptManager, PromptSequenceItem
 
 
@@ -10,14 +10,22 @@ logger = logging.getLogger("toy_transformer")
 
 
 class DescriptionGenerator(BaseService):
-    def __init__(self, config: Dict, prompt_manager: PromptManager):
+    def __init__(
+        self,
+        config: Dict,
+        prompt_manager: PromptManager,
+        governor: Union[GeminiGovernor, None] = None,
+    ):
         super().__init__(
             config,
             prompt_manager,
             prompt_type="image_descriptor",
-            max_concurrency=4,
+            governor=governor,
+            priority=1,
             max_total_tasks=4,
         )
+        import google.generativeai as genai
+
         self.model = genai.GenerativeModel(
             config["model_name"],
             system_instruction=self._get_prompt_key("system_prompt"),
@@ -29,6 +37,8 @@ class DescriptionGenerator(BaseService):
         detected_keywords: List[str],
         main_keyword: Union[str, None],
     ) -> str:
+        import google.generativeai as genai
+
         sequence = self._get_prompt_sequence(
             "image_descriptor", exclude_keys=["system_prompt"]
         )
@@ -44,7 +54,7 @@ class DescriptionGenerator(BaseService):
                 PromptSequenceItem("text", f"Main keyword of the image: {main_keyword}")
             )
 
-        response = self.model.generate_content(
+        response = await self.model.generate_content_async(
             sequence.get_sequence(),
             generation_config=genai.GenerationConfig(temperature=0.95),
         )
@@ -52,6 +62,6 @@ class DescriptionGenerator(BaseService):
 
     def process_results(self, results: List[str]) -> str:
         longest_description = max(results, key=len)
-        logger.log(logging.INFO, f"Longest description: {longest_description}")
+        logger.log(logging.INFO, "Longest description: %s", longest_description)
 
         return longest_description
@@ -0,0 +1,96 @@
+import json
+import logging
+from typing import Dict, List, Union
+from typing_extensions import TypedDict
+from PIL import Image
+from .base_service import BaseService
+from ..core.gemini_governor import GeminiGovernor
+from ..core.prompt_manager import PromptManager, PromptSequenceItem
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+class FusedDescriptionResponse(TypedDict):
+    description: str
+    toy_description: str
+
+
+class FusedDescriptionGenerator(BaseService):
+    """
+    Writes the object description and the toy rewrite of it in one structured
+    Gemini call, replacing the DescriptionGenerator -> ToyDescriptionModifier
+    round trips for profiles with `fused_description: true`.
+    """
+
+    def __init__(
+        self,
+        config: Dict,
+        prompt_manager: PromptManager,
+        governor: Union[GeminiGovernor, None] = None,
+    ):
+        super().__init__(
+            config,
+            prompt_manager,
+            prompt_type="fused_descriptor",
+            governor=governor,
+            priority=0,
+            max_total_tasks=4,
+        )
+        import google.generativeai as genai
+
+        self.model = genai.GenerativeModel(
+            config["model_name"],
+            system_instruction=self._get_prompt_key("system_prompt"),
+        )
+
+    async def forward(
+        self,
+        image: Image.Image,
+        detected_keywords: List[str],
+        main_keyword: Union[str, None],
+    ) -> FusedDescriptionResponse:
+        import google.generativeai as genai
+
+        sequence = self._get_prompt_sequence(
+            "fused_descriptor", exclude_keys=["system_prompt"]
+        )
+        sequence.items.append(PromptSequenceItem("image", image))
+        sequence.items.append(
+            PromptSequenceItem(
+                "text",
+                f"Keywords: {detected_keywords[:min(4, len(detected_keywords))]}",
+            )
+        )
+        if main_keyword:
+            sequence.items.append(
+                PromptSequenceItem("text", f"Main keyword of the image: {main_keyword}")
+            )
+
+        response = await self.model.generate_content_async(
+            sequence.get_sequence(),
+            generation_config=genai.GenerationConfig(
+                response_mime_type="application/json",
+                response_schema=FusedDescriptionResponse,
+                temperature=0.95,
+            ),
+        )
+
+        # An invalid answer raises here, so the sample is retried
+        result = json.loads(response.text)
+        if not isinstance(result, dict) or not all(
+            isinstance(result.get(key), str) and result[key].strip()
+            for key in FusedDescriptionResponse.__annotations__
+        ):
+            raise ValueError(f"Invalid fused description response: {response.text}")
+        return FusedDescriptionResponse(
+            description=result["description"],
+            toy_description=result["toy_description"],
+        )
+
+    def process_results(
+        self, results: List[FusedDescriptionResponse]
+    ) -> FusedDescriptionResponse:
+        longest = max(results, key=lambda result: len(result["toy_description"]))
+        logger.log(logging.DEBUG, "Longest fused description: %s", longest)
+        return longest
@@ -1,30 +1,66 @@
+import asyncio
 import urllib.parse
-import requests
 import base64
+from concurrent.futures import ThreadPoolExecutor
 from io import BytesIO
+from pathlib import Path
 from PIL import Image
-from typing import Dict, Tuple
+from typing import IO, Dict, Tuple, Union
 
 
 class ImageGenerator:
     def __init__(self, config: Dict):
         self.base_url = config["base_url"]
+        self.connect_timeout = config.get("connect_timeout", 10)
+        self.read_timeout = config.get("read_timeout", 120)
+        # Own threads: a cancelled request does not stop its provider call, hung
+        # calls must not fill the default executor of ingest, detection and SAM
+        self.executor = ThreadPoolExecutor(
+            config.get("max_concurrency", 8), thread_name_prefix="image-generation"
+        )
+
+    def fetch_image(
+        self, description: str, timeout: Union[float, None] = None
+    ) -> Tuple[bytes, str]:
+        """
+        Encoded image generated from a description, and its URL. `timeout` (e.g.
+        the remaining request budget) caps the configured connect/read timeouts.
+        """
+        import requests
 
-    def generate_image(self, description: str, output_path: str) -> Tuple[str, str]:
         escaped_prompt = urllib.parse.quote_plus(description)
         url = f"{self.base_url}{escaped_prompt}"
 
-        response = requests.get(url)
+        read_timeout = self.read_timeout
+        if timeout is not None:
+            read_timeout = max(0.1, min(read_timeout, timeout))
+        response = requests.get(
+            url, timeout=(min(self.connect_timeout, read_timeout), read_timeout)
+        )
         if response.status_code == 200:
-            with open(output_path, "wb") as f:
-                f.write(response.content)
-
-            output_img = Image.open(output_path)
-            img_byte_array = BytesIO()
-            output_img.save(img_byte_array, format="PNG")
-            img_byte_array.seek(0)
-            image_bytes = base64.b64encode(img_byte_array.getvalue()).decode("utf-8")
-
-            return image_bytes, url
+            return response.content, url
         else:
             raise Exception(f"Failed to generate image: {response.text}")
+
+    async def generate(
+        self, description: str, timeout: Union[float, None] = None
+    ) -> Tuple[bytes, str]:
+        """`fetch_image` on the generator's own threads."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, self.fetch_image, description, timeout
+        )
+
+    @staticmethod
+    def encode_image(image: Union[str, Path, IO[bytes]]) -> str:
+        """Base64 PNG of an output image, given its path or a file object."""
+        output_img = Image.open(image)
+        if output_img.format == "PNG":
+            # Already a PNG, no need to decode and encode it again
+            if isinstance(image, (str, Path)):
+                return base64.b64encode(Path(image).read_bytes()).decode("utf-8")
+            image.seek(0)
+            return base64.b64encode(image.read()).decode("utf-8")
+        img_byte_array = BytesIO()
+        output_img.save(img_byte_array, format="PNG")
+        img_byte_array.seek(0)
+        return base64.b64encode(img_byte_array.getvalue()).decode("utf-8")
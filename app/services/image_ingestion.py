@@ -0,0 +1,151 @@
+import io
+import time
+import logging
+from typing import Dict, Tuple, Union
+import numpy as np
+import numpy.typing as npt
+from PIL import Image, ImageOps
+from ..core.metrics import metrics
+from .perceptual_index import colour_thumbnail, dhash
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+def remove_transparency(
+    img: Image.Image, bg_colour: Tuple[int, int, int] = (255, 255, 255)
+) -> Image.Image:
+    # Only process if image has transparency
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        logger.log(logging.INFO, "Removing transparency from image %s", img)
+
+        # Convert image to RGBA if in LA mode, to access alpha channel
+        img = img.convert("RGBA")
+        alpha = img.split()[-1]
+
+        # Create a new image with the specified background color and paste original on it
+        bg = Image.new("RGBA", img.size, bg_colour + (255,))
+        bg.paste(img, mask=alpha)
+
+        # Convert to RGB to discard the alpha channel completely
+        result = bg.convert("RGB")
+        logger.log(
+            logging.DEBUG,
+            "Transparency removed and alpha channel discarded for image %s",
+            img,
+        )
+        return result
+    else:
+        return img
+
+
+class IngestedImage:
+    """
+    An upload decoded once to an upright RGB working image. Every stage shares
+    `image` (do not modify it) or the read-only `array`, and smaller copies are
+    cached by `resized()`.
+    """
+
+    def __init__(
+        self,
+        image: Image.Image,
+        original_size: Tuple[int, int],
+        decode_seconds: float,
+    ):
+        self.image = image
+        self.original_size = original_size
+        self.decode_seconds = decode_seconds
+        self._array: Union[npt.NDArray, None] = None
+        self._resized: Dict[int, Image.Image] = {}
+        self._perceptual_hash: Union[int, None] = None
+        self._colour_thumbnail: Union[str, None] = None
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        return self.image.size
+
+    @property
+    def array(self) -> npt.NDArray:
+        """HxWx3 uint8 view of the working image, converted on first use."""
+        if self._array is None:
+            array = np.asarray(self.image)
+            array.flags.writeable = False
+            self._array = array
+        return self._array
+
+    @property
+    def perceptual_hash(self) -> int:
+        """64-bit difference hash of the working image, computed on first use."""
+        if self._perceptual_hash is None:
+            self._perceptual_hash = dhash(self.image)
+        return self._perceptual_hash
+
+    @property
+    def colour_thumbnail(self) -> str:
+        """Colour thumbnail that confirms perceptual hash matches, computed once."""
+        if self._colour_thumbnail is None:
+            self._colour_thumbnail = colour_thumbnail(self.image)
+        return self._colour_thumbnail
+
+    def resized(self, max_size: Union[int, None]) -> Image.Image:
+        """The working image with its longest side capped at `max_size`, cached."""
+        if not max_size or max(self.size) <= max_size:
+            return self.image
+        if max_size not in self._resized:
+            image = self.image.copy()
+            image.thumbnail((max_size, max_size), Image.LANCZOS)
+            self._resized[max_size] = image
+        return self._resized[max_size]
+
+
+def ingest_image(data: bytes, max_size: Union[int, None] = None) -> IngestedImage:
+    """
+    Decodes an upload once (blocking). JPEGs are decoded in draft mode straight to
+    the smallest DCT scale that still covers `max_size`, so a large photo is never
+    fully decoded. EXIF orientation is applied and transparency flattened onto
+    white before the final downscale to `max_size`.
+    """
+    if not data:
+        raise ValueError("Uploaded file is empty")
+
+    start = time.perf_counter()
+    image = Image.open(io.BytesIO(data))
+    original_size = image.size
+    logger.log(
+        logging.INFO, "Image opened: %s %s %s", image.format, image.mode, original_size
+    )
+
+    if max_size and image.format == "JPEG" and max(original_size) > max_size:
+        # draft() keeps both sides at least as large as requested, so ask for the
+        # original aspect ratio with the longest side at max_size
+        scale = max_size / max(original_size)
+        image.draft(
+            "RGB",
+            (
+                max(1, round(original_size[0] * scale)),
+                max(1, round(original_size[1] * scale)),
+            ),
+        )
+
+    image = ImageOps.exif_transpose(image)
+    image = remove_transparency(image)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    if max_size and max(image.size) > max_size:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    image.load()
+
+    decode_seconds = time.perf_counter() - start
+    metrics.observe("image_decode_seconds", decode_seconds)
+    metrics.observe(
+        "image_upload_megapixels", original_size[0] * original_size[1] / 1e6
+    )
+    logger.log(
+        logging.INFO,
+        "Image decoded from %s to %s in %.0fms",
+        original_size,
+        image.size,
+        decode_seconds * 1000,
+    )
+    return IngestedImage(image, original_size, decode_seconds)
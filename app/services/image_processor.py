@@ -1,225 +1,1133 @@
+import io
 import os
+import json
+import time
+import asyncio
 import logging
-from typing import Dict, Any, Tuple
+from contextlib import asynccontextmanager
+from typing import (
+    TYPE_CHECKING,
+    AsyncIterator,
+    Dict,
+    Any,
+    Iterable,
+    List,
+    Tuple,
+    Union,
+)
 from pathlib import Path
-import tempfile
-from fastapi import UploadFile
+import numpy as np
 from PIL import Image
 
+from ..core.admission import MemoryAdmission
 from ..core.config import ConfigHandler
+from ..core.deadline import Deadline, DeadlineExceeded
+from ..core.gemini_governor import GeminiGovernor
+from ..core.metrics import metrics
 from ..core.prompt_manager import PromptManager
-from .keyword_extractor import KeywordExtractor
-from .object_detector import ObjectDetector
-from .segmentation import Segmentation
+from ..core.scheduler import BULK, INTERACTIVE, FairScheduler
+from ..core.tracing import tracer
+from .artifact_store import ArtifactStore
+from .keyword_extractor import KeywordExtractor, KeywordResponse
+from .object_detector import ObjectDetector, ObjectDetectorResult
+from .segmentation import Segmentation, SegmentationResult
 from .description_generator import DescriptionGenerator
+from .fused_description_generator import FusedDescriptionGenerator
 from .image_generator import ImageGenerator
+from .image_ingestion import IngestedImage, ingest_image, remove_transparency
+from .inference_backends import SAM_IMAGE_SIZE
+from .perceptual_index import PerceptualIndex, colour_difference
 from .toy_description_modifier import ToyDescriptionModifier
 
+if TYPE_CHECKING:
+    from fastapi import UploadFile
+
 
 logger = logging.getLogger("toy_transformer")
 
 
 class ImageProcessor:
-    def __init__(self, config: ConfigHandler):
+    def __init__(self, config: ConfigHandler, lazy: bool = False):
+        """
+        Cheap construction: with `lazy=True` the model weights and Gemini clients are
+        only created by `load()` (or on first use via `ensure_ready()`), so the API
+        can bind its port before the models are in memory.
+        """
         self.config = config
         self.prompt_manager = PromptManager(
             config_path=Path("config/prompts_config.yaml"),
             assets_base_path=Path("assets"),
         )
 
-        # Initialize services
+        # Uploads, masks, cutouts and outputs, stored once per content hash
+        storage_config = config.get_storage_config()
+        self.artifacts = ArtifactStore(
+            storage_config.get("artifact_dir", "artifacts"),
+            image_format=storage_config.get("image_format", "webp"),
+            quality=storage_config.get("image_quality", 85),
+            mmap_reads=storage_config.get("mmap_reads", False),
+            max_records=storage_config.get("max_records", 1000),
+        )
+        self.keep_intermediates = storage_config.get("keep_intermediates", True)
+
+        self.local_workers = max(1, config.get_batch_config().get("local_workers", 1))
+        self.batch_max_concurrency = config.get_batch_config().get("max_concurrency", 8)
+
+        self.profiles = {
+            name: config.get_profile_config(name)
+            for name in config.get_active_profiles()
+        }
+        self.default_profile = config.get_profile_config()["name"]
+
+        # Requests wait for a slot, handed out fairly across clients, then for
+        # their estimated memory cost to fit in a global budget
+        scheduler_config = dict(config.get_scheduler_config())
+        scheduler_config.pop("tenant_header", None)
+        self.scheduler = FairScheduler(**scheduler_config)
+        self.admission = MemoryAdmission(**config.get_admission_config())
+
+        # Longest side of the working image copy sent to Gemini
+        self.gemini_image_size = config.get_model_config("gemini").get(
+            "max_image_size", 1024
+        )
+
+        self.multi_object_config = config.get_multi_object_config()
+        self.fast_path_config = config.get_keyword_fast_path_config()
+        self.open_vocabulary: List[str] = []
+        # Moving average of the Gemini keyword stage, the latency a fast path hit saves
+        self.keyword_latency_ewma: Union[float, None] = None
+
+        # Perceptual hash index of processed uploads, for near-duplicate reuse
+        self.dedup_config = config.get_dedup_config()
+        self.dedup_reuse = self.dedup_config.get("reuse", "result")
+        self.duplicate_index = self._open_duplicate_index()
+
+        self.local_models_loaded = False
+        self.loaded = False
+        self.ready = False
+        self._ready_task: Union[asyncio.Task, None] = None
+
+        if not lazy:
+            self.load()
+
+        logger.log(logging.INFO, "ImageProcessor initialized")
+
+    def load(self):
+        """Loads the model weights and creates the service clients (blocking)."""
+        if self.loaded:
+            return
+
+        start = time.perf_counter()
+        self.load_local_models()
+
+        # Initialize services, all Gemini calls go through one shared governor
+        gemini_config = self.config.get_model_config("gemini")
+        self.gemini_governor = GeminiGovernor(**gemini_config.get("governor", {}))
         self.keyword_extractor = KeywordExtractor(
-            config.get_model_config("gemini"), self.prompt_manager
+            gemini_config, self.prompt_manager, self.gemini_governor
         )
-        self.object_detector = ObjectDetector(config.get_model_config("yolo"))
-        self.segmentation = Segmentation(config.get_model_config("sam"))
         self.description_generator = DescriptionGenerator(
-            config.get_model_config("gemini"), self.prompt_manager
+            gemini_config, self.prompt_manager, self.gemini_governor
         )
         self.toy_description_modifier = ToyDescriptionModifier(
-            config.get_model_config("gemini"), self.prompt_manager
+            gemini_config, self.prompt_manager, self.gemini_governor
+        )
+        self.fused_description_generator = FusedDescriptionGenerator(
+            gemini_config, self.prompt_manager, self.gemini_governor
+        )
+
+        self.image_generator = ImageGenerator(self.config.get_image_generation_config())
+
+        self.loaded = True
+        logger.log(logging.INFO, "Models loaded in %.2fs", time.perf_counter() - start)
+
+    def load_local_models(self):
+        """
+        Loads the YOLOWorld/SAM weights, the open vocabulary and the prompt images
+        (blocking). Starts no threads and opens no network clients, so a pre-fork
+        server calls it once in the master and the workers share the memory.
+        """
+        if self.local_models_loaded:
+            return
+
+        # Local models of every active profile, profiles with identical model
+        # settings share a pool. YOLOWorld.set_classes mutates the model, so each
+        # replica serves one image at a time. Inference runs off the event loop
+        # while Gemini calls overlap.
+        self.object_detectors: List[ObjectDetector] = []
+        self.segmentations: List[Segmentation] = []
+        self.detector_pools: Dict[str, asyncio.Queue] = {}
+        self.segmentation_pools: Dict[str, asyncio.Queue] = {}
+        for profile in self.profiles.values():
+            detector_key = self._model_key(profile["yolo"])
+            if detector_key not in self.detector_pools:
+                self.detector_pools[detector_key] = asyncio.Queue()
+                for _ in range(self.local_workers):
+                    object_detector = ObjectDetector(profile["yolo"])
+                    self.object_detectors.append(object_detector)
+                    self.detector_pools[detector_key].put_nowait(object_detector)
+
+            segmentation_key = self._model_key(profile["sam"])
+            if segmentation_key not in self.segmentation_pools:
+                self.segmentation_pools[segmentation_key] = asyncio.Queue()
+                for _ in range(self.local_workers):
+                    segmentation = Segmentation(profile["sam"])
+                    self.segmentations.append(segmentation)
+                    self.segmentation_pools[segmentation_key].put_nowait(segmentation)
+
+        self._load_open_vocabulary()
+
+        # Decode the prompt example images once
+        for prompt_type in self.prompt_manager.config["prompts"]:
+            self.prompt_manager.get_prompt_sequence(prompt_type)
+        for image in self.prompt_manager.image_cache.values():
+            image.load()
+
+        self.local_models_loaded = True
+
+    def after_fork(self, workers: int):
+        """
+        Per-worker state of a pre-forked server: each worker runs its share of the
+        pipeline slots and of the memory budget, and reopens the duplicate index,
+        inherited file descriptors would share their read offset with the others.
+        """
+        self.scheduler.max_concurrency = max(
+            1, self.scheduler.max_concurrency // workers
+        )
+        self.scheduler.interactive_reserved = min(
+            self.scheduler.interactive_reserved, self.scheduler.max_concurrency - 1
+        )
+        self.admission.budget = max(1, self.admission.budget // workers)
+        metrics.set_gauge("admission_memory_budget_bytes", self.admission.budget)
+        if self.duplicate_index is not None:
+            self.duplicate_index.close()
+            self.duplicate_index = self._open_duplicate_index()
+
+    def _load_open_vocabulary(self):
+        fast_path_profiles = [
+            p for p in self.profiles.values() if p["keyword_fast_path"]
+        ]
+        if not fast_path_profiles:
+            return
+
+        vocabulary_path = Path(
+            self.fast_path_config.get(
+                "vocabulary_path", "assets/vocabulary/open_vocabulary.txt"
+            )
+        )
+        with open(vocabulary_path, "r") as f:
+            lines = (line.strip() for line in f)
+            self.open_vocabulary = list(
+                dict.fromkeys(
+                    line for line in lines if line and not line.startswith("#")
+                )
+            )
+        logger.log(
+            logging.INFO,
+            "Keyword fast path vocabulary: %s classes",
+            len(self.open_vocabulary),
         )
 
-        self.image_generator = ImageGenerator(config.get_image_generation_config())
+        for profile in fast_path_profiles:
+            yolo_config = profile["yolo"]
+            max_classes = yolo_config.get("max_classes", 32)
+            if (
+                yolo_config.get("backend", "torch") != "torch"
+                and len(self.open_vocabulary) > max_classes
+            ):
+                logger.log(
+                    logging.WARNING,
+                    "Keyword fast path disabled for profile %s: "
+                    "the %s backend holds %s classes",
+                    profile["name"],
+                    yolo_config["backend"],
+                    max_classes,
+                )
+                profile["keyword_fast_path"] = False
 
-        self.max_output_storage = config.get_storage_config().get(
-            "max_output_storage", 30
+    def _open_duplicate_index(self) -> Union[PerceptualIndex, None]:
+        if not self.dedup_config.get("enabled", False):
+            return None
+        return PerceptualIndex(
+            self.dedup_config.get("index_dir", "index"),
+            max_distance=self.dedup_config.get("max_distance", 6),
         )
-        self.output_dir = Path(config.get_storage_config()["output_dir"])
 
-        logger.log(logging.INFO, "ImageProcessor initialized")
+    def warmup(self):
+        """
+        Runs every local model replica once on a synthetic image, so the first real
+        request does not pay for lazy initialisation, kernel selection and
+        first-touch allocations (blocking).
+        """
+        start = time.perf_counter()
+
+        width, height = 640, 480
+        image = Image.merge(
+            "RGB",
+            (
+                Image.linear_gradient("L").resize((width, height)),
+                Image.radial_gradient("L").resize((width, height)),
+                Image.new("L", (width, height), 128),
+            ),
+        )
+        box_xyxy = np.array([width / 4, height / 4, 3 * width / 4, 3 * height / 4])
+
+        for object_detector in self.object_detectors:
+            object_detector.detect_objects(image, ["object"])
+            if self.open_vocabulary:
+                # Caches the open vocabulary text embeddings of the replica
+                object_detector.detect_objects(image, self.open_vocabulary)
+        for segmentation in self.segmentations:
+            segmentation.segment_object(image, box_xyxy=box_xyxy)
+
+        logger.log(
+            logging.INFO, "Models warmed up in %.2fs", time.perf_counter() - start
+        )
+
+    async def _load_and_warmup(self, warmup: bool = True):
+        await asyncio.to_thread(self.load)
+        if warmup:
+            await asyncio.to_thread(self.warmup)
+        self.ready = True
+
+    def start_loading(self, warmup: bool = True) -> asyncio.Task:
+        """Starts loading (and warming up) the models in the background."""
+        if self._ready_task is None:
+            self._ready_task = asyncio.create_task(self._load_and_warmup(warmup))
+        return self._ready_task
+
+    async def ensure_ready(self):
+        """Waits for the models to be loaded, starting the load if nobody has yet."""
+        if self.ready:
+            return
+        if self._ready_task is not None and self._ready_task.done():
+            if self._ready_task.exception() is not None:
+                self._ready_task = None  # retry a failed load
+        task = self.start_loading()
+        # Shield so a cancelled request does not abort loading for everyone else
+        await asyncio.shield(task)
+
+    remove_transparency = staticmethod(remove_transparency)
 
     @staticmethod
-    def remove_transparency(
-        img: Image.Image, bg_colour: Tuple[int, int, int] = (255, 255, 255)
-    ) -> Image.Image:
-        # Only process if image has transparency
-        if img.mode in ("RGBA", "LA") or (
-            img.mode == "P" and "transparency" in img.info
-        ):
-            logger.log(logging.INFO, f"Removing transparency from image {img}")
-
-            # Convert image to RGBA if in LA mode, to access alpha channel
-            img = img.convert("RGBA")
-            alpha = img.split()[-1]
-
-            # Create a new image with the specified background color and paste original on it
-            bg = Image.new("RGBA", img.size, bg_colour + (255,))
-            bg.paste(img, mask=alpha)
-
-            # Convert to RGB to discard the alpha channel completely
-            result = bg.convert("RGB")
-            logger.log(
-                logging.DEBUG,
-                f"Transparency removed and alpha channel discarded for image {img}",
+    def _model_key(model_config: Dict[str, Any]) -> str:
+        return json.dumps(model_config, sort_keys=True)
+
+    def resolve_profile(self, name: Union[str, None] = None) -> Dict[str, Any]:
+        name = name or self.default_profile
+        if name not in self.profiles:
+            raise ValueError(
+                f"Unknown or inactive profile: {name}. "
+                f"Available profiles: {', '.join(self.profiles)}"
             )
-            return result
-        else:
-            return img
+        return self.profiles[name]
 
-    async def process_image(self, file: UploadFile) -> Dict[str, Any]:
-        logger.log(logging.INFO, f"Processing image {file}")
+    def upload_dimension(self, profile: Dict[str, Any]) -> int:
+        """
+        Longest side worth uploading for `profile`: its `max_image_size`, or for a
+        full resolution profile the largest input of its models (the detector
+        `imgsz`, the SAM image encoder and the Gemini working copy).
+        """
+        if profile["max_image_size"]:
+            return profile["max_image_size"]
+        return max(
+            profile["yolo"].get("imgsz", 640), SAM_IMAGE_SIZE, self.gemini_image_size
+        )
 
-        # Create temporary directory for processing
-        with tempfile.TemporaryDirectory() as temp_dir:
-            logger.log(logging.DEBUG, f"Temporary directory created: {temp_dir}")
+    @staticmethod
+    @asynccontextmanager
+    async def _acquire(pool: asyncio.Queue):
+        model = await pool.get()
+        try:
+            yield model
+        finally:
+            pool.put_nowait(model)
 
-            # Save uploaded file
-            temp_path = Path(temp_dir) / "input.jpg"
-            with open(temp_path, "wb") as f:
-                f.write(await file.read())
+    async def process_image(
+        self,
+        file: "UploadFile",
+        profile: Union[str, None] = None,
+        deadline: Union[Deadline, None] = None,
+        max_objects: int = 1,
+        tenant: str = "local",
+        lane: str = INTERACTIVE,
+    ) -> Dict[str, Any]:
+        logger.log(logging.INFO, "Processing image %s", file)
+        return await self.process_image_bytes(
+            await file.read(),
+            file.filename,
+            profile=profile,
+            deadline=deadline,
+            max_objects=max_objects,
+            tenant=tenant,
+            lane=lane,
+        )
 
-            fsize = os.path.getsize(temp_path)
-            if fsize == 0:
-                logger.log(logging.ERROR, f"Uploaded file {temp_path} is empty")
-                raise Exception("Uploaded file is empty")
-            logger.log(logging.DEBUG, f"File saved size: {fsize}")
+    async def _process_batch_item(
+        self,
+        index: int,
+        filename: str,
+        data: Union[bytes, Path],
+        profile: Union[str, None] = None,
+        tenant: str = "local",
+    ) -> Dict[str, Any]:
+        start = asyncio.get_running_loop().time()
+        try:
+            if isinstance(data, Path):
+                data = await asyncio.to_thread(data.read_bytes)
+            result = await self.process_image_bytes(
+                data, filename, profile=profile, tenant=tenant, lane=BULK
+            )
+            item = {"success": True, "error": None, **result}
+        except Exception as e:
+            logger.log(logging.ERROR, "Error processing %s: %s", filename, e)
+            item = {"success": False, "error": str(e)}
+        item.update(
+            index=index,
+            filename=filename,
+            elapsed=asyncio.get_running_loop().time() - start,
+        )
+        return item
 
-            # Process image through pipeline
-            try:
-                image = Image.open(temp_path)
-                logger.log(logging.INFO, f"Image loaded {image}")
-            except Exception as e:
-                logger.log(logging.ERROR, f"Error loading image: {e}")
-                raise e
+    async def process_batch(
+        self,
+        items: Iterable[Tuple[str, Union[bytes, Path]]],
+        max_concurrency: Union[int, None] = None,
+        profile: Union[str, None] = None,
+        tenant: str = "local",
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Runs every (filename, data) item through the pipeline with at most
+        `max_concurrency` images in flight, in the bulk lane of `tenant`, yielding
+        one result per item in completion order. `data` may be a Path, read only
+        when the item is scheduled, so large runs keep a bounded amount of image
+        data in memory. Failures are reported in the item's `error` field.
+        """
+        max_concurrency = max_concurrency or self.batch_max_concurrency
+        self.resolve_profile(profile)
+        pending_items = enumerate(items)
+        pending = set()
 
-            image = self.remove_transparency(image)
+        try:
+            while True:
+                while len(pending) < max_concurrency:
+                    next_item = next(pending_items, None)
+                    if next_item is None:
+                        break
+                    index, (filename, data) = next_item
+                    pending.add(
+                        asyncio.create_task(
+                            self._process_batch_item(
+                                index, filename, data, profile, tenant
+                            )
+                        )
+                    )
 
-            # Extract keywords
-            try:
-                keywords = await self.keyword_extractor(image)
-                logger.log(logging.INFO, f"Keywords extracted: {keywords}")
-            except Exception as e:
-                logger.log(logging.ERROR, f"Error extracting keywords: {e}")
-                raise e
+                if not pending:
+                    break
 
-            try:
-                # Detect objects
-                detection_result = self.object_detector.detect_objects(
-                    image, keywords["main_objects"]
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
                 )
-                if (
-                    detection_result["main_class"] is None
-                    and detection_result["boxes_xyxy"] == []
-                ):
-                    raise Exception("No main object detected")
-                else:
-                    boxes_xywh = detection_result["boxes_xywh"]
-                    boxes_xyxy = detection_result["boxes_xyxy"]
-                    main_class = detection_result["main_class"]
-                    classes_detected = detection_result["classes"]
-
-                    highest_score_box_xywh = detection_result["highest_score_box_xywh"]
-                    highest_score_box_xyxy = detection_result["highest_score_box_xyxy"]
-
-                logger.log(logging.INFO, f"Object detected: {main_class}")
-                logger.log(logging.INFO, f"Classes detected: {classes_detected}")
-                logger.log(logging.INFO, f"Highest score box: {highest_score_box_xyxy}")
-                logger.log(logging.DEBUG, f"Boxes detected: {boxes_xyxy}")
-                logger.log(logging.DEBUG, f"Boxes detected: {boxes_xywh}")
-            except Exception as e:
-                logger.log(logging.ERROR, f"Error detecting objects: {e}")
-                raise e
+                for task in done:
+                    yield task.result()
+        finally:
+            # Reached early when the consumer stops, e.g. the client disconnected
+            if pending:
+                metrics.inc("requests_cancelled", len(pending), reason="batch_aborted")
+            for task in pending:
+                task.cancel()
+
+    async def process_image_bytes(
+        self,
+        data: bytes,
+        filename: str,
+        profile: Union[str, None] = None,
+        deadline: Union[Deadline, None] = None,
+        max_objects: int = 1,
+        tenant: str = "local",
+        lane: str = INTERACTIVE,
+    ) -> Dict[str, Any]:
+        """
+        Runs the pipeline within `deadline`, which defaults to the profile timeout.
+        Each stage checks the remaining budget and the Gemini services skip optional
+        samples when time is short. With `max_objects` > 1 the toy images of up to
+        that many objects are generated, see `process_objects`. The request waits
+        for a slot of `tenant` in the interactive or bulk `lane` of the scheduler.
+        """
+        with tracer.span("process_image", filename=filename, profile=profile):
+            profile_config = self.resolve_profile(profile)
+            if deadline is None:
+                deadline = Deadline(profile_config["timeout"])
+            # Rejects images above the pixel ceiling before anything is decoded
+            memory_cost = self.admission.estimate(
+                data, profile_config["max_image_size"]
+            )
+            await self.ensure_ready()
 
             try:
-                # Segment main object
-                segmentation_result = self.segmentation.segment_object(
-                    image, box_xyxy=highest_score_box_xyxy
+                return await asyncio.wait_for(
+                    self._run_admitted(
+                        data,
+                        filename,
+                        profile_config,
+                        deadline,
+                        memory_cost,
+                        max_objects,
+                        tenant,
+                        lane,
+                    ),
+                    deadline.remaining(),
+                )
+            except (asyncio.TimeoutError, DeadlineExceeded):
+                logger.log(
+                    logging.ERROR,
+                    "Processing %s exceeded its %ss deadline (profile %s)",
+                    filename,
+                    deadline.timeout,
+                    profile_config["name"],
+                )
+                metrics.inc(
+                    "requests_deadline_exceeded", profile=profile_config["name"]
+                )
+                raise DeadlineExceeded(
+                    f"Processing exceeded the {deadline.timeout}s deadline"
                 )
-                logger.log(logging.INFO, f"Object {image} segmented")
-                logger.log(logging.DEBUG, f"Object segmented {segmentation_result}")
-
-                if segmentation_result is None:
-                    raise Exception("Error segmenting object")
-                else:
-                    segmented_image = segmentation_result["isolated_object"]
-                    segmented_image_box_crop = segmentation_result[
-                        "isolated_box_cutout"
-                    ]
-                    bianry_mask = segmentation_result["binary_mask"]
-
-                # Save segmented image
-                seg_path = Path(temp_dir) / "segmented.png"
-                logger.log(logging.DEBUG, f"Saving segmented image: {seg_path}")
-                segmented_image.save(seg_path)
-                logger.log(logging.DEBUG, f"Segmented image saved: {seg_path}")
-
-                # Save box crop
-                box_crop_path = Path(temp_dir) / "box_crop.png"
-                logger.log(logging.DEBUG, f"Saving box crop: {box_crop_path}")
-                segmented_image_box_crop.save(box_crop_path)
-                logger.log(logging.DEBUG, f"Box crop saved: {box_crop_path}")
-            except Exception as e:
-                logger.log(logging.ERROR, f"Error segmenting object: {e}")
-                raise e
 
+    async def _run_admitted(
+        self,
+        data: bytes,
+        filename: str,
+        profile: Dict[str, Any],
+        deadline: Deadline,
+        memory_cost: int,
+        max_objects: int = 1,
+        tenant: str = "local",
+        lane: str = INTERACTIVE,
+    ) -> Dict[str, Any]:
+        with tracer.span("queue_wait", tenant=tenant, lane=lane):
+            await self.scheduler.acquire(tenant, lane)
+        try:
+            with tracer.span("admission_wait", memory_cost=memory_cost):
+                held = await self.admission.acquire(memory_cost)
             try:
-                if main_class is None:
-                    classes_detected = keywords["main_objects"]
-                    logger.log(
-                        logging.INFO,
-                        f"Main object not detected, fallback to LLM keywords: {classes_detected}",
+                return await self._run_pipeline(
+                    data, filename, profile, deadline, max_objects
+                )
+            finally:
+                self.admission.release(held)
+        finally:
+            self.scheduler.release(tenant, lane)
+
+    async def _keyword_fast_path(
+        self, image: Image.Image, detector_pool: asyncio.Queue, deadline: Deadline
+    ) -> Union[ObjectDetectorResult, None]:
+        """
+        Detects with the open vocabulary and returns the result when the main box is
+        confident enough to skip the Gemini keyword extraction, None otherwise.
+        """
+        deadline.check("keyword fast path")
+        start = time.perf_counter()
+        with tracer.span("keyword_fast_path") as span:
+            async with self._acquire(detector_pool) as object_detector:
+                result = await asyncio.to_thread(
+                    object_detector.detect_confident,
+                    image,
+                    self.open_vocabulary,
+                    min_confidence=self.fast_path_config.get("min_confidence", 0.6),
+                    min_area_ratio=self.fast_path_config.get("min_area_ratio", 0.05),
+                    min_score=self.fast_path_config.get("min_score", 1.3),
+                )
+            outcome = "hit" if result is not None else "miss"
+            if span is not None:
+                span.set(outcome=outcome)
+        elapsed = time.perf_counter() - start
+
+        metrics.inc("keyword_fast_path", outcome=outcome)
+        metrics.observe("keyword_fast_path_seconds", elapsed, outcome=outcome)
+        hits = metrics.get_counter("keyword_fast_path", outcome="hit")
+        total = hits + metrics.get_counter("keyword_fast_path", outcome="miss")
+        metrics.set_gauge("keyword_fast_path_hit_ratio", hits / total)
+        if result is not None and self.keyword_latency_ewma is not None:
+            metrics.observe(
+                "keyword_fast_path_saved_seconds", self.keyword_latency_ewma - elapsed
+            )
+        return result
+
+    async def _extract_keywords(
+        self, image: Image.Image, samples: Dict[str, int], deadline: Deadline
+    ) -> KeywordResponse:
+        start = time.perf_counter()
+        with tracer.span("keyword_extraction"):
+            keywords = await self.keyword_extractor(
+                image,
+                max_total_tasks=samples.get("keyword_extractor"),
+                deadline=deadline,
+            )
+        elapsed = time.perf_counter() - start
+        metrics.observe("keyword_extraction_seconds", elapsed)
+        if self.keyword_latency_ewma is None:
+            self.keyword_latency_ewma = elapsed
+        else:
+            self.keyword_latency_ewma = 0.8 * self.keyword_latency_ewma + 0.2 * elapsed
+        return keywords
+
+    async def _run_pipeline(
+        self,
+        data: bytes,
+        filename: str,
+        profile: Dict[str, Any],
+        deadline: Deadline,
+        max_objects: int = 1,
+    ) -> Dict[str, Any]:
+        # Decode once, straight to the profile's working resolution
+        try:
+            with tracer.span("ingest", bytes=len(data)) as span:
+                ingested = await asyncio.to_thread(
+                    ingest_image, data, profile["max_image_size"]
+                )
+                if span is not None:
+                    span.set(
+                        original_size=str(ingested.original_size),
+                        size=str(ingested.size),
                     )
+        except Exception as e:
+            logger.log(logging.ERROR, "Error loading image %s: %s", filename, e)
+            raise e
 
-                # Generate description
-                description = await self.description_generator(
-                    Image.open(seg_path),
-                    detected_keywords=classes_detected,
-                    main_keyword=main_class,
+        # Stored as it is while the pipeline runs, only the record needs it
+        upload = asyncio.create_task(self._store_upload(data))
+
+        # Near-duplicate of an earlier upload: reuse its result or analysis
+        if self.duplicate_index is not None and max_objects == 1:
+            reused = await self._reuse_duplicate(
+                ingested, filename, profile, deadline, upload
+            )
+            if reused is not None:
+                return reused
+
+        if max_objects > 1:
+            return await self.process_objects(
+                ingested, filename, profile, deadline, max_objects, upload
+            )
+
+        analysis = await self.analyze(ingested, profile, deadline)
+        result = await self.generate_output(
+            filename, analysis, deadline, profile, upload=upload
+        )
+        await self._remember(ingested, result, analysis["keywords"], profile)
+        return result
+
+    async def detect(
+        self, image: Image.Image, classes: List[str], profile: Dict[str, Any]
+    ) -> ObjectDetectorResult:
+        """Runs the profile's detector on `image` with the `classes` vocabulary."""
+        detector_pool = self.detector_pools[self._model_key(profile["yolo"])]
+        with tracer.span("detection", classes=len(classes)):
+            async with self._acquire(detector_pool) as object_detector:
+                return await asyncio.to_thread(
+                    object_detector.detect_objects, image, classes
                 )
-                logger.log(logging.INFO, f"Description generated: {description}")
-            except Exception as e:
-                logger.log(logging.ERROR, f"Error generating description: {e}")
-                raise e
 
-            try:
-                # Modify description for toy
-                toy_description = await self.toy_description_modifier(
-                    Image.open(temp_path), description
+    async def _locate(
+        self, ingested: IngestedImage, profile: Dict[str, Any], deadline: Deadline
+    ) -> Tuple[KeywordResponse, ObjectDetectorResult]:
+        """Keywords of the image and the detection of those keywords."""
+        samples = profile["samples"]
+        detector_pool = self.detector_pools[self._model_key(profile["yolo"])]
+        image = ingested.image
+
+        # A confident open vocabulary detection replaces the Gemini keywords
+        detection_result = None
+        if profile["keyword_fast_path"]:
+            detection_result = await self._keyword_fast_path(
+                image, detector_pool, deadline
+            )
+
+        # Extract keywords
+        try:
+            if detection_result is not None:
+                keywords = KeywordResponse(
+                    reasoning="Local open vocabulary detection",
+                    main_objects=list(
+                        dict.fromkeys(
+                            [detection_result["main_class"]]
+                            + detection_result["classes"]
+                        )
+                    ),
+                )
+            else:
+                keywords = await self._extract_keywords(
+                    ingested.resized(self.gemini_image_size), samples, deadline
+                )
+            logger.log(logging.INFO, "Keywords extracted: %s", keywords)
+        except Exception as e:
+            logger.log(logging.ERROR, "Error extracting keywords: %s", e)
+            raise e
+
+        try:
+            # Detect objects
+            if detection_result is None:
+                deadline.check("object detection")
+                detection_result = await self.detect(
+                    image, keywords["main_objects"], profile
                 )
-                logger.log(logging.INFO, f"Modified toy description: {toy_description}")
-            except Exception as e:
-                logger.log(logging.ERROR, f"Error modifying description: {e}")
-                raise e
+            if (
+                detection_result["main_class"] is None
+                and detection_result["boxes_xyxy"] == []
+            ):
+                raise Exception("No main object detected")
+
+            logger.log(
+                logging.INFO, "Object detected: %s", detection_result["main_class"]
+            )
+            logger.log(
+                logging.INFO, "Classes detected: %s", detection_result["classes"]
+            )
+            logger.log(
+                logging.INFO,
+                "Highest score box: %s",
+                detection_result["highest_score_box_xyxy"],
+            )
+            logger.log(
+                logging.DEBUG, "Boxes detected: %s", detection_result["boxes_xyxy"]
+            )
+            logger.log(
+                logging.DEBUG, "Boxes detected: %s", detection_result["boxes_xywh"]
+            )
+        except Exception as e:
+            logger.log(logging.ERROR, "Error detecting objects: %s", e)
+            raise e
+
+        return keywords, detection_result
+
+    async def _segment(
+        self,
+        ingested: IngestedImage,
+        boxes_xyxy: List[np.ndarray],
+        profile: Dict[str, Any],
+        deadline: Deadline,
+    ) -> List[SegmentationResult]:
+        """Segments every box with one SAM call."""
+        segmentation_pool = self.segmentation_pools[self._model_key(profile["sam"])]
+        try:
+            deadline.check("segmentation")
+            with tracer.span("segmentation", boxes=len(boxes_xyxy)):
+                async with self._acquire(segmentation_pool) as segmentation:
+                    segmentation_results = await asyncio.to_thread(
+                        segmentation.segment_objects, ingested.array, boxes_xyxy
+                    )
+            logger.log(logging.INFO, "Objects segmented: %s", len(boxes_xyxy))
+        except Exception as e:
+            logger.log(logging.ERROR, "Error segmenting object: %s", e)
+            raise e
+        return segmentation_results
+
+    async def _describe(
+        self,
+        segmented_image: Image.Image,
+        context_image: Image.Image,
+        classes_detected: List[str],
+        main_class: Union[str, None],
+        profile: Dict[str, Any],
+        deadline: Deadline,
+    ) -> Tuple[str, str]:
+        """
+        Description of the segmented object and its toy rewrite, which also sees
+        `context_image`.
+        """
+        samples = profile["samples"]
+        try:
+            if profile["fused_description"]:
+                # Description and toy description in one structured call
+                with tracer.span("fused_description"):
+                    fused = await self.fused_description_generator(
+                        segmented_image,
+                        detected_keywords=classes_detected,
+                        main_keyword=main_class,
+                        max_total_tasks=samples.get("fused_descriptor"),
+                        deadline=deadline,
+                    )
+                description = fused["description"]
+                toy_description = fused["toy_description"]
+            else:
+                # Generate description
+                with tracer.span("description"):
+                    description = await self.description_generator(
+                        segmented_image,
+                        detected_keywords=classes_detected,
+                        main_keyword=main_class,
+                        max_total_tasks=samples.get("image_descriptor"),
+                        deadline=deadline,
+                    )
+                toy_description = None
+            logger.log(logging.INFO, "Description generated: %s", description)
+        except Exception as e:
+            logger.log(logging.ERROR, "Error generating description: %s", e)
+            raise e
+
+        try:
+            if toy_description is None:
+                # Modify description for toy
+                with tracer.span("toy_description"):
+                    toy_description = await self.toy_description_modifier(
+                        context_image,
+                        description,
+                        max_total_tasks=samples.get("toy_desc_modifier"),
+                        deadline=deadline,
+                    )
+            logger.log(logging.INFO, "Modified toy description: %s", toy_description)
+        except Exception as e:
+            logger.log(logging.ERROR, "Error modifying description: %s", e)
+            raise e
+
+        return description, toy_description
+
+    async def analyze(
+        self, ingested: IngestedImage, profile: Dict[str, Any], deadline: Deadline
+    ) -> Dict[str, Any]:
+        """
+        Keywords, detection, segmentation and descriptions of a decoded image, every
+        stage of the pipeline but the toy image generation.
+        """
+        keywords, detection_result = await self._locate(ingested, profile, deadline)
+        main_class = detection_result["main_class"]
+        classes_detected = detection_result["classes"]
+        highest_score_box_xyxy = detection_result["highest_score_box_xyxy"]
 
-            # Check how many files are in the output directory and delete the oldest one if there are more than 30
-            files = list(self.output_dir.iterdir())
-            if len(files) > self.max_output_storage:
-                oldest_file = min(files, key=lambda p: p.stat().st_ctime)
-                logger.log(logging.INFO, f"Deleting oldest file: {oldest_file}")
-                oldest_file.unlink()
+        # Segment main object
+        segmentation_result = (
+            await self._segment(ingested, [highest_score_box_xyxy], profile, deadline)
+        )[0]
 
-            output_path = self.output_dir / os.path.basename(file.filename)
-            image_bytes, image_url = self.image_generator.generate_image(
-                toy_description, str(output_path)
+        if main_class is None:
+            classes_detected = keywords["main_objects"]
+            logger.log(
+                logging.INFO,
+                "Main object not detected, fallback to LLM keywords: %s",
+                classes_detected,
             )
-            logger.log(logging.INFO, f"Image generated: {image_url}")
 
+        intermediates = asyncio.create_task(
+            self._store_segmentation(segmentation_result)
+        )
+        description, toy_description = await self._describe(
+            segmentation_result["isolated_object"],
+            ingested.resized(self.gemini_image_size),
+            classes_detected,
+            main_class,
+            profile,
+            deadline,
+        )
+
+        return {
+            "keywords": keywords["main_objects"],
+            "main_object": main_class,
+            "detected_objects": classes_detected,
+            "box_xyxy": highest_score_box_xyxy,
+            "description": description,
+            "toy_description": toy_description,
+            **await intermediates,
+        }
+
+    async def _store_upload(self, data: bytes) -> Union[str, None]:
+        """Artifact id of the upload bytes, None if they could not be stored."""
+        try:
+            return await asyncio.to_thread(self.artifacts.put_file, data)
+        except Exception as e:
+            logger.log(logging.WARNING, "Error storing upload: %s", e)
+            return None
+
+    async def _store_segmentation(
+        self, segmentation_result: SegmentationResult
+    ) -> Dict[str, str]:
+        """
+        Artifact ids of the mask and cutout, none without `keep_intermediates` or
+        when they could not be stored.
+        """
+        if not self.keep_intermediates:
+            return {}
+
+        def store() -> Dict[str, str]:
             return {
-                "image_url": image_url,
-                "description": description,
-                "image_bytes": image_bytes,
-                "toy_description": toy_description,
-                "main_object": main_class,
-                "detected_objects": classes_detected,
+                "mask": self.artifacts.put_mask(segmentation_result["binary_mask"]),
+                "cutout": self.artifacts.put_image(
+                    segmentation_result["isolated_box_cutout"]
+                ),
             }
+
+        try:
+            with tracer.span("store_segmentation"):
+                return await asyncio.to_thread(store)
+        except Exception as e:
+            logger.log(logging.WARNING, "Error storing segmentation: %s", e)
+            return {}
+
+    async def process_objects(
+        self,
+        ingested: IngestedImage,
+        filename: str,
+        profile: Dict[str, Any],
+        deadline: Deadline,
+        max_objects: int,
+        upload: Union["asyncio.Task[Union[str, None]]", None] = None,
+    ) -> Dict[str, Any]:
+        """
+        Toy images of up to `max_objects` detected objects. Keywords and detection
+        run once, the boxes are segmented in one SAM call, then each object's
+        descriptions and image generation run in parallel, `multi_object.concurrency`
+        objects at a time. The result is the one of the best object, with every
+        object under "objects". Objects that fail are left out.
+        """
+        keywords, detection_result = await self._locate(ingested, profile, deadline)
+        indices = ObjectDetector.top_objects(
+            detection_result,
+            max_objects,
+            overlap_iou=self.multi_object_config.get("overlap_iou", 0.6),
+        )
+        if detection_result["scores"]:
+            boxes_xyxy = [detection_result["boxes_xyxy"][i] for i in indices]
+            classes = [detection_result["classes"][i] for i in indices]
+            scores: List[Union[float, None]] = [
+                detection_result["scores"][i] for i in indices
+            ]
+        else:
+            boxes_xyxy = [detection_result["highest_score_box_xyxy"]]
+            classes = [None]
+            scores = [None]
+        classes_detected = detection_result["classes"] or keywords["main_objects"]
+
+        segmentation_results = await self._segment(
+            ingested, boxes_xyxy, profile, deadline
+        )
+
+        slots = asyncio.Semaphore(self.multi_object_config.get("concurrency", 3))
+        stem, suffix = os.path.splitext(os.path.basename(filename))
+
+        async def process_object(index: int) -> Dict[str, Any]:
+            segmentation_result = segmentation_results[index]
+            async with slots:
+                with tracer.span("object", index=index, main_object=classes[index]):
+                    intermediates = asyncio.create_task(
+                        self._store_segmentation(segmentation_result)
+                    )
+                    description, toy_description = await self._describe(
+                        segmentation_result["isolated_object"],
+                        segmentation_result["isolated_box_cutout"],
+                        classes_detected,
+                        classes[index],
+                        profile,
+                        deadline,
+                    )
+                    result = await self.generate_output(
+                        f"{stem}-{index}{suffix}",
+                        {
+                            "main_object": classes[index],
+                            "detected_objects": classes_detected,
+                            "description": description,
+                            "toy_description": toy_description,
+                            **await intermediates,
+                        },
+                        deadline,
+                        profile,
+                        upload=upload,
+                    )
+            result["box_xyxy"] = np.asarray(boxes_xyxy[index]).tolist()
+            result["score"] = scores[index]
+            return result
+
+        outcomes = await asyncio.gather(
+            *(process_object(i) for i in range(len(boxes_xyxy))),
+            return_exceptions=True,
+        )
+        objects = []
+        for outcome in outcomes:
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            if isinstance(outcome, BaseException):
+                logger.log(logging.ERROR, "Error processing object: %s", outcome)
+                continue
+            objects.append(outcome)
+        if not objects:
+            raise next(o for o in outcomes if isinstance(o, BaseException))
+
+        metrics.observe("multi_object_objects", len(objects))
+        return {**objects[0], "objects": objects}
+
+    async def generate_output(
+        self,
+        filename: str,
+        analysis: Dict[str, Any],
+        deadline: Deadline,
+        profile: Dict[str, Any],
+        upload: Union["asyncio.Task[Union[str, None]]", None] = None,
+    ) -> Dict[str, Any]:
+        """
+        Generates the toy image of an analysis, stores it as an artifact and records
+        it with the artifacts it was made from: the mask and cutout of the analysis
+        and the result of the `upload` storing task.
+        """
+        deadline.check("image generation")
+        with tracer.span("image_generation"):
+            data, image_url = await self.image_generator.generate(
+                analysis["toy_description"], timeout=deadline.remaining()
+            )
+        logger.log(logging.INFO, "Image generated: %s", image_url)
+
+        upload_id = await upload if upload is not None else None
+
+        def store() -> Tuple[str, str]:
+            # The provider's JPEGs are kept, other formats encoded once as WebP
+            artifact_id = self.artifacts.put_image(data)
+            self.artifacts.add_record(
+                {
+                    "filename": os.path.basename(filename),
+                    "profile": profile["name"],
+                    "upload": upload_id,
+                    "mask": analysis.get("mask"),
+                    "cutout": analysis.get("cutout"),
+                    "output": artifact_id,
+                    "main_object": analysis["main_object"],
+                    "toy_description": analysis["toy_description"],
+                }
+            )
+            return artifact_id, self.image_generator.encode_image(io.BytesIO(data))
+
+        with tracer.span("store_output"):
+            artifact_id, image_bytes = await asyncio.to_thread(store)
+
+        return {
+            "image_url": image_url,
+            "description": analysis["description"],
+            "image_bytes": image_bytes,
+            "toy_description": analysis["toy_description"],
+            "main_object": analysis["main_object"],
+            "detected_objects": analysis["detected_objects"],
+            "artifact_id": artifact_id,
+        }
+
+    async def _remember(
+        self,
+        ingested: IngestedImage,
+        result: Dict[str, Any],
+        keywords: List[str],
+        profile: Dict[str, Any],
+    ):
+        """Indexes a processed upload so that near-duplicates can reuse it."""
+        if self.duplicate_index is None:
+            return
+        record = {
+            "profile": profile["name"],
+            "keywords": keywords,
+            "main_object": result["main_object"],
+            "detected_objects": result["detected_objects"],
+            "description": result["description"],
+            "toy_description": result["toy_description"],
+            "image_url": result["image_url"],
+            "artifact_id": result["artifact_id"],
+        }
+
+        def add():
+            record["colour_thumbnail"] = ingested.colour_thumbnail
+            self.duplicate_index.add(ingested.perceptual_hash, record)
+
+        try:
+            await asyncio.to_thread(add)
+        except Exception as e:
+            # The result is still valid, it just cannot be reused
+            logger.log(
+                logging.WARNING, "Error indexing %s: %s", result["artifact_id"], e
+            )
+
+    def _read_stored_output(self, record: Dict[str, Any]) -> Union[str, None]:
+        """Base64 PNG of a record's output image, None if it was pruned."""
+        # Records of the old output directory have no artifact, their file may
+        # have been replaced under the same name
+        if "artifact_id" not in record:
+            return None
+        try:
+            return self.image_generator.encode_image(
+                self.artifacts.path(record["artifact_id"])
+            )
+        except OSError:
+            return None
+
+    def _lookup(
+        self, ingested: IngestedImage, profile: Dict[str, Any]
+    ) -> Union[Tuple[Dict[str, Any], int], None]:
+        """Nearest indexed record of `profile` and its distance, or None (blocking)."""
+        max_difference = self.dedup_config.get("max_colour_difference", 0.02)
+
+        def accept(record: Dict[str, Any]) -> bool:
+            # A hash match alone may be another product of the same shape and
+            # layout, only reuse records whose colours match too
+            return (
+                record["profile"] == profile["name"]
+                and "colour_thumbnail" in record
+                and colour_difference(
+                    record["colour_thumbnail"], ingested.colour_thumbnail
+                )
+                <= max_difference
+            )
+
+        match = self.duplicate_index.search(ingested.perceptual_hash, accept=accept)
+        if match is None:
+            return None
+        entry, distance = match
+        return self.duplicate_index.get(entry), distance
+
+    async def _reuse_duplicate(
+        self,
+        ingested: IngestedImage,
+        filename: str,
+        profile: Dict[str, Any],
+        deadline: Deadline,
+        upload: Union["asyncio.Task[Union[str, None]]", None] = None,
+    ) -> Union[Dict[str, Any], None]:
+        """
+        Result for a near-duplicate of an indexed upload of the same profile, or None
+        when there is no match and the full pipeline has to run.
+        """
+        start = time.perf_counter()
+        with tracer.span("duplicate_lookup"):
+            match = await asyncio.to_thread(self._lookup, ingested, profile)
+        metrics.observe("duplicate_lookup_seconds", time.perf_counter() - start)
+        if match is None:
+            metrics.inc("duplicate_lookups", outcome="miss")
+            return None
+
+        record, distance = match
+        metrics.observe("duplicate_distance_bits", distance)
+        logger.log(
+            logging.INFO,
+            "%s is a near-duplicate (%s bits) of an earlier upload",
+            filename,
+            distance,
+        )
+
+        output_gone = False
+        if self.dedup_reuse == "result":
+            image_bytes = await asyncio.to_thread(self._read_stored_output, record)
+            if image_bytes is not None:
+                metrics.inc("duplicate_lookups", outcome="result")
+                return {
+                    "image_url": record["image_url"],
+                    "description": record["description"],
+                    "image_bytes": image_bytes,
+                    "toy_description": record["toy_description"],
+                    "main_object": record["main_object"],
+                    "detected_objects": record["detected_objects"],
+                    "artifact_id": record["artifact_id"],
+                }
+            logger.log(logging.INFO, "Stored output of %s is gone", filename)
+            output_gone = True
+
+        # Only the toy image is generated again
+        metrics.inc("duplicate_lookups", outcome="analysis")
+        result = await self.generate_output(
+            filename, record, deadline, profile, upload=upload
+        )
+        # The matched record covers this upload already, unless its output is gone
+        if output_gone:
+            await self._remember(ingested, result, record["keywords"], profile)
+        return result
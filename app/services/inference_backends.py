@@ -0,0 +1,488 @@
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Tuple
+import numpy as np
+import numpy.typing as npt
+from PIL import Image
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+DETECTOR_BACKENDS = ("torch", "onnx", "openvino")
+SEGMENTATION_BACKENDS = ("torch", "onnx", "openvino")
+
+# Longest side the SAM 2 image encoder resizes its input to
+SAM_IMAGE_SIZE = 1024
+# Pixel normalization of the SAM predictor
+_SAM_MEAN = np.array([123.675, 116.28, 103.53], dtype=np.float32)
+_SAM_STD = np.array([58.395, 57.12, 57.375], dtype=np.float32)
+
+
+def _quantized(onnx_path: Path, runtime: str) -> Path:
+    """Dynamically INT8-quantized copy of an exported graph, made once."""
+    if runtime != "onnx":
+        logger.log(
+            logging.WARNING,
+            "Dynamic INT8 quantization is only available for the onnx backend",
+        )
+        return onnx_path
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = onnx_path.with_name(onnx_path.stem + "_int8.onnx")
+    if not int8_path.exists():
+        logger.log(logging.INFO, "Quantizing %s to %s", onnx_path, int8_path)
+        quantize_dynamic(str(onnx_path), str(int8_path), weight_type=QuantType.QInt8)
+    return int8_path
+
+
+def _load_graph(onnx_path: Path, runtime: str, inputs: List[str]):
+    """
+    Callable running an exported graph on CPU with ONNX Runtime or OpenVINO. It
+    takes the arrays of `inputs` in order and returns the list of outputs.
+    """
+    if runtime == "onnx":
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError(
+                "The onnx backends require `pip install onnxruntime`"
+            ) from e
+        session = ort.InferenceSession(
+            str(onnx_path), providers=["CPUExecutionProvider"]
+        )
+        return lambda *arrays: session.run(None, dict(zip(inputs, arrays)))
+
+    try:
+        import openvino as ov
+    except ImportError as e:
+        raise ImportError("The openvino backends require `pip install openvino`") from e
+    compiled = ov.Core().compile_model(str(onnx_path), "CPU")
+
+    def run(*arrays):
+        outputs = compiled(dict(zip(inputs, arrays)))
+        return [outputs[i] for i in range(len(compiled.outputs))]
+
+    return run
+
+
+class TorchDetectorBackend:
+    """
+    Eager PyTorch YOLOWorld, the vocabulary is set on the model before each call.
+    The text embeddings of the last `vocabulary_cache_size` vocabularies are kept,
+    so switching between e.g. the open vocabulary and a request's keywords does not
+    re-run the CLIP text encoder.
+    """
+
+    def __init__(self, config: Dict):
+        from ultralytics import YOLOWorld
+
+        self.model = YOLOWorld(config["model_path"])
+        self.imgsz = config.get("imgsz", 640)
+        self.device = config.get("device", "cpu")
+        self._classes: List[str] = []
+        self._vocabularies: "OrderedDict[Tuple[str, ...], object]" = OrderedDict()
+        self._vocabulary_cache_size = config.get("vocabulary_cache_size", 8)
+
+    def _set_classes(self, classes: List[str]):
+        key = tuple(classes)
+        txt_feats = self._vocabularies.get(key)
+        if txt_feats is None:
+            self.model.set_classes(list(classes))
+            self._vocabularies[key] = self.model.model.txt_feats
+            while len(self._vocabularies) > self._vocabulary_cache_size:
+                self._vocabularies.popitem(last=False)
+        else:
+            # Same state YOLOWorld.set_classes leaves behind, minus the encoder
+            self._vocabularies.move_to_end(key)
+            world_model = self.model.model
+            world_model.txt_feats = txt_feats
+            world_model.model[-1].nc = len(classes)
+            world_model.names = list(classes)
+            if self.model.predictor:
+                self.model.predictor.model.names = list(classes)
+        self._classes = list(classes)
+
+    def predict(self, image: Image.Image, classes: List[str]):
+        # set_classes runs the CLIP text encoder, skipped for an unchanged vocabulary
+        if classes != self._classes:
+            self._set_classes(classes)
+        return self.model.predict(
+            image, imgsz=self.imgsz, device=self.device, verbose=False
+        )
+
+
+class ExportedDetectorBackend:
+    """
+    YOLOWorld exported once to an ONNX graph that takes the vocabulary text
+    embeddings as a second input, run with ONNX Runtime or OpenVINO on CPU.
+
+    The detection head has a fixed number of class slots (`max_classes`), unused
+    slots are fed zero embeddings and dropped before NMS. Text embeddings are still
+    computed by the PyTorch CLIP encoder and cached per class name.
+    """
+
+    def __init__(self, config: Dict, runtime: str):
+        from ultralytics import YOLOWorld
+
+        self.runtime = runtime
+        self.imgsz = config.get("imgsz", 640)
+        self.max_classes = config.get("max_classes", 32)
+        self.conf = config.get("conf", 0.25)
+        self.iou = config.get("iou", 0.7)
+        self.int8 = config.get("int8", False)
+        self.export_dir = Path(config.get("export_dir", "exported_models"))
+
+        self.world = YOLOWorld(config["model_path"])
+        self._embedding_cache: "OrderedDict[str, npt.NDArray]" = OrderedDict()
+        self._embedding_cache_size = config.get("embedding_cache_size", 4096)
+
+        run = _load_graph(
+            self._export(config["model_path"]), runtime, ["images", "txt_feats"]
+        )
+        self._run = lambda images, txt_feats: run(images, txt_feats)[0]
+
+    def _export(self, model_path: str) -> Path:
+        import torch
+
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        stem = Path(model_path).stem
+        onnx_path = self.export_dir / f"{stem}_{self.imgsz}_{self.max_classes}.onnx"
+        if not onnx_path.exists():
+            logger.log(logging.INFO, "Exporting %s to %s", model_path, onnx_path)
+            # Size the head for max_classes and get the embedding width
+            self.world.set_classes([f"class{i}" for i in range(self.max_classes)])
+            world_model = self.world.model.eval()
+            txt_feats = world_model.txt_feats.detach().clone()
+
+            for module in world_model.modules():
+                if hasattr(module, "export") and hasattr(module, "nc"):
+                    module.export = True
+                    module.format = "onnx"
+                    module.nc = self.max_classes
+                    module.no = module.nc + module.reg_max * 4
+
+            class WorldWithTextInput(torch.nn.Module):
+                def __init__(self, model):
+                    super().__init__()
+                    self.model = model
+
+                def forward(self, images, txt_feats):
+                    return self.model.predict(images, txt_feats=txt_feats)
+
+            images = torch.zeros(1, 3, self.imgsz, self.imgsz)
+            with torch.no_grad():
+                torch.onnx.export(
+                    WorldWithTextInput(world_model),
+                    (images, txt_feats),
+                    str(onnx_path),
+                    input_names=["images", "txt_feats"],
+                    output_names=["output0"],
+                    opset_version=17,
+                )
+            # The export flags change the torch model's outputs, reload a clean copy
+            from ultralytics import YOLOWorld
+
+            self.world = YOLOWorld(model_path)
+
+        if self.int8:
+            onnx_path = _quantized(onnx_path, self.runtime)
+        return onnx_path
+
+    def _text_embeddings(self, classes: List[str]) -> npt.NDArray:
+        embeddings = {}
+        missing = []
+        for c in classes:
+            if c in self._embedding_cache:
+                self._embedding_cache.move_to_end(c)
+                embeddings[c] = self._embedding_cache[c]
+            else:
+                missing.append(c)
+        if missing:
+            self.world.set_classes(missing)
+            feats = self.world.model.txt_feats.detach().cpu().numpy()[0]
+            for name, feat in zip(missing, feats):
+                embeddings[name] = self._embedding_cache[name] = feat
+            while len(self._embedding_cache) > self._embedding_cache_size:
+                self._embedding_cache.popitem(last=False)
+
+        txt_feats = np.zeros(
+            (1, self.max_classes, embeddings[classes[0]].shape[-1]),
+            dtype=np.float32,
+        )
+        txt_feats[0, : len(classes)] = np.stack([embeddings[c] for c in classes])
+        return txt_feats
+
+    def _letterbox(
+        self, image_np: npt.NDArray
+    ) -> Tuple[npt.NDArray, float, Tuple[int, int]]:
+        height, width = image_np.shape[:2]
+        ratio = min(self.imgsz / height, self.imgsz / width)
+        new_w, new_h = round(width * ratio), round(height * ratio)
+        pad_x, pad_y = (self.imgsz - new_w) // 2, (self.imgsz - new_h) // 2
+
+        resized = np.asarray(
+            Image.fromarray(image_np).resize((new_w, new_h), Image.BILINEAR)
+        )
+        canvas = np.full((self.imgsz, self.imgsz, 3), 114, dtype=np.uint8)
+        canvas[pad_y : pad_y + new_h, pad_x : pad_x + new_w] = resized
+        tensor = canvas.transpose(2, 0, 1)[np.newaxis].astype(np.float32) / 255.0
+        return tensor, ratio, (pad_x, pad_y)
+
+    def predict(self, image: Image.Image, classes: List[str]):
+        import torch
+        from ultralytics.engine.results import Results
+        from ultralytics.utils import ops
+
+        if len(classes) > self.max_classes:
+            logger.log(
+                logging.WARNING,
+                "%s classes exceed max_classes=%s, truncating",
+                len(classes),
+                self.max_classes,
+            )
+            classes = classes[: self.max_classes]
+
+        image_np = np.asarray(image.convert("RGB"))
+        images, ratio, (pad_x, pad_y) = self._letterbox(image_np)
+        preds = self._run(images, self._text_embeddings(classes))
+
+        # Drop the padded class slots before NMS
+        preds = torch.from_numpy(np.ascontiguousarray(preds[:, : 4 + len(classes)]))
+        boxes = ops.non_max_suppression(preds, self.conf, self.iou)[0]
+
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad_x) / ratio
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad_y) / ratio
+        ops.clip_boxes(boxes, image_np.shape[:2])
+
+        names = {i: name for i, name in enumerate(classes)}
+        return [Results(image_np[..., ::-1], path="", names=names, boxes=boxes)]
+
+
+class TorchSegmentationBackend:
+    """
+    Eager PyTorch SAM on the configured device. With `int8: true` the Linear layers
+    (most of the SAM 2 Hiera image encoder) are dynamically quantized for CPU.
+    """
+
+    def __init__(self, config: Dict):
+        from ultralytics import SAM
+
+        self.model = SAM(config["model_path"])
+        self.device = config.get("device", "cpu")
+
+        if config.get("int8", False):
+            import torch
+
+            if self.device != "cpu":
+                raise ValueError("Dynamic INT8 quantization is only supported on cpu")
+            self.model.model = torch.ao.quantization.quantize_dynamic(
+                self.model.model.eval(), {torch.nn.Linear}, dtype=torch.qint8
+            )
+            logger.log(logging.INFO, "SAM Linear layers quantized to INT8")
+
+    def predict(self, image_np: npt.NDArray, bboxes: npt.NDArray):
+        return self.model(image_np, bboxes=bboxes, device=self.device, verbose=False)
+
+
+class ExportedSegmentationBackend:
+    """
+    SAM 2 exported once to two ONNX graphs, run with ONNX Runtime or OpenVINO on
+    CPU: the image encoder, and the prompt encoder with the mask decoder, which
+    takes the box prompts as an input. As with the torch backend the image is
+    encoded once per call and every box is decoded as a prompt. With `int8: true`
+    the image encoder graph is dynamically quantized (onnx).
+    """
+
+    def __init__(self, config: Dict, runtime: str):
+        self.runtime = runtime
+        self.int8 = config.get("int8", False)
+        self.export_dir = Path(config.get("export_dir", "exported_models"))
+
+        encoder_path, decoder_path = self._export(config["model_path"])
+        self._encode = _load_graph(encoder_path, runtime, ["image"])
+        self._decode = _load_graph(
+            decoder_path,
+            runtime,
+            ["image_embed", "high_res_feats_0", "high_res_feats_1", "boxes"],
+        )
+
+    def _export(self, model_path: str) -> Tuple[Path, Path]:
+        self.export_dir.mkdir(parents=True, exist_ok=True)
+        stem = Path(model_path).stem
+        encoder_path = self.export_dir / f"{stem}_encoder_{SAM_IMAGE_SIZE}.onnx"
+        decoder_path = self.export_dir / f"{stem}_decoder_{SAM_IMAGE_SIZE}.onnx"
+
+        if not (encoder_path.exists() and decoder_path.exists()):
+            import torch
+            from ultralytics import SAM
+
+            logger.log(
+                logging.INFO,
+                "Exporting %s to %s and %s",
+                model_path,
+                encoder_path,
+                decoder_path,
+            )
+            model = SAM(model_path).model.eval()
+
+            class ImageEncoder(torch.nn.Module):
+                """Image to the embedding and high resolution features of SAM 2."""
+
+                def __init__(self, model):
+                    super().__init__()
+                    self.model = model
+
+                def forward(self, image):
+                    backbone_out = self.model.forward_image(image)
+                    _, feats, _, sizes = self.model._prepare_backbone_features(
+                        backbone_out
+                    )
+                    if self.model.directly_add_no_mem_embed:
+                        feats[-1] = feats[-1] + self.model.no_mem_embed
+                    # (HW, 1, C) sequences to 1xCxHxW maps, highest resolution first
+                    high_res_0, high_res_1, image_embed = [
+                        feat.permute(1, 2, 0).reshape(1, -1, *size)
+                        for feat, size in zip(feats, sizes)
+                    ]
+                    return image_embed, high_res_0, high_res_1
+
+            class BoxDecoder(torch.nn.Module):
+                """Boxes in encoder input pixels to low resolution mask logits."""
+
+                def __init__(self, model):
+                    super().__init__()
+                    self.prompt_encoder = model.sam_prompt_encoder
+                    self.mask_decoder = model.sam_mask_decoder
+
+                def forward(self, image_embed, high_res_0, high_res_1, boxes):
+                    # As the predictor prompts SAM 2: the box corners are points
+                    # labelled 2 and 3, followed by a padding point. The masked
+                    # in-place writes of PromptEncoder._embed_points do not
+                    # export, the same embeddings are summed here
+                    encoder = self.prompt_encoder
+                    height, width = encoder.input_image_size
+                    corners = (boxes.reshape(-1, 2, 2) + 0.5) / torch.tensor(
+                        [width, height], dtype=boxes.dtype
+                    )
+                    corners = encoder.pe_layer._pe_encoding(corners) + torch.cat(
+                        [
+                            encoder.point_embeddings[2].weight,
+                            encoder.point_embeddings[3].weight,
+                        ]
+                    )
+                    padding = encoder.not_a_point_embed.weight.expand(
+                        corners.shape[0], 1, -1
+                    )
+                    sparse = torch.cat([corners, padding], dim=1)
+                    dense = encoder.no_mask_embed.weight.reshape(1, -1, 1, 1).expand(
+                        corners.shape[0], -1, *encoder.image_embedding_size
+                    )
+                    masks, _, _, _ = self.mask_decoder(
+                        image_embeddings=image_embed,
+                        image_pe=encoder.get_dense_pe(),
+                        sparse_prompt_embeddings=sparse,
+                        dense_prompt_embeddings=dense,
+                        multimask_output=False,
+                        repeat_image=True,
+                        high_res_features=[high_res_0, high_res_1],
+                    )
+                    return masks[:, 0]
+
+            image = torch.zeros(1, 3, SAM_IMAGE_SIZE, SAM_IMAGE_SIZE)
+            # The number of boxes is a dynamic axis, the example box is arbitrary
+            boxes = torch.tensor([[256.0, 256.0, 768.0, 768.0]])
+            encoder, decoder = ImageEncoder(model), BoxDecoder(model)
+            with torch.no_grad():
+                features = encoder(image)
+                torch.onnx.export(
+                    encoder,
+                    (image,),
+                    str(encoder_path),
+                    input_names=["image"],
+                    output_names=[
+                        "image_embed",
+                        "high_res_feats_0",
+                        "high_res_feats_1",
+                    ],
+                    opset_version=17,
+                )
+                torch.onnx.export(
+                    decoder,
+                    (*features, boxes),
+                    str(decoder_path),
+                    input_names=[
+                        "image_embed",
+                        "high_res_feats_0",
+                        "high_res_feats_1",
+                        "boxes",
+                    ],
+                    output_names=["masks"],
+                    dynamic_axes={"boxes": {0: "boxes"}, "masks": {0: "boxes"}},
+                    opset_version=17,
+                )
+
+        if self.int8:
+            encoder_path = _quantized(encoder_path, self.runtime)
+        return encoder_path, decoder_path
+
+    def _preprocess(self, image_np: npt.NDArray) -> Tuple[npt.NDArray, float]:
+        """
+        Resized to SAM_IMAGE_SIZE and padded at the bottom and right, as by the
+        SAM predictor. The predictor reads numpy images as BGR and flips their
+        channels, the torch backend gets the same arrays, so the flip is kept.
+        """
+        height, width = image_np.shape[:2]
+        ratio = SAM_IMAGE_SIZE / max(height, width)
+        new_w, new_h = round(width * ratio), round(height * ratio)
+
+        resized = np.asarray(
+            Image.fromarray(image_np).resize((new_w, new_h), Image.BILINEAR)
+        )
+        canvas = np.full((SAM_IMAGE_SIZE, SAM_IMAGE_SIZE, 3), 114, dtype=np.uint8)
+        canvas[:new_h, :new_w] = resized
+        normalized = (canvas[..., ::-1].astype(np.float32) - _SAM_MEAN) / _SAM_STD
+        return np.ascontiguousarray(normalized.transpose(2, 0, 1)[np.newaxis]), ratio
+
+    def predict(self, image_np: npt.NDArray, bboxes: npt.NDArray):
+        import torch
+        from ultralytics.engine.results import Results
+        from ultralytics.utils import ops
+
+        image, ratio = self._preprocess(image_np)
+        features = self._encode(image)
+        boxes = np.asarray(bboxes, dtype=np.float32).reshape(-1, 4) * ratio
+        low_res = self._decode(*features, boxes)[0]
+
+        # Back to the image size and binarized, as in the predictor's postprocess
+        masks = ops.scale_masks(
+            torch.from_numpy(low_res)[None].float(), image_np.shape[:2], padding=False
+        )[0]
+        names = {i: str(i) for i in range(len(boxes))}
+        return [Results(image_np[..., ::-1], path="", names=names, masks=masks > 0.0)]
+
+
+def create_detector_backend(config: Dict):
+    backend = config.get("backend", "torch")
+    if backend not in DETECTOR_BACKENDS:
+        raise ValueError(
+            f"Unknown detector backend {backend!r}, expected one of {DETECTOR_BACKENDS}"
+        )
+    logger.log(logging.INFO, "Using %s detector backend", backend)
+    if backend == "torch":
+        return TorchDetectorBackend(config)
+    return ExportedDetectorBackend(config, runtime=backend)
+
+
+def create_segmentation_backend(config: Dict):
+    backend = config.get("backend", "torch")
+    if backend not in SEGMENTATION_BACKENDS:
+        raise ValueError(
+            f"Unknown segmentation backend {backend!r}, "
+            f"expected one of {SEGMENTATION_BACKENDS}"
+        )
+    logger.log(logging.INFO, "Using %s segmentation backend", backend)
+    if backend == "torch":
+        return TorchSegmentationBackend(config)
+    return ExportedSegmentationBackend(config, runtime=backend)
@@ -1,11 +1,13 @@
+import re
+import json
 import logging
-from typing import Dict, List
+from collections import Counter, OrderedDict
+from typing import Dict, List, Union
 from typing_extensions import TypedDict
-import google.generativeai as genai
+import numpy as np
 from PIL import Image
-from fuzzywuzzy import fuzz
-from collections import Counter
 from .base_service import BaseService
+from ..core.gemini_governor import GeminiGovernor
 from ..core.prompt_manager import PromptManager, PromptSequenceItem
 
 
@@ -17,27 +19,161 @@ class KeywordResponse(TypedDict):
     main_objects: List[str]
 
 
+def parse_keyword_response(text: str) -> KeywordResponse:
+    """Parses and validates one model answer against the KeywordResponse schema."""
+    result = json.loads(text)
+    if not isinstance(result, dict):
+        raise ValueError("Result is not a dictionary")
+    if not isinstance(result.get("reasoning"), str):
+        raise ValueError("Result does not contain a 'reasoning' string")
+    main_objects = result.get("main_objects")
+    if not isinstance(main_objects, list) or not all(
+        isinstance(item, str) for item in main_objects
+    ):
+        raise ValueError("Result does not contain a 'main_objects' list of strings")
+    return KeywordResponse(reasoning=result["reasoning"], main_objects=main_objects)
+
+
+_NON_WORD = re.compile(r"[^\w\s-]+")
+_WHITESPACE = re.compile(r"[\s_-]+")
+
+
+# Plural-only nouns and words whose trailing "s" is not a plural ending
+_SINGULAR_EXCEPTIONS = frozenset(
+    {
+        "binoculars",
+        "clothes",
+        "earphones",
+        "glasses",
+        "goggles",
+        "headphones",
+        "jeans",
+        "leggings",
+        "news",
+        "pants",
+        "pliers",
+        "scissors",
+        "series",
+        "shorts",
+        "species",
+        "sunglasses",
+        "tights",
+        "tongs",
+        "trousers",
+        "tweezers",
+    }
+)
+
+
+def _singular(word: str) -> str:
+    if (
+        len(word) <= 3
+        or word in _SINGULAR_EXCEPTIONS
+        or word.endswith(("ss", "us", "is"))
+    ):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    if word.endswith(("ches", "shes", "xes", "sses", "zes")):
+        return word[:-2]
+    if word.endswith("s"):
+        return word[:-1]
+    return word
+
+
+def normalize_keyword(keyword: str) -> str:
+    """
+    Grouping key of a keyword: lowercased, without punctuation and extra whitespace,
+    the last word singularised. Only used to compare keywords, the detector gets
+    the original wording.
+    """
+    words = _WHITESPACE.sub(" ", _NON_WORD.sub("", keyword.lower())).split()
+    if not words:
+        return ""
+    words[-1] = _singular(words[-1])
+    return " ".join(words)
+
+
+class KeywordVocabulary:
+    """
+    Bounded vocabulary of keywords seen in earlier requests, by grouping key. Near
+    duplicates ("Teddy Bears", "teddy-bear") map to the wording first seen, so
+    detector class lists repeat across requests and hit the text embedding caches.
+    """
+
+    def __init__(self, threshold: float = 90, max_size: int = 2048):
+        self.threshold = threshold
+        self.max_size = max_size
+        self._terms: "OrderedDict[str, str]" = OrderedDict()  # key -> wording
+
+    def __len__(self) -> int:
+        return len(self._terms)
+
+    def canonical(self, key: str, wording: str) -> str:
+        """Wording of the known key matching `key`, else `wording`, now known."""
+        from rapidfuzz import fuzz, process
+
+        match = None
+        if key in self._terms:
+            match = key
+        elif self._terms:
+            found = process.extractOne(
+                key,
+                list(self._terms),
+                scorer=fuzz.ratio,
+                score_cutoff=self.threshold,
+            )
+            if found is not None:
+                match = found[0]
+
+        if match is None:
+            match = key
+            self._terms[key] = wording
+        self._terms.move_to_end(match)
+        while len(self._terms) > self.max_size:
+            self._terms.popitem(last=False)
+        return self._terms[match]
+
+
 class KeywordExtractor(BaseService):
-    def __init__(self, config: Dict, prompt_manager: PromptManager):
+    def __init__(
+        self,
+        config: Dict,
+        prompt_manager: PromptManager,
+        governor: Union[GeminiGovernor, None] = None,
+    ):
         super().__init__(
             config,
             prompt_manager,
             prompt_type="keyword_extractor",
-            max_concurrency=4,
+            governor=governor,
+            priority=2,
             max_total_tasks=4,
         )
+        import google.generativeai as genai
+
         self.model = genai.GenerativeModel(
             config["model_name"],
             system_instruction=self._get_prompt_key("system_prompt"),
         )
 
-    async def forward(self, image: Image.Image) -> str:
+        keywords_config = config.get("keywords", {})
+        self.match_threshold = keywords_config.get("match_threshold", 50)
+        self.min_frequency = keywords_config.get("min_frequency", 1)
+        self.vocabulary = KeywordVocabulary(
+            threshold=keywords_config.get("vocabulary_threshold", 90),
+            max_size=keywords_config.get("vocabulary_size", 2048),
+        )
+
+    async def forward(self, image: Image.Image) -> KeywordResponse:
+        import google.generativeai as genai
+
         sequence = self._get_prompt_sequence(
             "keyword_extractor", exclude_keys=["system_prompt"]
         )
         sequence.items.append(PromptSequenceItem("image", image))
 
-        response = self.model.generate_content(
+        response = await self.model.generate_content_async(
             sequence.get_sequence(),
             generation_config=genai.GenerationConfig(
                 response_mime_type="application/json",
@@ -49,101 +185,89 @@ class KeywordExtractor(BaseService):
             ),
         )
 
-        # Inital eval to check if the response is a valid dict
-        eval(response.text)
-
-        return response.text
+        # An invalid answer raises here, so the sample is retried
+        return parse_keyword_response(response.text)
 
-    def process_results(self, results: List[str]) -> KeywordResponse:
-        # Join all the results to their corresponding keys if they contain the "main_objects" key
+    def process_results(self, results: List[KeywordResponse]) -> KeywordResponse:
+        # Collect the main objects of every sample
         final_result = KeywordResponse(reasoning="", main_objects=[])
 
-        logger.log(logging.INFO, f"Processing results: {results}")
-
-        for result_str in results:
-            try:
-                result = eval(result_str)
-                if not isinstance(result, dict):
-                    raise ValueError("Result is not a dictionary")
-                if "main_objects" not in result:
-                    raise ValueError("Result does not contain 'main_objects' key")
-                if not isinstance(result["main_objects"], list):
-                    raise ValueError("'main_objects' key is not a list")
-                if "reasoning" not in result:
-                    raise ValueError("Result does not contain 'reasoning' key")
-                if not isinstance(result["reasoning"], str):
-                    raise ValueError("'reasoning' key is not a string")
-            except Exception as e:
-                logger.log(logging.ERROR, f"Error evaluating result: {e}")
-                continue
+        logger.log(logging.INFO, "Processing results: %s", results)
 
-            for key, value in result.items():
-                if key not in final_result:
-                    final_result[key] = []
-                if key == "main_objects":
-                    final_result[key].extend(value)
+        for result in results:
+            final_result["main_objects"].extend(result["main_objects"])
 
-        logger.log(logging.DEBUG, f"Final result before fuzzy matching: {final_result}")
+        logger.log(
+            logging.DEBUG, "Final result before fuzzy matching: %s", final_result
+        )
 
         if len(final_result["main_objects"]) == 0:
             logger.log(logging.ERROR, "No main objects detected")
             raise ValueError("No main objects detected")
 
-        if len(results) > 1:
-            final_result_filtered = final_result.copy()
-            # Loop through the final result and fuzzy match the characters in the main_objects and filter out the ones that are unique or have a low match
-            final_result_filtered["main_objects"] = self._get_frequent_matched_items(
-                final_result["main_objects"]
-            )
-            if len(final_result_filtered["main_objects"]) == 0:
-                logger.log(logging.ERROR, "No main objects detected")
-                logger.log(logging.INFO, "Fall back to the original result")
-                final_result_filtered["main_objects"] = final_result["main_objects"]
-                final_result["main_objects"] = final_result_filtered["main_objects"]
+        # Merge near duplicates across samples into canonical vocabulary terms
+        consolidated = self._get_frequent_matched_items(final_result["main_objects"])
+        if consolidated:
+            final_result["main_objects"] = consolidated
+        else:
+            logger.log(logging.ERROR, "No main objects detected")
+            logger.log(logging.INFO, "Fall back to the original result")
 
-        logger.log(logging.INFO, f"Final result: {final_result}")
+        logger.log(logging.INFO, "Final result: %s", final_result)
         return final_result
 
-    def _get_frequent_matched_items(self, items, threshold=50, min_frequency=1):
+    def _get_frequent_matched_items(
+        self,
+        items: List[str],
+        threshold: Union[float, None] = None,
+        min_frequency: Union[int, None] = None,
+    ) -> List[str]:
         """
-        Returns a list of unique items that highly match with others in the original list,
-        filtering out items that appear infrequently and ensuring only one representative
-        item per similar group is retained.
+        Returns one item per group of similar items, most frequent group first.
+        Items are grouped by their normalised key, similarities of the distinct
+        keys come from a single vectorized matrix, and groups whose total count is
+        below `min_frequency` are dropped. Each group is named by its most frequent
+        original wording (through the vocabulary of earlier requests).
         """
-        if not items:
-            return []
-
-        # First, group similar items
-        clusters = []
-        used_items = set()
+        from rapidfuzz import fuzz, process
 
-        for item in items:
-            if item in used_items:
-                continue
+        threshold = self.match_threshold if threshold is None else threshold
+        if min_frequency is None:
+            min_frequency = self.min_frequency
 
-            # Find similar items
-            similar_items = [
-                i
-                for i in items
-                if i not in used_items and fuzz.ratio(item, i) >= threshold
-            ]
+        # Samples repeat the same answers, each distinct item is normalised once
+        wordings: Dict[str, Counter] = {}
+        for item, count in Counter(items).items():
+            key = normalize_keyword(item)
+            if key:
+                wordings.setdefault(key, Counter())[" ".join(item.split())] += count
+        counts = Counter({key: sum(c.values()) for key, c in wordings.items()})
+        if not counts:
+            return []
 
-            # Only create a cluster if it meets minimum frequency
-            if len(similar_items) >= min_frequency:
-                clusters.append(similar_items)
-                used_items.update(similar_items)
+        # Most frequent first, so each group is led by its most frequent member
+        terms, frequencies = zip(*counts.most_common())
+        frequencies = np.asarray(frequencies)
+        similarity = process.cdist(
+            terms, terms, scorer=fuzz.ratio, score_cutoff=threshold, workers=-1
+        )
 
-        # Select one representative item per cluster
         unique_items = []
-        for cluster in clusters:
-            # Select most frequent item from the cluster
-            representative = max(cluster, key=Counter(items).get)
-
-            # Ensure no previously selected items are too similar to this one
-            if not any(
-                fuzz.ratio(representative, existing) >= threshold
-                for existing in unique_items
-            ):
-                unique_items.append(representative)
-
-        return unique_items
+        assigned = np.zeros(len(terms), dtype=bool)
+        for i, term in enumerate(terms):
+            if assigned[i]:
+                continue
+            members = (similarity[i] >= threshold) & ~assigned
+            assigned |= members
+            if frequencies[members].sum() < min_frequency:
+                continue
+            group_wordings: Counter = Counter()
+            for index in np.flatnonzero(members):
+                group_wordings.update(wordings[terms[index]])
+            # A later leader is never similar to an earlier one, it would have
+            # joined that group, so the selected items are already distinct
+            unique_items.append(
+                self.vocabulary.canonical(term, group_wordings.most_common(1)[0][0])
+            )
+
+        return list(dict.fromkeys(unique_items))
@@ -0,0 +1,284 @@
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, List, Tuple, Union
+import numpy as np
+import numpy.typing as npt
+from PIL import Image
+
+from ..core.deadline import Deadline
+from ..core.metrics import metrics
+from ..core.scheduler import INTERACTIVE
+from .image_ingestion import IngestedImage, ingest_image
+
+if TYPE_CHECKING:
+    from .image_processor import ImageProcessor
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+class FrameChangeDetector:
+    """
+    Cheap scene change score: the mean absolute difference of small grayscale
+    thumbnails, mean-centred so that exposure changes of the camera do not count.
+    """
+
+    def __init__(self, size: Tuple[int, int] = (64, 48)):
+        self.size = size
+
+    def signature(self, image: Image.Image) -> npt.NDArray:
+        thumbnail = image.convert("L").resize(self.size, Image.BILINEAR)
+        pixels = np.asarray(thumbnail, dtype=np.float32)
+        return pixels - pixels.mean()
+
+    @staticmethod
+    def difference(a: npt.NDArray, b: npt.NDArray) -> float:
+        """0 for identical frames, about 0.1 and above for a different scene."""
+        return float(np.abs(a - b).mean()) / 255
+
+
+def box_iou(a: npt.NDArray, b: npt.NDArray) -> float:
+    ax1, ay1, ax2, ay2 = (float(v) for v in a)
+    bx1, by1, bx2, by2 = (float(v) for v in b)
+    inter_w = max(0.0, min(ax2, bx2) - max(ax1, bx1))
+    inter_h = max(0.0, min(ay2, by2) - max(ay1, by1))
+    intersection = inter_w * inter_h
+    union = (ax2 - ax1) * (ay2 - ay1) + (bx2 - bx1) * (by2 - by1) - intersection
+    return intersection / union if union > 0 else 0.0
+
+
+class LiveSession:
+    """
+    Incremental processing of a stream of camera frames for one viewer.
+
+    Every frame is compared with the frame of the last detection. Below
+    `change_threshold` the previous state is returned as is. Above it, the detector
+    runs with the keywords of the current object, and as long as the main box stays
+    on the same object (same class, IoU >= `track_iou`) only the box is updated.
+    A new or lost object (for `confirm_frames` detections) starts a full analysis
+    (keywords, segmentation, descriptions and toy image) in the background, at most
+    once per `analysis_interval` seconds, while tracking goes on.
+
+    Frames arriving while one is being processed replace each other, so a slow
+    viewer gets the latest frame rather than a growing backlog. Detections and
+    analyses take a slot of `tenant` in the interactive lane of the scheduler and
+    their share of the memory budget, like uploaded images.
+    """
+
+    def __init__(
+        self,
+        processor: "ImageProcessor",
+        profile: Dict[str, Any],
+        session_id: str,
+        tenant: str = "local",
+        max_image_size: int = 640,
+        change_threshold: float = 0.04,
+        track_iou: float = 0.3,
+        confirm_frames: int = 2,
+        analysis_interval: float = 5.0,
+    ):
+        self.processor = processor
+        self.profile = profile
+        self.session_id = session_id
+        self.tenant = tenant
+        self.max_image_size = max_image_size
+        self.change_threshold = change_threshold
+        self.track_iou = track_iou
+        self.confirm_frames = confirm_frames
+        self.analysis_interval = analysis_interval
+        self.change_detector = FrameChangeDetector()
+
+        # Current object, from the last analysis and the tracked detections
+        self.keywords: Union[List[str], None] = None
+        self.main_object: Union[str, None] = None
+        self.box_xyxy: Union[npt.NDArray, None] = None
+        self.analysis: Union[Dict[str, Any], None] = None
+
+        self._reference: Union[npt.NDArray, None] = None
+        self._mismatches = 0
+        self._analysis_task: Union[asyncio.Task, None] = None
+        self._last_analysis_at = float("-inf")
+
+        self._latest: Union[Tuple[int, bytes], None] = None
+        self._frame_ready = asyncio.Event()
+        self._send_lock = asyncio.Lock()
+        self._send: Union[Callable[[Dict[str, Any]], Awaitable[None]], None] = None
+        self.frames = 0
+        self.dropped = 0
+
+    async def run(
+        self,
+        receive: Callable[[], Awaitable[bytes]],
+        send: Callable[[Dict[str, Any]], Awaitable[None]],
+    ):
+        """
+        Serves the session until `receive` raises, e.g. on disconnect. Frames are
+        read continuously and only the latest one is processed.
+        """
+        self._send = send
+        reader = asyncio.create_task(self._read_frames(receive))
+        try:
+            while True:
+                ready = asyncio.create_task(self._frame_ready.wait())
+                await asyncio.wait({ready, reader}, return_when=asyncio.FIRST_COMPLETED)
+                if reader.done():
+                    ready.cancel()
+                    reader.result()  # re-raises the disconnect
+                    return
+                self._frame_ready.clear()
+                seq, data = self._latest
+                self._latest = None
+                await self._emit(await self.process_frame(data, seq))
+        finally:
+            reader.cancel()
+            if self._analysis_task is not None:
+                self._analysis_task.cancel()
+
+    async def _read_frames(self, receive: Callable[[], Awaitable[bytes]]):
+        seq = 0
+        while True:
+            data = await receive()
+            seq += 1
+            if self._latest is not None:
+                # The previous frame was never picked up, it is stale now
+                self.dropped += 1
+                metrics.inc("live_frames", outcome="dropped")
+            self._latest = (seq, data)
+            self._frame_ready.set()
+
+    async def _emit(self, message: Dict[str, Any]):
+        async with self._send_lock:
+            await self._send(message)
+
+    def _decode(self, data: bytes) -> Tuple[IngestedImage, npt.NDArray, int]:
+        # Rejects frames above the pixel ceiling before anything is decoded
+        memory_cost = self.processor.admission.estimate(data, self.max_image_size)
+        ingested = ingest_image(data, self.max_image_size)
+        return ingested, self.change_detector.signature(ingested.image), memory_cost
+
+    @asynccontextmanager
+    async def _admitted(self, memory_cost: int):
+        """Holds a scheduler slot and the memory for one detection or analysis."""
+        async with self.processor.scheduler.slot(self.tenant, INTERACTIVE):
+            async with self.processor.admission.admit(memory_cost):
+                yield
+
+    async def process_frame(self, data: bytes, seq: int) -> Dict[str, Any]:
+        start = time.perf_counter()
+        self.frames += 1
+        try:
+            ingested, signature, memory_cost = await asyncio.to_thread(
+                self._decode, data
+            )
+        except Exception as e:
+            metrics.inc("live_frames", outcome="error")
+            return {"type": "error", "frame": seq, "detail": f"Invalid frame: {e}"}
+
+        change = None
+        if self._reference is not None:
+            change = self.change_detector.difference(signature, self._reference)
+
+        if change is not None and change < self.change_threshold:
+            outcome = "unchanged"
+        elif self.keywords is None:
+            # Nothing to track yet, the first analysis provides the keywords
+            self._request_analysis(ingested, seq, memory_cost)
+            outcome = "pending"
+        else:
+            self._reference = signature
+            try:
+                outcome = await self._track(ingested, seq, memory_cost)
+            except Exception as e:
+                logger.log(logging.ERROR, "Live session %s: %s", self.session_id, e)
+                metrics.inc("live_frames", outcome="error")
+                return {"type": "error", "frame": seq, "detail": str(e)}
+
+        elapsed = time.perf_counter() - start
+        metrics.inc("live_frames", outcome=outcome)
+        metrics.observe("live_frame_seconds", elapsed, outcome=outcome)
+        return {
+            "type": "frame",
+            "frame": seq,
+            "outcome": outcome,
+            "change": change,
+            "main_object": self.main_object,
+            "box_xyxy": None if self.box_xyxy is None else self.box_xyxy.tolist(),
+            "analyzing": self._analysis_task is not None,
+            "dropped": self.dropped,
+            "latency_ms": elapsed * 1000,
+        }
+
+    async def _track(self, ingested: IngestedImage, seq: int, memory_cost: int) -> str:
+        """Re-detects the current keywords and follows the main box."""
+        async with self._admitted(memory_cost):
+            detection = await self.processor.detect(
+                ingested.image, self.keywords, self.profile
+            )
+        main_class = detection["main_class"]
+        box_xyxy = np.asarray(detection["highest_score_box_xyxy"])
+
+        same_object = (
+            main_class is not None
+            and main_class == self.main_object
+            and self.box_xyxy is not None
+            and box_iou(box_xyxy, self.box_xyxy) >= self.track_iou
+        )
+        if same_object:
+            self._mismatches = 0
+            self.box_xyxy = box_xyxy
+            return "tracked"
+
+        # A single odd detection (motion blur, occlusion) does not switch objects
+        self._mismatches += 1
+        if main_class is not None and main_class in self.keywords:
+            self.main_object = main_class
+            self.box_xyxy = box_xyxy
+        if self._mismatches >= self.confirm_frames:
+            self._request_analysis(ingested, seq, memory_cost)
+        return "changed"
+
+    def _request_analysis(self, ingested: IngestedImage, seq: int, memory_cost: int):
+        if self._analysis_task is not None:
+            return
+        if time.monotonic() - self._last_analysis_at < self.analysis_interval:
+            return
+        self._last_analysis_at = time.monotonic()
+        self._analysis_task = asyncio.create_task(
+            self._analyze(ingested, seq, memory_cost)
+        )
+
+    async def _analyze(self, ingested: IngestedImage, seq: int, memory_cost: int):
+        start = time.perf_counter()
+        deadline = Deadline(self.profile["timeout"])
+        try:
+            async with self._admitted(memory_cost):
+                analysis = await self.processor.analyze(
+                    ingested, self.profile, deadline
+                )
+                self.keywords = analysis["keywords"]
+                self.main_object = analysis["main_object"]
+                self.box_xyxy = np.asarray(analysis["box_xyxy"])
+                self.analysis = analysis
+                self._mismatches = 0
+
+                result = await self.processor.generate_output(
+                    f"live-{self.session_id}-{seq}.png",
+                    analysis,
+                    deadline,
+                    self.profile,
+                )
+            metrics.observe("live_analysis_seconds", time.perf_counter() - start)
+            await self._emit({"type": "analysis", "frame": seq, **result})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.log(logging.ERROR, "Live session %s: %s", self.session_id, e)
+            metrics.inc("live_analysis_errors")
+            await self._emit({"type": "error", "frame": seq, "detail": str(e)})
+        finally:
+            self._analysis_task = None
+            # The scene may have moved on while analysing, compare the next frame
+            # with the new object
+            self._reference = None
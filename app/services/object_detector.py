@@ -1,10 +1,10 @@
 import logging
-from typing import Dict, List, Union
+from typing import Dict, List, Tuple, Union
 from typing_extensions import TypedDict
 import numpy as np
 import numpy.typing as npt
 from PIL import Image
-from ultralytics import YOLOWorld
+from .inference_backends import create_detector_backend
 
 
 logger = logging.getLogger("toy_transformer")
@@ -17,11 +17,38 @@ class ObjectDetectorResult(TypedDict):
     main_class: Union[str, None]
     highest_score_box_xywh: npt.NDArray
     highest_score_box_xyxy: npt.NDArray
+    # Raw metrics of the main box, None for the fallback box
+    main_confidence: Union[float, None]
+    main_area_ratio: Union[float, None]
+    main_score: Union[float, None]
+    # Raw combined score of every box and the box indices from the best score
+    # down, both empty for the fallback box
+    scores: List[float]
+    ranked: List[int]
+
+
+def _box_iou(box: npt.NDArray, boxes: npt.NDArray) -> npt.NDArray:
+    """IoU of one xyxy box with each of `boxes`."""
+    inter_w = np.clip(
+        np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0]), 0, None
+    )
+    inter_h = np.clip(
+        np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1]), 0, None
+    )
+    intersection = inter_w * inter_h
+    union = (
+        (box[2] - box[0]) * (box[3] - box[1])
+        + (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        - intersection
+    )
+    return np.divide(
+        intersection, union, out=np.zeros_like(intersection), where=union > 0
+    )
 
 
 class ObjectDetector:
     def __init__(self, config: Dict):
-        self.model = YOLOWorld(config["model_path"])
+        self.backend = create_detector_backend(config)
         self.weighted_score_threshold = config["weighted_score_threshold"]
         self.weight_confidence = config["weight_confidence"]
         self.weight_area = config["weight_area"]
@@ -30,27 +57,21 @@ class ObjectDetector:
     def detect_objects(
         self, image: Image.Image, classes: List[str]
     ) -> ObjectDetectorResult:
-        self.model.set_classes(classes)
-        logger.log(logging.INFO, f"Setting classes: {classes}")
+        logger.log(logging.INFO, "Setting classes: %s", classes)
 
-        results = self.model.predict(image)
-        logger.log(logging.DEBUG, f"Results: {results}")
+        results = self.backend.predict(image, classes)
+        logger.log(logging.DEBUG, "Results: %s", results)
 
         return self._process_results(results, input_classes=classes, image=image)
 
     def _process_results(
         self, results, input_classes: List[str], image: Image.Image
     ) -> ObjectDetectorResult:
-        boxes_xywh, boxes_xyxy, classes, confs = [], [], [], []
+        # One device-to-host copy per result, rows of x1, y1, x2, y2, (track id),
+        # confidence, class
+        data = [result.boxes.data.cpu().numpy() for result in results]
 
-        for result in results:
-            for box in result.boxes:
-                boxes_xywh.append(box.xywh[0].cpu().numpy())
-                boxes_xyxy.append(box.xyxy[0].cpu().numpy())
-                classes.append(int(box.cls.item()))
-                confs.append(box.conf.item())
-
-        if not boxes_xywh:
+        if not data or not sum(len(d) for d in data):
             logger.log(logging.WARNING, "No objects detected. Creating fallback box.")
 
             # Create a fallback box in the center of the image, 1/3 the size
@@ -79,7 +100,7 @@ class ObjectDetector:
                 ]
             )
 
-            logger.log(logging.INFO, f"Fallback box XYWH: {fallback_box_xywh}")
+            logger.log(logging.INFO, "Fallback box XYWH: %s", fallback_box_xywh)
 
             return {
                 "boxes_xywh": [fallback_box_xywh],
@@ -88,80 +109,146 @@ class ObjectDetector:
                 "classes": [],
                 "highest_score_box_xywh": fallback_box_xywh,
                 "highest_score_box_xyxy": fallback_box_xyxy,
+                "main_confidence": None,
+                "main_area_ratio": None,
+                "main_score": None,
+                "scores": [],
+                "ranked": [],
             }
 
-        normalized_combined_score = self._calculate_score(boxes_xywh, confs, image)
-        logger.log(
-            logging.INFO, f"Normalized combined score: {normalized_combined_score}"
-        )
+        data = np.concatenate(data)
+        boxes_xyxy = data[:, :4]
+        x1, y1, x2, y2 = boxes_xyxy.T
+        boxes_xywh = np.stack(((x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1), 1)
+        confs = data[:, -2]
+        classes = data[:, -1].astype(int)
+
+        combined_scores = self._combined_scores(boxes_xywh, confs, image.size)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.log(
+                logging.DEBUG,
+                "Normalized combined score: %s",
+                self._normalize_scores(combined_scores),
+            )
 
-        # Get the box with the highest combined score
-        best_box_index = np.argmax(normalized_combined_score)
-        logger.log(logging.DEBUG, f"Best box index: {best_box_index}")
+        # Best first, ties in detection order
+        ranked = np.argsort(-combined_scores, kind="stable")
+        best_box_index = ranked[0]
+        logger.log(logging.DEBUG, "Best box index: %s", best_box_index)
 
         # Extract the box with the highest combined score
         highest_score_box_xywh = boxes_xywh[best_box_index]
         highest_score_box_xyxy = boxes_xyxy[best_box_index]
 
         max_classes = input_classes[classes[best_box_index]]
-        detected_classes = [input_classes[c] for c in classes]
+        detected_classes = [input_classes[c] for c in classes.tolist()]
 
-        logger.log(logging.INFO, f"Detected classes: {detected_classes}")
-        logger.log(logging.INFO, f"Main object detected: {max_classes}")
+        logger.log(logging.INFO, "Detected classes: %s", detected_classes)
+        logger.log(logging.INFO, "Main object detected: %s", max_classes)
 
+        image_width, image_height = image.size
         return {
-            "boxes_xywh": boxes_xywh,
-            "boxes_xyxy": boxes_xyxy,
+            "boxes_xywh": list(boxes_xywh),
+            "boxes_xyxy": list(boxes_xyxy),
             "main_class": max_classes,
             "classes": detected_classes,
             "highest_score_box_xywh": highest_score_box_xywh,
             "highest_score_box_xyxy": highest_score_box_xyxy,
+            "main_confidence": float(confs[best_box_index]),
+            "main_area_ratio": float(
+                highest_score_box_xywh[2]
+                * highest_score_box_xywh[3]
+                / (image_width * image_height)
+            ),
+            "main_score": float(combined_scores[best_box_index]),
+            "scores": combined_scores.tolist(),
+            "ranked": ranked.tolist(),
         }
 
-    def _calculate_score(
+    @staticmethod
+    def top_objects(
+        result: ObjectDetectorResult, k: int, overlap_iou: float = 0.6
+    ) -> List[int]:
+        """
+        Indices of the `k` best boxes in the ranking of the result. A box overlapping
+        a better one by more than `overlap_iou` is the same object detected under
+        another keyword and is skipped. The fallback box is index 0.
+        """
+        if not result["ranked"]:
+            return [0]
+        boxes = np.asarray(result["boxes_xyxy"], dtype=np.float64)
+        selected: List[int] = []
+        for index in result["ranked"]:
+            if len(selected) == k:
+                break
+            if (
+                selected
+                and (_box_iou(boxes[index], boxes[selected]) > overlap_iou).any()
+            ):
+                continue
+            selected.append(index)
+        return selected
+
+    def detect_confident(
         self,
-        boxes_xywh: List[np.ndarray],
-        confs: List[float],
         image: Image.Image,
-    ) -> npt.NDArray:
-        # Image dimensions
-        image_width, image_height = image.size
-
-        # Calculate image center
-        image_center_x, image_center_y = image_width / 2, image_height / 2
-        del image
-
-        # Initialize lists to store scores for each condition
-        combined_scores = []
-
-        for i, box in enumerate(boxes_xywh):
-            # Calculate area of the bounding box (width * height)
-            area = box[2] * box[3]
-
-            # Calculate confidence score for the box
-            confidence = confs[i]
-
-            # Calculate proximity to the image center
-            box_center_x, box_center_y = box[0], box[1]
-            distance_to_center = np.sqrt(
-                (box_center_x - image_center_x) ** 2
-                + (box_center_y - image_center_y) ** 2
-            )
-            normalized_distance = (
-                1
-                - (distance_to_center / np.sqrt(image_width**2 + image_height**2)) ** 2
-            )
+        classes: List[str],
+        min_confidence: float,
+        min_area_ratio: float,
+        min_score: float,
+    ) -> Union[ObjectDetectorResult, None]:
+        """
+        Detects with the given vocabulary and returns the result only when the main
+        box clears the confidence, area and raw combined score thresholds.
+        """
+        result = self.detect_objects(image, classes)
+        if result["main_class"] is None:
+            return None
+        confident = (
+            result["main_confidence"] >= min_confidence
+            and result["main_area_ratio"] >= min_area_ratio
+            and result["main_score"] >= min_score
+        )
+        logger.log(
+            logging.INFO,
+            "Open vocabulary detection %r: confidence=%.2f area=%.2f score=%.2f %s",
+            result["main_class"],
+            result["main_confidence"],
+            result["main_area_ratio"],
+            result["main_score"],
+            "confident" if confident else "ambiguous",
+        )
+        return result if confident else None
 
-            # Calculate combined score using weighted factors
-            combined_score = (
-                self.weighted_score_threshold * confidence
-                + self.weight_area * (area / (image_width * image_height))
-                + self.weight_center_proximity * normalized_distance
-            )
-            combined_scores.append(combined_score)
+    @staticmethod
+    def _normalize_scores(combined_scores: npt.NDArray) -> npt.NDArray:
+        low, high = combined_scores.min(), combined_scores.max()
+        if high == low:
+            return np.ones_like(combined_scores)
+        return (combined_scores - low) / (high - low)
 
-        normalized_combined_score = np.interp(
-            combined_scores, (min(combined_scores), max(combined_scores)), (0, 1)
+    def _combined_scores(
+        self,
+        boxes_xywh: npt.NDArray,
+        confs: npt.NDArray,
+        image_size: Tuple[int, int],
+    ) -> npt.NDArray:
+        """
+        Weighted sum of the confidence, the area relative to the image and the
+        proximity to the image center (1 - squared distance / squared diagonal) of
+        every box.
+        """
+        image_width, image_height = image_size
+        boxes_xywh = np.asarray(boxes_xywh, dtype=np.float64)
+
+        area_ratio = boxes_xywh[:, 2] * boxes_xywh[:, 3] / (image_width * image_height)
+        squared_distance = (boxes_xywh[:, 0] - image_width / 2) ** 2 + (
+            boxes_xywh[:, 1] - image_height / 2
+        ) ** 2
+        center_proximity = 1 - squared_distance / (image_width**2 + image_height**2)
+
+        return (
+            self.weighted_score_threshold * np.asarray(confs, dtype=np.float64)
+            + self.weight_area * area_ratio
+            + self.weight_center_proximity * center_proximity
         )
-
-        return normalized_combined_score
@@ -0,0 +1,304 @@
+import os
+import json
+import base64
+import struct
+import logging
+import threading
+from array import array
+from itertools import combinations
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Tuple, Union
+import numpy as np
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+logger = logging.getLogger("toy_transformer")
+
+
+HASH_BITS = 64
+_ENTRY = struct.Struct("<QQ")  # hash, offset of the record in records.jsonl
+
+
+def dhash(image: Image.Image) -> int:
+    """
+    64-bit difference hash: the sign of the horizontal gradients of a 9x8 grayscale
+    thumbnail. Robust to resizing, recompression and small colour changes.
+    """
+    pixels = np.asarray(
+        image.convert("L").resize((9, 8), Image.BILINEAR), dtype=np.int16
+    )
+    bits = (pixels[:, 1:] > pixels[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def colour_thumbnail(image: Image.Image) -> str:
+    """16x16 RGB thumbnail, base64 encoded to be stored with a record."""
+    pixels = image.convert("RGB").resize((16, 16), Image.BOX)
+    return base64.b64encode(pixels.tobytes()).decode("ascii")
+
+
+def colour_difference(a: str, b: str) -> float:
+    """
+    Share of the cells of two colour thumbnails whose colour changed by more than
+    a quarter of the range in some channel. dhash only sees brightness gradients,
+    so a red and a navy object on the same background hash alike, this tells them
+    apart while resizing and recompression change next to no cells.
+    """
+    a_pixels = np.frombuffer(base64.b64decode(a), dtype=np.uint8).reshape(-1, 3)
+    b_pixels = np.frombuffer(base64.b64decode(b), dtype=np.uint8).reshape(-1, 3)
+    changed = np.abs(a_pixels.astype(np.int16) - b_pixels).max(axis=1) > 64
+    return float(changed.mean())
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+_BYTE_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(values: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):  # numpy >= 2.0
+        return np.bitwise_count(values)
+    return _BYTE_POPCOUNT[values.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PerceptualIndex:
+    """
+    Near-duplicate lookup over 64-bit perceptual hashes with multi-index hashing:
+    the hash is split into `chunks` substrings, each with its own table. Two hashes
+    within distance r agree to within r // chunks bits on at least one substring,
+    so a search only probes that neighbourhood of each substring and verifies the
+    few candidates it finds.
+
+    Older entries live in sorted numpy arrays searched with vectorized probes and
+    popcounts, new entries go to dict tables that are merged into the arrays once
+    they hold `freeze_every` entries or a quarter of the frozen ones.
+
+    Records are appended to `records.jsonl` and (hash, offset) pairs to
+    `index.bin` in `directory`, only the hashes and offsets are kept in memory.
+    Entries appended by other processes (pre-forked workers, a batch run) are read
+    from the tail of `index.bin` before each search and add. The methods are
+    thread-safe, callers on the event loop run them in a thread.
+    """
+
+    def __init__(
+        self,
+        directory: Union[str, Path, None] = None,
+        max_distance: int = 6,
+        chunks: int = 4,
+        freeze_every: int = 4096,
+    ):
+        if HASH_BITS % chunks:
+            raise ValueError(f"chunks must divide {HASH_BITS}")
+        self.max_distance = max_distance
+        self.chunks = chunks
+        self.chunk_bits = HASH_BITS // chunks
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+
+        self._hashes = array("Q")
+        self._offsets = array("Q")
+        self.freeze_every = freeze_every
+
+        # Entries [0, _frozen) are in the sorted arrays, the rest in the dict tables
+        self._frozen = 0
+        self._frozen_hashes = np.zeros(0, dtype=np.uint64)
+        self._frozen_keys = [np.zeros(0, dtype=np.int64) for _ in range(chunks)]
+        self._frozen_entries = [np.zeros(0, dtype=np.int64) for _ in range(chunks)]
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(chunks)]
+        self._flip_masks: Dict[int, List[int]] = {}
+        self._memory_records: List[Dict[str, Any]] = []
+
+        self._lock = threading.Lock()
+        self.directory = Path(directory) if directory is not None else None
+        self._records_file = None
+        self._index_file = None
+        self._index_read = 0  # bytes of index.bin loaded
+        if self.directory is not None:
+            self._open()
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _open(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._records_file = open(self.directory / "records.jsonl", "ab+")
+        self._index_file = open(self.directory / "index.bin", "ab+")
+        self._catch_up()
+        if len(self):
+            logger.log(
+                logging.INFO,
+                "Loaded %s perceptual hashes from %s",
+                len(self),
+                self.directory,
+            )
+
+    def _catch_up(self):
+        """Loads the entries appended to index.bin since the last call."""
+        size = os.fstat(self._index_file.fileno()).st_size
+        # Ignore a partially written last entry, it is complete on the next call
+        size -= (size - self._index_read) % _ENTRY.size
+        if size <= self._index_read:
+            return
+        self._index_file.seek(self._index_read)
+        data = self._index_file.read(size - self._index_read)
+        self._index_read = size
+
+        entries = np.frombuffer(data, dtype="<u8").reshape(-1, 2)
+        if len(entries) < self.freeze_every:
+            for image_hash, offset in entries.tolist():
+                self._insert(image_hash, offset)
+            return
+        self._hashes.frombytes(entries[:, 0].astype(np.uint64).tobytes())
+        self._offsets.frombytes(entries[:, 1].astype(np.uint64).tobytes())
+        self._freeze()
+
+    def close(self):
+        for f in (self._records_file, self._index_file):
+            if f is not None:
+                f.close()
+
+    def _substrings(self, image_hash: int) -> Iterator[Tuple[int, int]]:
+        for i in range(self.chunks):
+            yield i, (image_hash >> (i * self.chunk_bits)) & self._chunk_mask
+
+    def _neighbour_masks(self, radius: int) -> List[int]:
+        """XOR masks of every substring value within `radius` bits, cached."""
+        if radius not in self._flip_masks:
+            masks = []
+            for r in range(radius + 1):
+                for positions in combinations(range(self.chunk_bits), r):
+                    mask = 0
+                    for p in positions:
+                        mask |= 1 << p
+                    masks.append(mask)
+            self._flip_masks[radius] = masks
+        return self._flip_masks[radius]
+
+    def _insert(self, image_hash: int, offset: int):
+        entry = len(self._hashes)
+        self._hashes.append(image_hash)
+        self._offsets.append(offset)
+        for i, substring in self._substrings(image_hash):
+            self._tables[i].setdefault(substring, []).append(entry)
+        # Geometric growth keeps the amortised rebuild cost per insert constant
+        if entry + 1 - self._frozen >= max(self.freeze_every, self._frozen // 4):
+            self._freeze()
+
+    def _freeze(self):
+        """Rebuilds the sorted substring arrays over every entry."""
+        hashes = np.frombuffer(self._hashes, dtype=np.uint64)
+        self._frozen_hashes = hashes.copy()
+        for i in range(self.chunks):
+            keys = (hashes >> np.uint64(i * self.chunk_bits)) & np.uint64(
+                self._chunk_mask
+            )
+            order = np.argsort(keys, kind="stable")
+            self._frozen_keys[i] = keys[order].astype(np.int64)
+            self._frozen_entries[i] = order
+        self._frozen = len(hashes)
+        self._tables = [{} for _ in range(self.chunks)]
+
+    def search(
+        self,
+        image_hash: int,
+        max_distance: Union[int, None] = None,
+        accept: Union[Callable[[Dict[str, Any]], bool], None] = None,
+    ) -> Union[Tuple[int, int], None]:
+        """
+        Nearest entry within `max_distance` as (entry, distance), or None. With
+        `accept`, the records of the candidates are checked nearest first and the
+        nearest accepted one is returned.
+        """
+        with self._lock:
+            if self._index_file is not None:
+                self._catch_up()
+            candidates = self._candidates(image_hash, max_distance)
+            # Nearest first, the newest of equally near entries first
+            for entry in sorted(candidates, key=lambda e: (candidates[e], -e)):
+                if accept is None or accept(self._get(entry)):
+                    return entry, candidates[entry]
+            return None
+
+    def _candidates(
+        self, image_hash: int, max_distance: Union[int, None]
+    ) -> Dict[int, int]:
+        """Distance of every entry within `max_distance`, by entry id."""
+        if max_distance is None:
+            max_distance = self.max_distance
+        masks = self._neighbour_masks(max_distance // self.chunks)
+        found: Dict[int, int] = {}
+
+        # Frozen entries: all probes of a substring in one searchsorted, then one
+        # vectorized popcount over the gathered candidates
+        if self._frozen:
+            masks_array = np.asarray(masks, dtype=np.int64)
+            candidates = []
+            for i, substring in self._substrings(image_hash):
+                keys = self._frozen_keys[i]
+                probes = substring ^ masks_array
+                starts = np.searchsorted(keys, probes, side="left")
+                ends = np.searchsorted(keys, probes, side="right")
+                for start, end in zip(starts[ends > starts], ends[ends > starts]):
+                    candidates.append(self._frozen_entries[i][start:end])
+            if candidates:
+                entries = np.concatenate(candidates)
+                distances = _popcount(
+                    self._frozen_hashes[entries] ^ np.uint64(image_hash)
+                )
+                within = distances <= max_distance
+                found.update(zip(entries[within].tolist(), distances[within].tolist()))
+
+        # Entries added since the last freeze
+        for i, substring in self._substrings(image_hash):
+            table = self._tables[i]
+            for mask in masks:
+                for entry in table.get(substring ^ mask, ()):
+                    distance = hamming(self._hashes[entry], image_hash)
+                    if distance <= max_distance:
+                        found[entry] = distance
+        return found
+
+    def add(self, image_hash: int, record: Dict[str, Any]) -> int:
+        """Stores `record` for `image_hash` and returns its entry id."""
+        with self._lock:
+            if self._records_file is None:
+                self._memory_records.append(record)
+                self._insert(image_hash, len(self._memory_records) - 1)
+                return len(self._hashes) - 1
+
+            # Pre-forked workers append to the same files
+            if fcntl is not None:
+                fcntl.flock(self._records_file, fcntl.LOCK_EX)
+            try:
+                # Entries of the other writers go first, so that ours is next
+                self._catch_up()
+                self._records_file.seek(0, 2)
+                offset = self._records_file.tell()
+                self._records_file.write((json.dumps(record) + "\n").encode("utf-8"))
+                self._records_file.flush()
+                # The record is on disk before the index entry that points to it
+                self._index_file.write(_ENTRY.pack(image_hash, offset))
+                self._index_file.flush()
+                self._index_read += _ENTRY.size
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(self._records_file, fcntl.LOCK_UN)
+            self._insert(image_hash, offset)
+            return len(self._hashes) - 1
+
+    def get(self, entry: int) -> Dict[str, Any]:
+        with self._lock:
+            return self._get(entry)
+
+    def _get(self, entry: int) -> Dict[str, Any]:
+        offset = self._offsets[entry]
+        if self._records_file is None:
+            return self._memory_records[offset]
+        self._records_file.seek(offset)
+        return json.loads(self._records_file.readline())
@@ -1,10 +1,10 @@
 import logging
-from typing import Dict, Tuple
+from typing import Dict, List, Union
 import numpy as np
 import numpy.typing as npt
 from typing_extensions import TypedDict
 from PIL import Image
-from ultralytics import SAM
+from .inference_backends import create_segmentation_backend
 
 
 logger = logging.getLogger("toy_transformer")
@@ -18,48 +18,66 @@ class SegmentationResult(TypedDict):
 
 class Segmentation:
     def __init__(self, config: Dict):
-        self.sam_model = SAM(config["model_path"])
+        self.backend = create_segmentation_backend(config)
 
     def segment_object(
-        self, image: Image.Image, box_xyxy: npt.NDArray
+        self, image: Union[Image.Image, npt.NDArray], box_xyxy: npt.NDArray
     ) -> SegmentationResult:
-        logger.log(logging.INFO, f"Segmenting object with box {box_xyxy}.")
-
-        box_array = np.asarray(box_xyxy).reshape(-1, 4)
-        logger.log(logging.DEBUG, f"Box array shape: {box_array.shape}")
-        image_np = np.array(image)
-
-        results = self.sam_model(image_np, bboxes=box_array, device="cpu")
-        logger.log(logging.DEBUG, f"Segmentation results: {results}")
-        binary_mask = results[0].masks.data.cpu().numpy().squeeze()
-
-        return self._process_segmentation(image_np, binary_mask, box_xyxy)
+        return self.segment_objects(image, [box_xyxy])[0]
+
+    def segment_objects(
+        self, image: Union[Image.Image, npt.NDArray], boxes_xyxy: List[npt.NDArray]
+    ) -> List[SegmentationResult]:
+        """
+        Segments every box in one SAM call: the image is encoded once and each box
+        is decoded as a prompt.
+        """
+        logger.log(logging.INFO, "Segmenting objects with boxes %s.", boxes_xyxy)
+
+        box_array = np.asarray(boxes_xyxy).reshape(-1, 4)
+        logger.log(logging.DEBUG, "Box array shape: %s", box_array.shape)
+        # Shared read-only arrays are used as is, nothing below writes to them
+        image_np = np.asarray(image)
+
+        results = self.backend.predict(image_np, bboxes=box_array)
+        logger.log(logging.DEBUG, "Segmentation results: %s", results)
+        masks = results[0].masks.data.cpu().numpy()
+        masks = masks.reshape(len(box_array), *masks.shape[-2:])
+
+        return [
+            self._process_segmentation(image_np, binary_mask, box_xyxy)
+            for binary_mask, box_xyxy in zip(masks, box_array)
+        ]
 
     def _process_segmentation(
         self, image: npt.NDArray, binary_mask: npt.NDArray, box_xyxy: npt.NDArray
     ) -> SegmentationResult:
         logger.log(
             logging.INFO,
-            f"Processing segmentation results, binary mask shape: {binary_mask.shape}, box shape: {box_xyxy.shape}, image shape: {image.shape}",
+            "Processing segmentation results, binary mask shape: %s, "
+            "box shape: %s, image shape: %s",
+            binary_mask.shape,
+            box_xyxy.shape,
+            image.shape,
         )
 
-        logger.log(logging.DEBUG, f"Image shape: {image.shape}")
-        logger.log(logging.DEBUG, f"Binary mask shape: {binary_mask.shape}")
-        logger.log(logging.DEBUG, f"Box XYXY shape: {box_xyxy.shape}")
+        logger.log(logging.DEBUG, "Image shape: %s", image.shape)
+        logger.log(logging.DEBUG, "Binary mask shape: %s", binary_mask.shape)
+        logger.log(logging.DEBUG, "Box XYXY shape: %s", box_xyxy.shape)
 
         binary_mask_rgb = np.repeat(binary_mask[:, :, np.newaxis], 3, axis=2)
-        logger.log(logging.DEBUG, f"Binary mask RGB shape: {binary_mask_rgb.shape}")
+        logger.log(logging.DEBUG, "Binary mask RGB shape: %s", binary_mask_rgb.shape)
 
         white_background = np.ones_like(image) * 255
         isolated_object = np.where(binary_mask_rgb, image, white_background)
-        logger.log(logging.DEBUG, f"Isolated object shape: {isolated_object.shape}")
+        logger.log(logging.DEBUG, "Isolated object shape: %s", isolated_object.shape)
 
         # Cut out the isolated object using thr provided box
         isolated_object_PIL = Image.fromarray(isolated_object)
         isolated_box_cutout = isolated_object_PIL.copy()
         isolated_box_cutout = isolated_box_cutout.crop(box_xyxy)
         logger.log(
-            logging.DEBUG, f"Isolated box cutout size: {isolated_box_cutout.size}"
+            logging.DEBUG, "Isolated box cutout size: %s", isolated_box_cutout.size
         )
 
         logger.log(logging.INFO, "Segmentation processing complete")
@@ -1,9 +1,8 @@
 import logging
-from typing import Dict, List
-import google.generativeai as genai
+from typing import Dict, List, Union
 from PIL import Image
-from numpy import log
 from .base_service import BaseService
+from ..core.gemini_governor import GeminiGovernor
 from ..core.prompt_manager import PromptManager, PromptSequenceItem
 
 
@@ -11,14 +10,22 @@ logger = logging.getLogger("toy_transformer")
 
 
 class ToyDescriptionModifier(BaseService):
-    def __init__(self, config: Dict, prompt_manager: PromptManager):
+    def __init__(
+        self,
+        config: Dict,
+        prompt_manager: PromptManager,
+        governor: Union[GeminiGovernor, None] = None,
+    ):
         super().__init__(
             config,
             prompt_manager,
             prompt_type="toy_desc_modifier",
-            max_concurrency=4,
+            governor=governor,
+            priority=0,
             max_total_tasks=4,
         )
+        import google.generativeai as genai
+
         self.model = genai.GenerativeModel(
             config["model_name"],
             system_instruction=self._get_prompt_key("system_prompt"),
@@ -37,11 +44,13 @@ class ToyDescriptionModifier(BaseService):
             PromptSequenceItem("text", f"Original description: {org_description}")
         )
 
-        response = self.model.generate_content(sequence.get_sequence())
+        response = await self.model.generate_content_async(sequence.get_sequence())
         return response.text
 
     def process_results(self, results: List[str]) -> str:
-        logger.log(logging.DEBUG, f"Processing results: {results}")
+        logger.log(logging.DEBUG, "Processing results: %s", results)
         longest_toy_description = max(results, key=len)
-        logger.log(logging.DEBUG, f"Longest toy description: {longest_toy_description}")
+        logger.log(
+            logging.DEBUG, "Longest toy description: %s", longest_toy_description
+        )
         return longest_toy_description
@@ -1,3 +1,20 @@
+// Resolved while the script runs, relative to this file
+const RESIZE_WORKER_URL = new URL(
+  "resize_worker.js",
+  document.currentScript?.src || window.location.href,
+).href;
+
+// A resize taking longer than this uploads the original instead
+const RESIZE_TIMEOUT_MS = 20000;
+
+const DEFAULT_UPLOAD_LIMITS = {
+  max_dimension: null,
+  max_file_size: 10 * 1024 * 1024,
+  formats: ["image/jpeg", "image/webp"],
+  quality: 0.9,
+  min_resize_bytes: 1024 * 1024,
+};
+
 class ImageTransformer {
   constructor() {
     this.video = document.getElementById("video");
@@ -12,6 +29,14 @@ class ImageTransformer {
     this.main_object = document.getElementById("main_object");
     this.detected_objects = document.getElementById("detected_objects");
     this.error = document.getElementById("error");
+    this.previewUrl = null;
+
+    // Uploads are downscaled to what the server decodes, see prepareUpload
+    this.uploadLimits = this.fetchUploadLimits();
+    this.resizeWorker = null;
+    this.resizeWorkerBroken = false;
+    this.resizeRequests = new Map();
+    this.nextResizeId = 0;
 
     if (!this.canvas || !this.context) {
       console.error("Required elements not found");
@@ -29,6 +54,154 @@ class ImageTransformer {
     });
   }
 
+  async fetchUploadLimits() {
+    try {
+      const response = await fetch("/upload-limits");
+      if (!response.ok) throw new Error(response.statusText);
+      return { ...DEFAULT_UPLOAD_LIMITS, ...(await response.json()) };
+    } catch (err) {
+      console.warn("Upload limits unavailable, uploading originals:", err);
+      return DEFAULT_UPLOAD_LIMITS;
+    }
+  }
+
+  getResizeWorker() {
+    if (
+      !this.resizeWorker &&
+      !this.resizeWorkerBroken &&
+      typeof Worker !== "undefined" &&
+      typeof OffscreenCanvas !== "undefined"
+    ) {
+      this.resizeWorker = new Worker(RESIZE_WORKER_URL);
+      this.resizeWorker.onmessage = (event) => {
+        const { id, error, ...result } = event.data;
+        const request = this.resizeRequests.get(id);
+        if (!request) return; // timed out already
+        this.resizeRequests.delete(id);
+        clearTimeout(request.timer);
+        if (error) request.reject(new Error(error));
+        else request.resolve(result);
+      };
+      // The script failed to load or threw outside a request, e.g. out of memory
+      this.resizeWorker.onerror = (event) => {
+        event.preventDefault();
+        this.resizeWorkerBroken = true;
+        this.stopResizeWorker(
+          new Error(event.message || "The resize worker failed"),
+        );
+      };
+    }
+    return this.resizeWorker;
+  }
+
+  stopResizeWorker(error) {
+    // Every pending upload falls back to the original file
+    for (const request of this.resizeRequests.values()) {
+      clearTimeout(request.timer);
+      request.reject(error);
+    }
+    this.resizeRequests.clear();
+    this.resizeWorker?.terminate();
+    this.resizeWorker = null;
+  }
+
+  resizeInWorker(worker, file, limits) {
+    const id = this.nextResizeId++;
+    return new Promise((resolve, reject) => {
+      // A stuck worker is replaced on the next upload
+      const timer = setTimeout(
+        () => this.stopResizeWorker(new Error("Resizing timed out")),
+        RESIZE_TIMEOUT_MS,
+      );
+      this.resizeRequests.set(id, { resolve, reject, timer });
+      worker.postMessage({
+        id,
+        file,
+        maxDimension: limits.max_dimension,
+        formats: limits.formats,
+        quality: limits.quality,
+      });
+    });
+  }
+
+  async resizeOnMainThread(file, limits) {
+    // Browsers without OffscreenCanvas in workers
+    const bitmap = await createImageBitmap(file, {
+      imageOrientation: "from-image",
+    });
+    const scale = limits.max_dimension
+      ? Math.min(1, limits.max_dimension / Math.max(bitmap.width, bitmap.height))
+      : 1;
+    const canvas = document.createElement("canvas");
+    canvas.width = Math.max(1, Math.round(bitmap.width * scale));
+    canvas.height = Math.max(1, Math.round(bitmap.height * scale));
+    const context = canvas.getContext("2d");
+    context.imageSmoothingQuality = "high";
+    context.fillStyle = "#fff";
+    context.fillRect(0, 0, canvas.width, canvas.height);
+    context.drawImage(bitmap, 0, 0, canvas.width, canvas.height);
+
+    const blob = await new Promise((resolve) =>
+      canvas.toBlob(resolve, "image/jpeg", limits.quality),
+    );
+    if (!blob) {
+      // The canvas was too large to encode
+      bitmap.close();
+      throw new Error("Could not encode the resized image");
+    }
+    const result = {
+      blob,
+      width: canvas.width,
+      height: canvas.height,
+      originalWidth: bitmap.width,
+      originalHeight: bitmap.height,
+    };
+    bitmap.close();
+    return result;
+  }
+
+  /**
+   * Downscales the image to the largest size the server decodes and re-encodes
+   * it (JPEG or WebP), so less is uploaded and decoded. Small files within
+   * the limits, and files the browser cannot decode, are sent as they are.
+   */
+  async prepareUpload(file) {
+    const limits = await this.uploadLimits;
+    if (!limits.max_dimension && file.size < limits.min_resize_bytes) {
+      return file;
+    }
+
+    let result;
+    try {
+      const worker = this.getResizeWorker();
+      result = worker
+        ? await this.resizeInWorker(worker, file, limits)
+        : await this.resizeOnMainThread(file, limits);
+    } catch (err) {
+      console.warn("Could not resize the image, uploading the original:", err);
+      return file;
+    }
+
+    const downscaled =
+      result.width < result.originalWidth ||
+      result.height < result.originalHeight;
+    if (
+      !downscaled &&
+      (file.size < limits.min_resize_bytes || result.blob.size >= file.size)
+    ) {
+      return file;
+    }
+
+    const extension = result.blob.type === "image/webp" ? "webp" : "jpg";
+    const name = file.name.replace(/\.[^.]*$/, "") + "." + extension;
+    console.info(
+      `Upload resized from ${result.originalWidth}x${result.originalHeight} ` +
+        `(${file.size} bytes) to ${result.width}x${result.height} ` +
+        `(${result.blob.size} bytes)`,
+    );
+    return new File([result.blob], name, { type: result.blob.type });
+  }
+
   showLoading() {
     const overlay = document.getElementById("loadingOverlay");
     const spinner = document.getElementById("loadingSpinner");
@@ -173,20 +346,11 @@ class ImageTransformer {
       return false;
     }
 
-    if (file.size > 10 * 1024 * 1024) {
-      this.showError("File size must be less than 10MB");
-      return false;
-    }
-
-    // Preview image
-    const reader = new FileReader();
-    reader.onload = (e) => {
-      // this.resultImage.src = e.target.result;
-      // this.resultImage.classList.remove("hidden");
-      this.inputImage.src = e.target.result;
-      this.inputImage.classList.remove("hidden");
-    };
-    reader.readAsDataURL(file);
+    // Preview image, an object URL avoids base64-encoding large photos
+    if (this.previewUrl) URL.revokeObjectURL(this.previewUrl);
+    this.previewUrl = URL.createObjectURL(file);
+    this.inputImage.src = this.previewUrl;
+    this.inputImage.classList.remove("hidden");
 
     return true;
   }
@@ -203,8 +367,17 @@ class ImageTransformer {
       return;
     }
 
+    // The size limit applies to what is sent, phone photos are downscaled first
+    const upload = await this.prepareUpload(file);
+    const limits = await this.uploadLimits;
+    if (upload.size > limits.max_file_size) {
+      const maxMb = Math.round(limits.max_file_size / (1024 * 1024));
+      this.showError(`File size must be less than ${maxMb}MB`);
+      return;
+    }
+
     const formData = new FormData();
-    formData.append("file", file);
+    formData.append("file", upload, upload.name);
     await this.uploadImage(formData);
   }
 
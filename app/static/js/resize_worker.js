@@ -0,0 +1,48 @@
+// Downscales and re-encodes images off the main thread, see
+// ImageTransformer.prepareUpload in main.js
+
+async function encode(canvas, formats, quality) {
+  for (const type of formats) {
+    const blob = await canvas.convertToBlob({ type, quality });
+    // Browsers that cannot encode a format fall back to PNG
+    if (blob.type === type) return blob;
+  }
+  return canvas.convertToBlob({ type: "image/jpeg", quality });
+}
+
+self.onmessage = async (event) => {
+  const { id, file, maxDimension, formats, quality } = event.data;
+
+  try {
+    // EXIF orientation is applied here, the re-encoded file has no EXIF
+    const bitmap = await createImageBitmap(file, {
+      imageOrientation: "from-image",
+    });
+    const scale = maxDimension
+      ? Math.min(1, maxDimension / Math.max(bitmap.width, bitmap.height))
+      : 1;
+    const width = Math.max(1, Math.round(bitmap.width * scale));
+    const height = Math.max(1, Math.round(bitmap.height * scale));
+
+    const canvas = new OffscreenCanvas(width, height);
+    const context = canvas.getContext("2d");
+    context.imageSmoothingQuality = "high";
+    // The server flattens transparency onto white anyway, and JPEG has no alpha
+    context.fillStyle = "#fff";
+    context.fillRect(0, 0, width, height);
+    context.drawImage(bitmap, 0, 0, width, height);
+
+    const blob = await encode(canvas, formats, quality);
+    self.postMessage({
+      id,
+      blob,
+      width,
+      height,
+      originalWidth: bitmap.width,
+      originalHeight: bitmap.height,
+    });
+    bitmap.close();
+  } catch (err) {
+    self.postMessage({ id, error: err.message });
+  }
+};
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from pathlib import Path
+from typing import Dict, Iterator, List, Set, Tuple
+
+from app.core.config import ConfigHandler
+from app.core.logging import setup_logging
+from app.services.image_processor import ImageProcessor
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+# Fields of the pipeline result written to the manifest (image_bytes is dropped)
+MANIFEST_FIELDS = (
+    "image_url",
+    "description",
+    "toy_description",
+    "main_object",
+    "detected_objects",
+)
+
+
+def walk_images(input_dir: Path) -> Iterator[Path]:
+    """Yields image files under input_dir in a stable order."""
+    for root, dirs, files in os.walk(input_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if Path(name).suffix.lower() in IMAGE_EXTENSIONS:
+                yield Path(root) / name
+
+
+def item_key(path: Path, input_dir: Path) -> str:
+    return path.relative_to(input_dir).as_posix()
+
+
+def output_name(key: str) -> str:
+    """Flattens a relative path into a unique output filename."""
+    return key.replace("/", "__")
+
+
+class Checkpoint:
+    """
+    Append-only record of completed item keys. Each line is written and flushed as
+    soon as an item succeeds, so an interrupted run loses at most the items that were
+    in flight. Failed items are not recorded and are retried on the next run.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.completed: Set[str] = set()
+        if path.exists():
+            with open(path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self.completed.add(json.loads(line)["key"])
+        self._file = open(path, "a")
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.completed
+
+    def mark_done(self, key: str):
+        self.completed.add(key)
+        self._file.write(json.dumps({"key": key}) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self._file.close()
+
+
+class Progress:
+    def __init__(self, total: int, skipped: int, every: float = 2.0):
+        self.total = total
+        self.skipped = skipped
+        self.done = 0
+        self.failed = 0
+        self.every = every
+        self.started_at = time.perf_counter()
+        self._last_print = 0.0
+
+    def update(self, success: bool):
+        self.done += 1
+        self.failed += not success
+        now = time.perf_counter()
+        if now - self._last_print >= self.every or self.done == self.total:
+            self._last_print = now
+            self.print(now)
+
+    def print(self, now: float):
+        elapsed = now - self.started_at
+        rate = self.done / elapsed if elapsed else 0.0
+        remaining = self.total - self.done
+        eta = remaining / rate if rate else float("inf")
+        sys.stderr.write(
+            f"\r[{self.done}/{self.total}] {rate:.2f} img/s "
+            f"failed={self.failed} skipped={self.skipped} "
+            f"elapsed={elapsed:.0f}s eta={eta:.0f}s"
+        )
+        if self.done == self.total:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+
+async def run(args: argparse.Namespace):
+    input_dir = Path(args.input_dir).resolve()
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    config = ConfigHandler(args.config)
+    logger = setup_logging(
+        output_dir / "batch_runner.log", **config.get_logging_config()
+    )
+
+    storage_config = config.config.setdefault("storage", {})
+    storage_config["artifact_dir"] = str(output_dir / "artifacts")
+    storage_config["max_records"] = None  # keep every output of the run
+    # The duplicate index points at these artifacts, keep it next to them
+    dedup_config = config.config.setdefault("dedup", {})
+    dedup_config["index_dir"] = str(output_dir / "index")
+    batch_config = config.config.setdefault("batch", {})
+    batch_config["local_workers"] = args.local_workers
+    # The run is the only tenant, --max-in-flight bounds it instead of the
+    # server's fair scheduling limits
+    config.config["scheduler"] = {
+        "max_concurrency": args.max_in_flight,
+        "interactive_reserved": 0,
+        "tenant_max_concurrency": args.max_in_flight,
+    }
+    if args.profile is not None:
+        # Only load the models of the profile this run uses
+        config.config.setdefault("profiles", {})["active"] = [args.profile]
+    if args.gemini_concurrency is not None:
+        governor_config = config.config["models"]["gemini"].setdefault("governor", {})
+        governor_config["max_concurrency"] = args.gemini_concurrency
+        governor_config["initial_concurrency"] = min(
+            governor_config.get("initial_concurrency", 8), args.gemini_concurrency
+        )
+
+    checkpoint = Checkpoint(output_dir / "checkpoint.jsonl")
+    all_keys: List[Tuple[str, Path]] = [
+        (item_key(path, input_dir), path) for path in walk_images(input_dir)
+    ]
+    if args.limit is not None:
+        all_keys = all_keys[: args.limit]
+    todo = [(key, path) for key, path in all_keys if key not in checkpoint]
+    skipped = len(all_keys) - len(todo)
+    logger.log(
+        logging.INFO,
+        "Batch run: %s images found, %s already done, %s to process",
+        len(all_keys),
+        skipped,
+        len(todo),
+    )
+    if not todo:
+        print(f"Nothing to do: all {len(all_keys)} images are in the checkpoint")
+        checkpoint.close()
+        return
+
+    processor = ImageProcessor(config)
+    keys_by_name: Dict[str, str] = {output_name(key): key for key, _ in todo}
+    progress = Progress(len(todo), skipped)
+
+    with open(output_dir / "manifest.jsonl", "a") as manifest:
+        try:
+            async for item in processor.process_batch(
+                ((output_name(key), path) for key, path in todo),
+                max_concurrency=args.max_in_flight,
+                profile=args.profile,
+            ):
+                key = keys_by_name[item["filename"]]
+                record = {
+                    "key": key,
+                    "success": item["success"],
+                    "error": item["error"],
+                    "elapsed": round(item["elapsed"], 3),
+                    "output": str(processor.artifacts.path(item["artifact_id"]))
+                    if item["success"]
+                    else None,
+                }
+                record.update({field: item.get(field) for field in MANIFEST_FIELDS})
+                manifest.write(json.dumps(record) + "\n")
+                manifest.flush()
+
+                if item["success"]:
+                    checkpoint.mark_done(key)
+                progress.update(item["success"])
+        finally:
+            checkpoint.close()
+
+    elapsed = time.perf_counter() - progress.started_at
+    logger.log(
+        logging.INFO,
+        "Batch run finished: %s succeeded, %s failed in %.1fs (%.2f img/s)",
+        progress.done - progress.failed,
+        progress.failed,
+        elapsed,
+        progress.done / elapsed,
+    )
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        description="Run the toy transformation pipeline over a directory of images "
+        "without the API server. Re-running with the same output directory resumes "
+        "from the checkpoint."
+    )
+    parser.add_argument("input_dir", help="Directory of images (walked recursively)")
+    parser.add_argument(
+        "output_dir", help="Directory for outputs, manifest, checkpoint"
+    )
+    parser.add_argument("--config", default=None, help="Path to config.yaml")
+    parser.add_argument(
+        "--profile",
+        default=None,
+        help="Quality/latency profile from config.yaml (default: profiles.default)",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=8,
+        help="Images processed concurrently through the pipeline",
+    )
+    parser.add_argument(
+        "--local-workers",
+        type=int,
+        default=1,
+        help="YOLOWorld/SAM replicas running inference in parallel",
+    )
+    parser.add_argument(
+        "--gemini-concurrency",
+        type=int,
+        default=None,
+        help="Maximum concurrent Gemini calls (default from config)",
+    )
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Only consider the first N images"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run(parse_args()))
+    except KeyboardInterrupt:
+        print("\nInterrupted. Re-run the same command to resume.", file=sys.stderr)
@@ -0,0 +1,239 @@
+import argparse
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import numpy as np
+from PIL import Image
+
+from app.core.config import ConfigHandler
+from app.services.inference_backends import (
+    DETECTOR_BACKENDS,
+    create_detector_backend,
+    create_segmentation_backend,
+)
+
+DEFAULT_CLASSES = ["person", "dog", "cat", "car", "toy", "cup", "chair", "bottle"]
+
+
+def load_images(paths: List[str]) -> List[Tuple[str, Image.Image]]:
+    files = []
+    for path in map(Path, paths):
+        files.extend(sorted(path.glob("*")) if path.is_dir() else [path])
+    return [(f.name, Image.open(f).convert("RGB")) for f in files]
+
+
+def detections(backend, image: Image.Image, classes: List[str]) -> np.ndarray:
+    """Rows of x1, y1, x2, y2, conf, cls."""
+    return backend.predict(image, classes)[0].boxes.data.cpu().numpy()
+
+
+def pairwise_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:4] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:4] - b[:, :2], axis=1)
+    return intersection / (area_a[:, None] + area_b[None, :] - intersection + 1e-9)
+
+
+def compare(
+    reference: np.ndarray,
+    candidate: np.ndarray,
+    min_conf: float,
+    min_iou: float,
+    conf_tolerance: float,
+) -> List[str]:
+    """
+    Mismatches between two detection sets: every box of either side above
+    `min_conf` needs a box of the same class on the other side with an IoU of at
+    least `min_iou` and a confidence within `conf_tolerance`. Boxes just above the
+    NMS threshold may be dropped by one backend only, hence `min_conf`.
+    """
+    problems = []
+    for name, left, right in (
+        ("missing", reference, candidate),
+        ("extra", candidate, reference),
+    ):
+        left = left[left[:, 4] >= min_conf]
+        if not len(left):
+            continue
+        if not len(right):
+            problems.extend(f"{name} class {int(row[5])}" for row in left)
+            continue
+        iou = pairwise_iou(left, right)
+        iou[left[:, None, 5] != right[None, :, 5]] = 0
+        for i, row in enumerate(left):
+            j = int(np.argmax(iou[i]))
+            if iou[i, j] < min_iou:
+                problems.append(f"{name} class {int(row[5])} conf {row[4]:.2f}")
+            elif abs(row[4] - right[j, 4]) > conf_tolerance:
+                problems.append(
+                    f"class {int(row[5])} conf {row[4]:.3f} vs {right[j, 4]:.3f}"
+                )
+    return problems
+
+
+def prompt_boxes(image_np: np.ndarray) -> np.ndarray:
+    """A centred box and an off-centre one, in image pixels."""
+    height, width = image_np.shape[:2]
+    return np.array(
+        [
+            [width * 0.25, height * 0.25, width * 0.75, height * 0.75],
+            [width * 0.1, height * 0.1, width * 0.6, height * 0.9],
+        ]
+    )
+
+
+def masks(backend, image_np: np.ndarray, boxes: np.ndarray) -> np.ndarray:
+    """One boolean mask per box."""
+    data = backend.predict(image_np, boxes)[0].masks.data.cpu().numpy()
+    return data.reshape(len(boxes), *data.shape[-2:]) > 0.5
+
+
+def mask_iou(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """IoU of the masks of two (n, H, W) stacks, pairwise by index."""
+    intersection = (a & b).sum(axis=(1, 2))
+    union = (a | b).sum(axis=(1, 2))
+    return intersection / np.maximum(union, 1)
+
+
+def time_calls(call, repeat: int, warmup: int) -> Dict[str, float]:
+    for _ in range(warmup):
+        call()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return {
+        "median": float(np.median(timings)) * 1e3,
+        "p90": float(np.percentile(timings, 90)) * 1e3,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks that the exported detector backends (onnx, openvino) "
+        "find the same boxes and classes as torch on fixture images, then times "
+        "every backend. With --sam, the same for the segmentation backends."
+    )
+    parser.add_argument("images", nargs="*", default=["assets/images"])
+    parser.add_argument("--backends", nargs="+", default=list(DETECTOR_BACKENDS[1:]))
+    parser.add_argument("--classes", nargs="+", default=DEFAULT_CLASSES)
+    parser.add_argument("--min-conf", type=float, default=0.35)
+    parser.add_argument("--min-iou", type=float, default=0.9)
+    parser.add_argument("--conf-tolerance", type=float, default=0.05)
+    parser.add_argument("--int8", action="store_true", help="Also run int8 onnx")
+    parser.add_argument("--sam", action="store_true", help="Also check SAM backends")
+    parser.add_argument("--min-mask-iou", type=float, default=0.9)
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    args = parser.parse_args()
+
+    config = ConfigHandler()
+    yolo_config = config.get_model_config("yolo")
+    images = load_images(args.images)
+    if not images:
+        sys.exit("No images found")
+
+    variants = [("torch", {"backend": "torch", "int8": False})]
+    for backend in args.backends:
+        variants.append((backend, {"backend": backend, "int8": False}))
+        if args.int8 and backend == "onnx":
+            variants.append(("onnx int8", {"backend": "onnx", "int8": True}))
+
+    reference = None
+    failed = False
+    print(f"{'backend':<14} {'median ms':>10} {'p90 ms':>8}  parity")
+    for name, overrides in variants:
+        try:
+            backend = create_detector_backend({**yolo_config, **overrides})
+        except ImportError as e:
+            if reference is None:
+                sys.exit(f"The torch reference is unavailable: {e}")
+            print(f"{name:<14} skipped: {e}")
+            continue
+
+        results = [detections(backend, image, args.classes) for _, image in images]
+        problems = []
+        if reference is None:
+            reference, parity = results, "reference"
+        else:
+            for (filename, _), ref, res in zip(images, reference, results):
+                problems.extend(
+                    f"{filename}: {p}"
+                    for p in compare(
+                        ref, res, args.min_conf, args.min_iou, args.conf_tolerance
+                    )
+                )
+            # INT8 trades accuracy for speed, it is reported but does not fail
+            if problems and "int8" not in name:
+                failed = True
+            parity = "ok" if not problems else f"{len(problems)} mismatches"
+
+        image = images[0][1]
+        timing = time_calls(
+            lambda: backend.predict(image, args.classes), args.repeat, args.warmup
+        )
+        print(f"{name:<14} {timing['median']:>10.1f} {timing['p90']:>8.1f}  {parity}")
+        for problem in problems[:10]:
+            print(f"    {problem}")
+
+    # SAM: masks of the exported graphs against torch, INT8 is reported only
+    if args.sam:
+        sam_config = config.get_model_config("sam")
+        arrays = [(filename, np.asarray(image)) for filename, image in images]
+        sam_variants = [
+            ("sam torch", {"backend": "torch", "device": "cpu", "int8": False}),
+            ("sam int8", {"backend": "torch", "device": "cpu", "int8": True}),
+        ]
+        for backend in args.backends:
+            sam_variants.append((f"sam {backend}", {"backend": backend, "int8": False}))
+            if args.int8 and backend == "onnx":
+                sam_variants.append(
+                    ("sam onnx int8", {"backend": "onnx", "int8": True})
+                )
+
+        reference_masks = None
+        for name, overrides in sam_variants:
+            try:
+                sam = create_segmentation_backend({**sam_config, **overrides})
+            except ImportError as e:
+                if reference_masks is None:
+                    sys.exit(f"The torch SAM reference is unavailable: {e}")
+                print(f"{name:<14} skipped: {e}")
+                continue
+
+            results = [masks(sam, array, prompt_boxes(array)) for _, array in arrays]
+            problems = []
+            if reference_masks is None:
+                reference_masks, parity = results, "reference"
+            else:
+                for (filename, _), ref, res in zip(arrays, reference_masks, results):
+                    problems.extend(
+                        f"{filename}: box {i} mask IoU {iou:.3f}"
+                        for i, iou in enumerate(mask_iou(ref, res))
+                        if iou < args.min_mask_iou
+                    )
+                if problems and "int8" not in name:
+                    failed = True
+                parity = "ok" if not problems else f"{len(problems)} mismatches"
+
+            image_np = arrays[0][1]
+            boxes = prompt_boxes(image_np)
+            timing = time_calls(
+                lambda: sam.predict(image_np, boxes), args.repeat, args.warmup
+            )
+            print(
+                f"{name:<14} {timing['median']:>10.1f} {timing['p90']:>8.1f}  {parity}"
+            )
+            for problem in problems[:10]:
+                print(f"    {problem}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
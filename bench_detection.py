@@ -0,0 +1,114 @@
+import argparse
+import time
+from typing import List
+
+import numpy as np
+from PIL import Image
+
+from app.core.config import ConfigHandler
+from app.services.object_detector import ObjectDetector
+
+
+class FakeTensor:
+    """The parts of a CPU torch tensor the detector post-processing uses."""
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+
+    def cpu(self) -> "FakeTensor":
+        return self
+
+    def numpy(self) -> np.ndarray:
+        return self.array
+
+    def item(self) -> float:
+        return self.array.item()
+
+    def __getitem__(self, index) -> "FakeTensor":
+        return FakeTensor(self.array[index])
+
+
+class FakeBoxes:
+    """Ultralytics `Boxes` of one result, rows of x1, y1, x2, y2, conf, cls."""
+
+    def __init__(self, data: np.ndarray):
+        self.data = FakeTensor(data)
+        self.xyxy = FakeTensor(data[:, :4])
+        x1, y1, x2, y2 = data[:, :4].T
+        self.xywh = FakeTensor(
+            np.stack(((x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1), 1)
+        )
+        self.conf = FakeTensor(data[:, 4])
+        self.cls = FakeTensor(data[:, 5])
+
+    def __len__(self) -> int:
+        return len(self.data.array)
+
+    # Per-box iteration, to time revisions that walked the boxes one by one
+    def __iter__(self):
+        for i in range(len(self)):
+            yield FakeBoxes(self.data.array[i : i + 1])
+
+
+class FakeResult:
+    def __init__(self, data: np.ndarray):
+        self.boxes = FakeBoxes(data)
+
+
+def synthetic_results(
+    n: int, classes: int, size: int, rng: np.random.Generator
+) -> List[FakeResult]:
+    xy = rng.uniform(0, size * 0.8, (n, 2))
+    wh = rng.uniform(8, size * 0.5, (n, 2))
+    data = np.column_stack(
+        (
+            xy,
+            np.minimum(xy + wh, size),
+            rng.uniform(0.05, 1, n),
+            rng.integers(0, classes, n),
+        )
+    ).astype(np.float32)
+    return [FakeResult(data)]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Times the detection post-processing and scoring on synthetic "
+        "box sets (no model is loaded)."
+    )
+    parser.add_argument("--boxes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    parser.add_argument("--classes", type=int, default=300)
+    parser.add_argument("--size", type=int, default=1024, help="Image side (px)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The scoring weights of the configured detector, without its model
+    config = ConfigHandler().get_model_config("yolo")
+    detector = ObjectDetector.__new__(ObjectDetector)
+    detector.weighted_score_threshold = config["weighted_score_threshold"]
+    detector.weight_confidence = config["weight_confidence"]
+    detector.weight_area = config["weight_area"]
+    detector.weight_center_proximity = config["weight_center_proximity"]
+
+    rng = np.random.default_rng(args.seed)
+    image = Image.new("RGB", (args.size, args.size))
+    input_classes = [f"class {i}" for i in range(args.classes)]
+
+    print(f"{'boxes':>8} {'median ms':>10} {'min ms':>10} {'us/box':>8}")
+    for n in args.boxes:
+        results = synthetic_results(n, args.classes, args.size, rng)
+        timings = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            detector._process_results(results, input_classes, image)
+            timings.append(time.perf_counter() - start)
+        median = float(np.median(timings))
+        print(
+            f"{n:>8} {median * 1e3:>10.3f} {min(timings) * 1e3:>10.3f} "
+            f"{median * 1e6 / n:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
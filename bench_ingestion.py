@@ -0,0 +1,152 @@
+import argparse
+import io
+import sys
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+from PIL import Image, ImageOps
+
+from app.services.image_ingestion import ingest_image
+
+# Colour of the marker drawn in the top-left corner of every upright fixture
+MARKER = (255, 0, 0)
+
+
+def photo(width: int, height: int, rng: np.random.Generator) -> Image.Image:
+    """Smooth gradients with sensor-like noise, so JPEG sizes are photo-like."""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.stack(
+        (x / width * 255, y / height * 255, (x + y) / (width + height) * 255), 2
+    )
+    pixels += rng.normal(0, 6, (height, width, 1)).astype(np.float32)
+    image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    image.paste(MARKER, (0, 0, width // 8, height // 8))
+    return image
+
+
+def fixtures(
+    scale: float, seed: int
+) -> Dict[str, Tuple[bytes, Tuple[int, int], Tuple[int, ...]]]:
+    """Encoded large photos by name, with their upright size and marker colour."""
+    rng = np.random.default_rng(seed)
+
+    def size(width: int, height: int) -> Tuple[int, int]:
+        return round(width * scale), round(height * scale)
+
+    result = {}
+
+    # Portrait phone photo stored landscape, EXIF orientation 6 rotates it upright
+    upright = photo(*size(6000, 8000), rng)
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    buffer = io.BytesIO()
+    upright.transpose(Image.ROTATE_90).save(
+        buffer, format="JPEG", quality=90, exif=exif
+    )
+    result["jpeg_8000x6000_exif6"] = buffer.getvalue(), upright.size, MARKER
+
+    for name, (width, height), options in (
+        ("jpeg_12000x9000_progressive", (12000, 9000), {"progressive": True}),
+        ("webp_6000x4000", (6000, 4000), {"format": "WEBP", "quality": 85}),
+    ):
+        image = photo(*size(width, height), rng)
+        buffer = io.BytesIO()
+        image.save(buffer, **{"format": "JPEG", "quality": 90, **options})
+        result[name] = buffer.getvalue(), image.size, MARKER
+
+    # Transparency is flattened onto white
+    alpha = 200
+    image = photo(*size(6000, 4000), rng).convert("RGBA")
+    image.putalpha(alpha)
+    buffer = io.BytesIO()
+    image.save(buffer, format="PNG", compress_level=1)
+    marker = tuple(round(c * alpha / 255 + 255 * (1 - alpha / 255)) for c in MARKER)
+    result["png_6000x4000_rgba"] = buffer.getvalue(), image.size, marker
+    return result
+
+
+def full_decode(data: bytes, max_size: Union[int, None]) -> Image.Image:
+    """Decoding without draft mode, as before ingest_image."""
+    image = ImageOps.exif_transpose(Image.open(io.BytesIO(data))).convert("RGB")
+    if max_size:
+        image.thumbnail((max_size, max_size), Image.LANCZOS)
+    return image
+
+
+def check(
+    image: Image.Image,
+    upright: Tuple[int, int],
+    marker: Tuple[int, ...],
+    max_size: Union[int, None],
+) -> List[str]:
+    """Problems of an ingested fixture: wrong orientation, size or marker."""
+    problems = []
+    expected_scale = min(1, max_size / max(upright)) if max_size else 1
+    expected = (upright[0] * expected_scale, upright[1] * expected_scale)
+    if any(abs(a - b) > 2 for a, b in zip(image.size, expected)):
+        problems.append(f"size {image.size}, expected about {expected}")
+    corner = image.getpixel((image.width // 32, image.height // 32))
+    if any(abs(a - b) > 40 for a, b in zip(corner, marker)):
+        problems.append(f"top-left pixel {corner}, the image is not upright")
+    return problems
+
+
+def median_ms(call, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generates large photo fixtures (EXIF-rotated, progressive, "
+        "WebP, transparent PNG), checks that ingest_image returns them upright at "
+        "the requested size and times it against a full decode."
+    )
+    parser.add_argument("--max-size", type=int, nargs="+", default=[768, 1280, 0])
+    parser.add_argument("--scale", type=float, default=1.0, help="Fixture size")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", type=Path, help="Also write the fixtures here")
+    args = parser.parse_args()
+
+    images = fixtures(args.scale, args.seed)
+    if args.save:
+        args.save.mkdir(parents=True, exist_ok=True)
+        for name, (data, _, _) in images.items():
+            extension = name.split("_", 1)[0]
+            (args.save / f"{name}.{extension}").write_bytes(data)
+
+    problems: List[str] = []
+    print(
+        f"{'fixture':<28} {'MB':>5} {'max size':>8} {'ingest ms':>10} "
+        f"{'full ms':>8} {'output':>12}"
+    )
+    for name, (data, upright, marker) in images.items():
+        for max_size in args.max_size:
+            max_size = max_size or None
+            ingested = ingest_image(data, max_size)
+            problems.extend(
+                f"{name} at {max_size}: {p}"
+                for p in check(ingested.image, upright, marker, max_size)
+            )
+            ingest = median_ms(lambda: ingest_image(data, max_size), args.repeat)
+            full = median_ms(lambda: full_decode(data, max_size), args.repeat)
+            output = "x".join(map(str, ingested.size))
+            print(
+                f"{name:<28} {len(data) / 1e6:>5.1f} {str(max_size):>8} "
+                f"{ingest:>10.0f} {full:>8.0f} {output:>12}"
+            )
+
+    for problem in problems:
+        print(f"FAIL: {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import argparse
+import random
+import time
+from collections import Counter
+from typing import List
+
+import numpy as np
+
+from app.core.config import ConfigHandler
+from app.services.keyword_extractor import KeywordExtractor, KeywordVocabulary
+
+NOUNS = [
+    "teddy bear", "toy car", "dog", "cat", "coffee mug", "sunglasses", "backpack",
+    "water bottle", "sneaker", "laptop", "plush rabbit", "headphones", "robot",
+    "dinosaur figure", "lego brick", "rubber duck", "scissors", "umbrella", "guitar",
+    "bicycle", "potted plant", "wooden train", "doll", "football", "alarm clock",
+]  # fmt: skip
+
+
+def variant(noun: str, rng: random.Random) -> str:
+    """A spelling of `noun` as the model might return it."""
+    roll = rng.random()
+    if roll < 0.3:
+        return noun
+    if roll < 0.5:
+        return noun.title()
+    if roll < 0.65:
+        return noun + "s"
+    if roll < 0.75:
+        return noun.replace(" ", "-")
+    if roll < 0.85:
+        return f"  {noun.upper()} "
+    # A typo
+    i = rng.randrange(len(noun))
+    return noun[:i] + noun[i + 1 :]
+
+
+def synthetic_keywords(n: int, rng: random.Random) -> List[str]:
+    nouns = NOUNS + [f"object {i}" for i in range(n // 10)]
+    return [variant(rng.choice(nouns), rng) for _ in range(n)]
+
+
+def pairwise_reference(
+    items: List[str], threshold: float = 50, min_frequency: int = 1
+) -> List[str]:
+    """
+    The consolidation before vectorization: pairwise ratios of the raw items, with
+    fuzzywuzzy as it was when installed, else with the faster rapidfuzz ratio.
+    """
+    try:
+        from fuzzywuzzy import fuzz
+    except ImportError:
+        from rapidfuzz import fuzz
+
+    clusters = []
+    used_items = set()
+    for item in items:
+        if item in used_items:
+            continue
+        similar_items = [
+            i for i in items if i not in used_items and fuzz.ratio(item, i) >= threshold
+        ]
+        if len(similar_items) >= min_frequency:
+            clusters.append(similar_items)
+            used_items.update(similar_items)
+
+    unique_items = []
+    for cluster in clusters:
+        representative = max(cluster, key=Counter(items).get)
+        if not any(
+            fuzz.ratio(representative, existing) >= threshold
+            for existing in unique_items
+        ):
+            unique_items.append(representative)
+    return unique_items
+
+
+def median_ms(call, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) * 1e3
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Times the keyword consolidation of the extractor samples on "
+        "synthetic keyword lists, against the previous pairwise grouping."
+    )
+    parser.add_argument("--items", type=int, nargs="+", default=[10, 100, 500, 2000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--no-reference", action="store_true", help="Skip the slow pairwise version"
+    )
+    args = parser.parse_args()
+
+    # The consolidation settings of the configured extractor, without its model
+    config = ConfigHandler().get_model_config("gemini").get("keywords", {})
+    extractor = KeywordExtractor.__new__(KeywordExtractor)
+    extractor.match_threshold = config.get("match_threshold", 50)
+    extractor.min_frequency = config.get("min_frequency", 1)
+
+    rng = random.Random(args.seed)
+    print(f"{'items':>6} {'groups':>7} {'ms':>9} {'pairwise ms':>12} {'speedup':>8}")
+    for n in args.items:
+        items = synthetic_keywords(n, rng)
+
+        def consolidate():
+            # A fresh vocabulary, as for the first request of a server
+            extractor.vocabulary = KeywordVocabulary(
+                threshold=config.get("vocabulary_threshold", 90),
+                max_size=config.get("vocabulary_size", 2048),
+            )
+            return extractor._get_frequent_matched_items(items)
+
+        groups = len(consolidate())
+        current = median_ms(consolidate, args.repeat)
+        line = f"{n:>6} {groups:>7} {current:>9.2f}"
+        if not args.no_reference:
+            reference = median_ms(
+                lambda: pairwise_reference(items, extractor.match_threshold),
+                args.repeat,
+            )
+            line += f" {reference:>12.2f} {reference / current:>7.1f}x"
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from app.core.logging import setup_logging, stop_logging
+
+
+class Payload:
+    """What the log calls of one request carry."""
+
+    def __init__(self, rng: np.random.Generator):
+        self.image = Image.new("RGB", (1024, 768))
+        self.mask = np.zeros((768, 1024), dtype=bool)
+        self.boxes = rng.uniform(0, 1024, (50, 6)).astype(np.float32)
+        self.keywords = [f"keyword {i}" for i in range(12)]
+        self.descriptions = ["A plush toy version of the object. " * 20] * 8
+
+
+def replay_eager(logger: logging.Logger, p: Payload):
+    """The log calls of one request as they were: f-strings, task args at INFO."""
+    for i in range(12):
+        logger.info(f"Processing task with args {(p.image,)}, kwargs {{}}")
+        logger.info(f"Completed task {i} with {p.keywords}")
+    logger.debug(f"Detection results: {p.boxes}")
+    logger.debug(f"Segmentation mask: {p.mask}")
+    logger.info(f"Main object box: {p.boxes[0]}")
+    for description in p.descriptions:
+        logger.info(f"Description: {description}")
+
+
+def replay_lazy(logger: logging.Logger, p: Payload):
+    """The same calls with lazy arguments, task args at DEBUG."""
+    for i in range(12):
+        logger.log(
+            logging.DEBUG, "Processing task with args %s, kwargs %s", (p.image,), {}
+        )
+        logger.log(logging.INFO, "Completed task %s with %s", i, p.keywords)
+    logger.log(logging.DEBUG, "Detection results: %s", p.boxes)
+    logger.log(logging.DEBUG, "Segmentation mask: %s", p.mask)
+    logger.log(logging.INFO, "Main object box: %s", p.boxes[0])
+    for description in p.descriptions:
+        logger.log(logging.INFO, "Description: %s", description)
+
+
+def measure(logger: logging.Logger, replay, payload: Payload, requests: int):
+    timings = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        replay(logger, payload)
+        timings.append(time.perf_counter() - start)
+    timings = np.asarray(timings) * 1e3
+    p50, p99 = np.percentile(timings, [50, 99])
+    return f"mean {timings.mean():.2f}ms, p50 {p50:.2f}ms, p99 {p99:.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measures the logging time on the calling thread of one "
+        "request's log calls: synchronous handlers with f-strings against the "
+        "queued handler with lazy arguments."
+    )
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    payload = Payload(np.random.default_rng(args.seed))
+    directory = Path(tempfile.mkdtemp())
+    # Console output goes to /dev/null, the handlers still format and write it
+    devnull = open(os.devnull, "w")
+
+    formatter = logging.Formatter(
+        "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+    )
+    sync_logger = logging.getLogger("bench_logging.sync")
+    sync_logger.setLevel(logging.INFO)
+    sync_logger.propagate = False
+    for handler in (
+        logging.FileHandler(directory / "sync.log"),
+        logging.StreamHandler(devnull),
+    ):
+        handler.setFormatter(formatter)
+        sync_logger.addHandler(handler)
+    result = measure(sync_logger, replay_eager, payload, args.requests)
+    print(f"synchronous, f-strings: {result}")
+
+    stderr, sys.stderr = sys.stderr, devnull
+    try:
+        # No rate limit, every record is written as in the synchronous case
+        logger = setup_logging(directory / "queued.log", "INFO", rate_limit=None)
+    finally:
+        sys.stderr = stderr
+    result = measure(logger, replay_lazy, payload, args.requests)
+    print(f"queued, lazy:           {result}")
+
+    start = time.perf_counter()
+    stop_logging()
+    print(f"queue drained in {(time.perf_counter() - start) * 1e3:.0f}ms")
+    for name in ("sync.log", "queued.log"):
+        print(f"{name}: {(directory / name).stat().st_size / 1e6:.1f} MB")
+        (directory / name).unlink()
+    directory.rmdir()
+    devnull.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from app.services.perceptual_index import PerceptualIndex, _popcount
+
+
+def noisy(image_hash: int, bits: int, rng: np.random.Generator) -> int:
+    for position in rng.choice(64, bits, replace=False):
+        image_hash ^= 1 << int(position)
+    return image_hash
+
+
+def percentiles_us(timings) -> str:
+    p50, p99 = np.percentile(timings, [50, 99]) * 1e6
+    return f"p50 {p50:.0f}us, p99 {p99:.0f}us"
+
+
+def verify(
+    index: PerceptualIndex,
+    hashes: np.ndarray,
+    queries: list,
+    max_distance: int,
+):
+    """Searches every query and compares the distance with brute force."""
+    timings, mismatches, hits = [], 0, 0
+    for query in queries:
+        start = time.perf_counter()
+        match = index.search(query)
+        timings.append(time.perf_counter() - start)
+
+        nearest = int(_popcount(hashes ^ np.uint64(query)).min())
+        expected = nearest if nearest <= max_distance else None
+        found = None if match is None else match[1]
+        mismatches += found != expected
+        hits += found is not None
+    return timings, mismatches, hits
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fills a perceptual index with random hashes and times "
+        "near-duplicate lookups, verified against a brute-force scan."
+    )
+    parser.add_argument("--entries", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--max-distance", type=int, default=6)
+    parser.add_argument(
+        "--disk", action="store_true", help="Use index files and time a reload"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    hashes = rng.integers(0, 2**64, args.entries, dtype=np.uint64)
+    directory = tempfile.mkdtemp() if args.disk else None
+    record = {"profile": "bench"}
+
+    try:
+        index = PerceptualIndex(directory, max_distance=args.max_distance)
+        start = time.perf_counter()
+        for image_hash in hashes.tolist():
+            index.add(image_hash, record)
+        insert = time.perf_counter() - start
+        print(
+            f"insert {args.entries} entries: {insert:.1f}s "
+            f"({insert / args.entries * 1e6:.1f}us each)"
+        )
+
+        # Half near-duplicates of stored entries, half random misses
+        targets = rng.choice(hashes, args.queries // 2).tolist()
+        queries = [
+            noisy(h, int(rng.integers(0, args.max_distance + 1)), rng) for h in targets
+        ]
+        queries.extend(
+            rng.integers(0, 2**64, args.queries - len(queries), np.uint64).tolist()
+        )
+
+        failed = False
+        indexes = [("search", index)]
+        if directory is not None:
+            index.close()
+            start = time.perf_counter()
+            reloaded = PerceptualIndex(directory, max_distance=args.max_distance)
+            print(f"reload: {time.perf_counter() - start:.2f}s")
+            indexes = [("search after reload", reloaded)]
+
+        for name, searched in indexes:
+            timings, mismatches, hits = verify(
+                searched, hashes, queries, args.max_distance
+            )
+            print(
+                f"{name}: {percentiles_us(timings)}, {hits}/{len(queries)} hits, "
+                f"{mismatches} differ from brute force"
+            )
+            failed |= mismatches > 0
+            searched.close()
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
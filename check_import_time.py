@@ -0,0 +1,74 @@
+import argparse
+import re
+import subprocess
+import sys
+from typing import List, Tuple
+
+# Loaded by the models and the Gemini services when they are built, never on import
+HEAVY_MODULES = ("torch", "ultralytics", "google.generativeai", "google.genai")
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module: str) -> List[Tuple[str, int, int]]:
+    """(module, self us, cumulative us) of every import of a fresh interpreter."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    times = []
+    errors = []
+    for line in process.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            times.append((match.group(4), int(match.group(1)), int(match.group(2))))
+        elif not line.startswith("import time:"):
+            errors.append(line)
+    if process.returncode:
+        raise RuntimeError(f"import {module} failed:\n" + "\n".join(errors))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Fails if importing the API module takes longer than the "
+        "budget or loads torch, ultralytics or the Gemini SDK."
+    )
+    parser.add_argument("--module", default="app.api.routes")
+    parser.add_argument("--budget-ms", type=float, default=1000)
+    parser.add_argument("--top", type=int, default=10, help="Slowest imports shown")
+    args = parser.parse_args()
+
+    try:
+        times = import_times(args.module)
+    except RuntimeError as e:
+        print(e)
+        sys.exit(2)
+
+    total_ms = next(cum for name, _, cum in times if name == args.module) / 1000
+    heavy = sorted(
+        {
+            name
+            for name, _, _ in times
+            if any(name == m or name.startswith(m + ".") for m in HEAVY_MODULES)
+        }
+    )
+
+    print(f"import {args.module}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    print(f"{'cumulative ms':>14} {'self ms':>8}  module")
+    for name, self_us, cumulative_us in sorted(times, key=lambda t: -t[2])[: args.top]:
+        print(f"{cumulative_us / 1000:>14.1f} {self_us / 1000:>8.1f}  {name}")
+
+    failed = False
+    if heavy:
+        print(f"FAIL: heavy modules imported: {', '.join(heavy)}")
+        failed = True
+    if total_ms > args.budget_ms:
+        print(f"FAIL: {total_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,54 @@
-import httpx
-import traceback
+import argparse
+import asyncio
 import base64
+import csv
+import json
+import mimetypes
+import random
+import time
+import traceback
+from collections import Counter
+from dataclasses import dataclass, asdict
 from io import BytesIO
+from pathlib import Path
+from typing import List, Union
+
+import httpx
 from PIL import Image
 
 # URL of the FastAPI server
-BASE_URL = "http://127.0.0.1:8000"  # Update this with the actual server URL
+BASE_URL = "http://127.0.0.1:8001"  # Update this with the actual server URL
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
 
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120, 300)
 
-async def upload_image(file_path: str):
+
+@dataclass
+class RequestRecord:
+    file: str
+    start: float
+    latency: float
+    status: Union[int, None]
+    success: bool
+    error: Union[str, None] = None
+
+
+async def upload_image(file_path: str, client: Union[httpx.AsyncClient, None] = None):
     """Uploads an image to the /transform endpoint and handles the response."""
     url = f"{BASE_URL}/transform"
     print(url)
     try:
         # Open the image file in binary mode
         with open(file_path, "rb") as image_file:
-            files = {"file": (file_path, image_file, "image/jpeg")}
+            files = {"file": (file_path, image_file, _content_type(file_path))}
 
-            # Send a POST request to the API
-            async with httpx.AsyncClient(timeout=500) as client:
+            # Send a POST request to the API, reusing the caller's client if given
+            if client is None:
+                async with httpx.AsyncClient(timeout=500) as client:
+                    response = await client.post(url, files=files)
+            else:
                 response = await client.post(url, files=files)
 
             # Check the response status
@@ -41,9 +71,310 @@ async def upload_image(file_path: str):
         traceback.print_exc()
 
 
-# Example usage
+def _content_type(file_path: Union[str, Path]) -> str:
+    content_type, _ = mimetypes.guess_type(str(file_path))
+    return content_type or "image/jpeg"
+
+
+def collect_images(image_dir: Union[str, Path]) -> List[Path]:
+    """Returns every image file under the given directory, sorted by path."""
+    image_dir = Path(image_dir)
+    if image_dir.is_file():
+        return [image_dir]
+    return sorted(
+        p
+        for p in image_dir.rglob("*")
+        if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS
+    )
+
+
+class LoadGenerator:
+    """
+    Drives the /transform endpoint with a pooled client and records the latency and
+    status of every request.
+
+    closed-loop: `concurrency` virtual users each send the next request as soon as their
+    previous one finishes.
+    open-loop: requests arrive at a fixed `rate` per second (Poisson by default)
+    regardless of how fast the server answers, so queueing delay shows up in latency.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        images: List[Path],
+        timeout: float = 500,
+        max_connections: int = 100,
+    ):
+        if not images:
+            raise ValueError("No images to send")
+        self.url = f"{base_url.rstrip('/')}/transform"
+        self.images = images
+        # Payloads are read once so disk I/O does not show up in the measurements
+        self.payloads = {p: p.read_bytes() for p in images}
+        self.client = httpx.AsyncClient(
+            timeout=timeout,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+        )
+        self.records: List[RequestRecord] = []
+        self._started_at = 0.0
+
+    async def close(self):
+        await self.client.aclose()
+
+    async def _send(self, image_path: Path):
+        files = {
+            "file": (
+                image_path.name,
+                self.payloads[image_path],
+                _content_type(image_path),
+            )
+        }
+        start = time.perf_counter()
+        status, success, error = None, False, None
+        try:
+            response = await self.client.post(self.url, files=files)
+            status = response.status_code
+            if status == 200:
+                data = response.json()
+                success = bool(data.get("success"))
+                if not success:
+                    error = data.get("error") or "success=false"
+            else:
+                try:
+                    error = response.json().get("detail")
+                except ValueError:
+                    error = None
+                error = f"HTTP {status}: {error}" if error else f"HTTP {status}"
+        except httpx.TimeoutException:
+            error = "timeout"
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+        latency = time.perf_counter() - start
+
+        self.records.append(
+            RequestRecord(
+                file=str(image_path),
+                start=start - self._started_at,
+                latency=latency,
+                status=status,
+                success=success,
+                error=error,
+            )
+        )
+
+    async def run_closed_loop(self, concurrency: int, total_requests: int):
+        self._started_at = time.perf_counter()
+        counter = iter(range(total_requests))
+
+        async def user():
+            for i in counter:
+                await self._send(self.images[i % len(self.images)])
+
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+
+    async def run_open_loop(
+        self, rate: float, total_requests: int, poisson: bool = True
+    ):
+        self._started_at = time.perf_counter()
+        tasks = []
+        next_arrival = self._started_at
+        for i in range(total_requests):
+            delay = next_arrival - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(
+                asyncio.create_task(self._send(self.images[i % len(self.images)]))
+            )
+            interval = random.expovariate(rate) if poisson else 1.0 / rate
+            next_arrival += interval
+        await asyncio.gather(*tasks)
+
+    @property
+    def elapsed(self) -> float:
+        if not self.records:
+            return 0.0
+        return max(r.start + r.latency for r in self.records)
+
+    def summary(self) -> dict:
+        latencies = sorted(r.latency for r in self.records)
+        ok = [r for r in self.records if r.success]
+        errors = Counter(r.error for r in self.records if not r.success)
+
+        def pct(p: float) -> Union[float, None]:
+            if not latencies:
+                return None
+            return latencies[
+                min(len(latencies) - 1, int(round(p * (len(latencies) - 1))))
+            ]
+
+        return {
+            "requests": len(self.records),
+            "successes": len(ok),
+            "errors": dict(errors),
+            "elapsed_s": self.elapsed,
+            "throughput_rps": len(self.records) / self.elapsed if self.elapsed else 0.0,
+            "latency_s": {
+                "min": latencies[0] if latencies else None,
+                "mean": sum(latencies) / len(latencies) if latencies else None,
+                "p50": pct(0.50),
+                "p90": pct(0.90),
+                "p95": pct(0.95),
+                "p99": pct(0.99),
+                "max": latencies[-1] if latencies else None,
+            },
+            "status_codes": dict(Counter(str(r.status) for r in self.records)),
+        }
+
+    def print_report(self, slo: Union[float, None] = None):
+        summary = self.summary()
+        print(
+            f"\nRequests: {summary['requests']}  Successes: {summary['successes']}  "
+            f"Elapsed: {summary['elapsed_s']:.2f}s  "
+            f"Throughput: {summary['throughput_rps']:.2f} req/s"
+        )
+
+        print("\nLatency (s):")
+        for key, value in summary["latency_s"].items():
+            print(f"  {key:>4}: {value:.3f}" if value is not None else f"  {key:>4}: -")
+
+        print("\nLatency histogram:")
+        counts = Counter()
+        for r in self.records:
+            bucket = next((b for b in LATENCY_BUCKETS if r.latency <= b), None)
+            counts[bucket] += 1
+        width = max(counts.values(), default=0)
+        lower = 0
+        for bucket in LATENCY_BUCKETS + (None,):
+            label = (
+                f"{lower:>5}-{bucket:<5}" if bucket is not None else f"{lower:>5}+     "
+            )
+            bar = "#" * int(40 * counts[bucket] / width) if width else ""
+            print(f"  {label} s | {counts[bucket]:>6} {bar}")
+            lower = bucket
+
+        print("\nStatus codes:")
+        for status, count in sorted(summary["status_codes"].items()):
+            print(f"  {status}: {count}")
+
+        if summary["errors"]:
+            print("\nErrors:")
+            for error, count in Counter(summary["errors"]).most_common():
+                print(f"  {count:>6}  {error}")
+
+        if slo is not None and self.records:
+            within = sum(1 for r in self.records if r.success and r.latency <= slo)
+            print(
+                f"\nSLO {slo}s: {within}/{len(self.records)} "
+                f"({100 * within / len(self.records):.1f}%) successful within target"
+            )
+
+    def write_csv(self, path: Union[str, Path]):
+        with open(path, "w", newline="") as f:
+            writer = csv.DictWriter(
+                f, fieldnames=list(RequestRecord.__dataclass_fields__)
+            )
+            writer.writeheader()
+            for record in self.records:
+                writer.writerow(asdict(record))
+
+    def write_json(self, path: Union[str, Path]):
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "summary": self.summary(),
+                    "records": [asdict(r) for r in self.records],
+                },
+                f,
+                indent=2,
+            )
+
+
+async def run_load_test(args: argparse.Namespace):
+    images = collect_images(args.images)
+    total_requests = args.requests or len(images)
+    generator = LoadGenerator(
+        args.url, images, timeout=args.timeout, max_connections=args.max_connections
+    )
+    try:
+        if args.mode == "closed":
+            print(
+                f"Closed loop: {args.concurrency} users, {total_requests} requests "
+                f"over {len(images)} images"
+            )
+            await generator.run_closed_loop(args.concurrency, total_requests)
+        else:
+            print(
+                f"Open loop: {args.rate} req/s, {total_requests} requests "
+                f"over {len(images)} images"
+            )
+            await generator.run_open_loop(
+                args.rate, total_requests, poisson=not args.uniform
+            )
+    finally:
+        await generator.close()
+
+    generator.print_report(slo=args.slo)
+    if args.csv:
+        generator.write_csv(args.csv)
+        print(f"\nPer-request records written to {args.csv}")
+    if args.json:
+        generator.write_json(args.json)
+        print(f"Summary written to {args.json}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Toy Transformer API client")
+    parser.add_argument("images", help="Image file or directory of images to upload")
+    parser.add_argument("--url", default=BASE_URL, help="Base URL of the server")
+    parser.add_argument(
+        "--mode",
+        choices=("single", "closed", "open"),
+        default="single",
+        help="single: upload one image and show the result; "
+        "closed: N concurrent users; open: fixed arrival rate",
+    )
+    parser.add_argument(
+        "--concurrency", type=int, default=4, help="Users for closed-loop mode"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=1.0, help="Arrivals per second for open-loop mode"
+    )
+    parser.add_argument(
+        "--uniform",
+        action="store_true",
+        help="Use evenly spaced arrivals instead of Poisson in open-loop mode",
+    )
+    parser.add_argument(
+        "--requests",
+        type=int,
+        default=None,
+        help="Total requests to send (default: one per image)",
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=500, help="Per-request timeout"
+    )
+    parser.add_argument(
+        "--max-connections", type=int, default=100, help="Connection pool size"
+    )
+    parser.add_argument(
+        "--slo", type=float, default=None, help="Latency target in seconds to check"
+    )
+    parser.add_argument("--csv", default=None, help="Write per-request records to CSV")
+    parser.add_argument(
+        "--json", default=None, help="Write summary and records to JSON"
+    )
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    import asyncio
+    args = parse_args()
 
-    # Replace 'example.jpg' with the path to your image file
-    asyncio.run(upload_image("chau-cay-tung-bong-lai-dia-lot-binh-hoa-1.jpg"))
+    if args.mode == "single":
+        BASE_URL = args.url
+        asyncio.run(upload_image(str(collect_images(args.images)[0])))
+    else:
+        asyncio.run(run_load_test(args))
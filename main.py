@@ -1,3 +1,8 @@
+import time
+
+# Measured before the heavy imports so time-to-listen covers them
+STARTED_AT = time.perf_counter()
+
 from pathlib import Path
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -26,7 +31,7 @@ app.mount(
 )
 
 # Include routes from routes.py
-image_transform = ImageTransformRouter()
+image_transform = ImageTransformRouter(started_at=STARTED_AT)
 app.include_router(image_transform.router)
 
 if __name__ == "__main__":
@@ -35,4 +40,30 @@ if __name__ == "__main__":
     host = config.get_api_config()["host"]
     port = config.get_api_config()["port"]
 
-    uvicorn.run(f"{Path(__file__).stem}:app", host=host, port=port, reload=True)
+    reload = config.get_api_config().get("reload", False)
+    workers = config.get_api_config().get("workers", 1)
+
+    if workers > 1 and config.get_api_config().get("preload", True) and not reload:
+        from app.core.prefork import PreforkServer
+
+        # Models load once here and are shared copy-on-write by the workers
+        PreforkServer(
+            app,
+            host=host,
+            port=port,
+            workers=workers,
+            preload=image_transform.processor.load_local_models,
+            after_fork=image_transform.processor.after_fork,
+            torch_threads=config.get_api_config().get("torch_threads"),
+            memory_report_interval=config.get_api_config().get(
+                "memory_report_interval", 60
+            ),
+        ).run()
+    else:
+        uvicorn.run(
+            f"{Path(__file__).stem}:app",
+            host=host,
+            port=port,
+            reload=reload,
+            workers=None if reload else workers,
+        )
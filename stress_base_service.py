@@ -0,0 +1,120 @@
+import argparse
+import asyncio
+import logging
+import random
+import sys
+import time
+from collections import Counter
+from typing import Any, List, Tuple
+
+from app.core.deadline import Deadline, DeadlineExceeded
+from app.core.gemini_governor import GeminiGovernor
+from app.services.base_service import BaseService
+
+
+class FakeService(BaseService):
+    """Samples that sleep a random latency and fail at `failure_rate`."""
+
+    def __init__(self, latency: float, failure_rate: float, concurrency: int):
+        super().__init__(
+            {},
+            prompt_manager=None,
+            prompt_type="stress",
+            governor=GeminiGovernor(
+                initial_concurrency=concurrency, max_concurrency=concurrency
+            ),
+            backoff_base=latency / 4,
+        )
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(0)
+        self.succeeded: Counter = Counter()
+
+    async def forward(self, call_id: int):
+        await asyncio.sleep(self.rng.expovariate(1 / self.latency))
+        if self.rng.random() < self.failure_rate:
+            raise RuntimeError(f"sample of call {call_id} failed")
+        self.succeeded[call_id] += 1
+        return call_id
+
+    def process_results(self, results: List[Any]) -> List[Any]:
+        return results
+
+
+async def run_call(
+    service: FakeService, call_id: int, samples: int, timeout: float, start_delay: float
+) -> Tuple[int, int, List[Any], bool]:
+    await asyncio.sleep(start_delay)
+    deadline = Deadline(timeout) if timeout else None
+    try:
+        results = await service(call_id, max_total_tasks=samples, deadline=deadline)
+    except DeadlineExceeded:
+        return call_id, samples, [], True
+    return call_id, samples, results, False
+
+
+async def stress(args) -> List[str]:
+    service = FakeService(args.latency, args.failure_rate, args.concurrency)
+    rng = random.Random(args.seed)
+    calls = [
+        run_call(
+            service,
+            call_id,
+            rng.randint(1, args.max_samples),
+            # Some calls run out of time and cancel their own tasks only
+            args.latency * rng.uniform(0.5, 3) if rng.random() < args.deadlines else 0,
+            rng.uniform(0, args.latency * 2),
+        )
+        for call_id in range(args.calls)
+    ]
+    outcomes = await asyncio.gather(*calls)
+
+    problems = []
+    for call_id, samples, results, timed_out in outcomes:
+        if any(result != call_id for result in results):
+            problems.append(f"call {call_id} got results of other calls: {results}")
+        if len(results) > samples:
+            problems.append(f"call {call_id} got {len(results)} of {samples} samples")
+        if not timed_out and len(results) != service.succeeded[call_id]:
+            problems.append(
+                f"call {call_id} returned {len(results)} results, "
+                f"{service.succeeded[call_id]} samples succeeded"
+            )
+        if not timed_out and not args.failure_rate and len(results) != samples:
+            problems.append(f"call {call_id} got {len(results)} of {samples} samples")
+    timed_out = sum(outcome[3] for outcome in outcomes)
+    print(
+        f"{args.calls} calls, {sum(service.succeeded.values())} samples succeeded, "
+        f"{timed_out} calls out of time"
+    )
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Runs many overlapping calls of one shared BaseService with "
+        "random latencies, failures and deadlines, and checks that every call gets "
+        "exactly its own samples."
+    )
+    parser.add_argument("--calls", type=int, default=300)
+    parser.add_argument("--max-samples", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.02, help="Mean, seconds")
+    parser.add_argument("--failure-rate", type=float, default=0.2)
+    parser.add_argument("--deadlines", type=float, default=0.2, help="Share of calls")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    # The service logs every call and failure
+    logging.getLogger("toy_transformer").setLevel(logging.CRITICAL)
+
+    start = time.perf_counter()
+    problems = asyncio.run(stress(args))
+    print(f"{time.perf_counter() - start:.1f}s, {len(problems)} problems")
+    for problem in problems[:20]:
+        print(f"  {problem}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()